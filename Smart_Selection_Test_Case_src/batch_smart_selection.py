@@ -0,0 +1,186 @@
+"""
+Smart Selection'ı tarayıcı açmadan, tüm (process_title, selected_category, selected_test_type)
+kombinasyonları için toplu olarak çalıştıran komut satırı aracı.
+
+Kullanım:
+    python batch_smart_selection.py --workers 4 --output mongo
+    python batch_smart_selection.py --output jsonl --jsonl-path results.jsonl --process-title Process_A
+
+Sonuçlar MongoDB'deki smart_selection_results koleksiyonuna (kombinasyon başına bir doküman)
+ya da her satırı bir kombinasyon olan bir JSONL dosyasına yazılır. Her kombinasyon için
+çift/saniye ve case/saniye verimi raporlanır.
+"""
+
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from smart_selection import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_CLUSTER_SIMILARITY,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_MIN_SIMILARITY,
+    DEFAULT_NEAR_DUPLICATE_DISTANCE,
+    DEFAULT_TOP_K,
+    PairVerdictCache,
+    TestCase,
+    TestCaseList,
+    aggregate_valid_combinations,
+    combination_filter,
+    db,
+    ensure_combination_index,
+    extract_test_cases,
+    fetch_details_by_combination,
+    run_incremental_smart_selection,
+)
+
+results_collection = db["smart_selection_results"]  # Toplu çalıştırma sonuçları
+
+def run_combination(combination, options, incremental=False, include_logs=False):
+    """
+    Tek bir kombinasyonun test case'lerini getirir, Smart Selection'ı çalıştırır ve
+    sonuçla birlikte verim metriklerini içeren bir sözlük döndürür.
+    Karşılaştırma logları yalnızca include_logs verilirse JSON'a dönüştürülür.
+    Çift sayısı karşılaştırma loglarından hesaplanır (cluster modunda bir küme üyelerinin tüm ikililerini sayar),
+    başarısız karşılaştırmalar logging ile raporlanır.
+    """
+    details = fetch_details_by_combination(**combination)
+    test_cases = []
+    for item in extract_test_cases(details):
+        try:
+            test_cases.append(TestCase(**item))
+        except Exception as e:
+            logging.warning(f"Skipping invalid test case: {item}. Error: {e}")
+
+    # Her kombinasyon kendi önbellek sayaçlarıyla çalışır
+    run_options = dict(options)
+    if run_options.pop("use_cache"):
+        run_options["verdict_cache"] = PairVerdictCache()
+
+    start = time.perf_counter()
+    if incremental:
+        result = run_incremental_smart_selection(
+            combination["process_title"], combination["selected_category"], combination["selected_test_type"],
+            test_cases, **run_options
+        )
+    else:
+        result = TestCaseList(test_cases=test_cases).smart_select(**run_options)
+    elapsed = time.perf_counter() - start
+
+    pairs = result.compared_pairs()
+    return {
+        **combination,
+        "unique_test_cases": [case.model_dump() for case in result.test_cases],
+        "similar_test_cases": result.duplicates,
+        "comparison_logs": result.export_comparison_logs() if include_logs else [],
+        "tier_stats": result.tier_stats,
+        "cache_stats": result.cache_stats,
+        "metrics": {
+            "test_cases": len(test_cases),
+            "unique_test_cases": len(result.test_cases),
+            "pairs": pairs,
+            "seconds": round(elapsed, 3),
+            "pairs_per_second": round(pairs / elapsed, 2) if elapsed else 0.0,
+            "cases_per_second": round(len(test_cases) / elapsed, 2) if elapsed else 0.0,
+        },
+        "finished_at": datetime.now().isoformat(),
+    }
+
+def save_result_to_mongo(result):
+    """
+    Kombinasyonun sonucunu smart_selection_results koleksiyonuna yazar (varsa üzerine yazar).
+    """
+    results_collection.update_one(
+        combination_filter(result["process_title"], result["selected_category"], result["selected_test_type"]),
+        {"$set": result},
+        upsert=True
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Smart Selection for many combinations without the Streamlit UI.")
+    parser.add_argument("--workers", type=int, default=2, help="combinations processed in parallel")
+    parser.add_argument("--llm-workers", type=int, default=DEFAULT_MAX_WORKERS, help="concurrent LLM comparisons per combination")
+    parser.add_argument("--mode", choices=["greedy", "cluster"], default="greedy")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="0 disables the candidate limit")
+    parser.add_argument("--min-similarity", type=float, default=DEFAULT_MIN_SIMILARITY)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--near-duplicate-distance", type=int, default=DEFAULT_NEAR_DUPLICATE_DISTANCE,
+                        help="max SimHash bit difference collapsed without the LLM")
+    parser.add_argument("--cluster-similarity", type=float, default=DEFAULT_CLUSTER_SIMILARITY,
+                        help="cosine similarity that links two cases into a cluster (cluster mode)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the verdict cache")
+    parser.add_argument("--incremental", action="store_true", help="only process test cases added since the last run")
+    parser.add_argument("--process-title", action="append", help="only run the given process title (repeatable)")
+    parser.add_argument("--output", choices=["mongo", "jsonl"], default="mongo")
+    parser.add_argument("--jsonl-path", default="smart_selection_results.jsonl")
+    parser.add_argument("--include-logs", action="store_true", help="also write the comparison logs")
+    args = parser.parse_args()
+    if args.incremental and args.mode != "greedy":
+        parser.error("--incremental is only supported in greedy mode")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    ensure_combination_index()
+    combinations = aggregate_valid_combinations()
+    if args.process_title:
+        combinations = [entry for entry in combinations if entry["process_title"] in args.process_title]
+    logging.info(f"{len(combinations)} combinations to process")
+
+    options = {
+        "top_k": args.top_k or None,
+        "min_similarity": args.min_similarity,
+        "max_workers": args.llm_workers,
+        "batch_size": args.batch_size,
+        "near_duplicate_distance": args.near_duplicate_distance,
+        "mode": args.mode,
+        "cluster_similarity": args.cluster_similarity,
+        "use_cache": not args.no_cache,
+    }
+
+    jsonl_file = open(args.jsonl_path, "a", encoding="utf-8") if args.output == "jsonl" else None
+    total_cases = total_pairs = 0
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = {
+                executor.submit(run_combination, combination, options, args.incremental, args.include_logs): combination
+                for combination in combinations
+            }
+            for future in as_completed(futures):
+                combination = futures[future]
+                label = f"{combination['process_title']} - {combination['selected_test_type']} - {combination['selected_category']}"
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"{label}: Smart Selection failed: {e}")
+                    continue
+
+                if jsonl_file:
+                    jsonl_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    jsonl_file.flush()
+                else:
+                    save_result_to_mongo(result)
+
+                metrics = result["metrics"]
+                total_cases += metrics["test_cases"]
+                total_pairs += metrics["pairs"]
+                logging.info(
+                    f"{label}: {metrics['test_cases']} cases -> {metrics['unique_test_cases']} unique, "
+                    f"{metrics['pairs']} pairs in {metrics['seconds']}s "
+                    f"({metrics['pairs_per_second']} pairs/s, {metrics['cases_per_second']} cases/s)"
+                )
+    finally:
+        if jsonl_file:
+            jsonl_file.close()
+
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Done: {len(combinations)} combinations, {total_cases} cases, {total_pairs} pairs in {elapsed:.1f}s "
+        f"({total_pairs / elapsed if elapsed else 0:.2f} pairs/s, {total_cases / elapsed if elapsed else 0:.2f} cases/s)"
+    )
+
+if __name__ == "__main__":
+    main()
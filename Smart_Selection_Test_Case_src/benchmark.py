@@ -0,0 +1,330 @@
+"""
+Smart Selection için performans ölçümleri.
+
+Kullanım:
+    python benchmark.py combinations --sessions 100000
+    python benchmark.py memory --cases 1000
+    python benchmark.py judge --pairs 50
+
+Mongo kullanan alt komutlar kendi verisini MONGO_URI üzerindeki ayrı bir benchmark veritabanına yazar
+ve ölçüm sonunda bu veritabanını siler; uygulamanın kullandığı veritabanına dokunulmaz.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+from ollama import Client as OllamaClient
+
+# Stub sunucu iki araç tarafından paylaşılır (depo kökündeki tools/stub_ollama.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import stub_ollama
+from smart_selection import (
+    COMBINATION_FIELDS,
+    DEFAULT_TOP_K,
+    PAIR_RESPONSE_SCHEMA,
+    SIMILARITY_MODEL,
+    SimilarityJudge,
+    TestCase,
+    TestCaseList,
+    aggregate_valid_combinations,
+    client,
+    ensure_combination_index,
+)
+
+BENCHMARK_DB = "smart_selection_benchmark"
+
+def timed(function, repeat):
+    """
+    function'ı repeat kez çalıştırır; (son sonuç, en iyi süre ms, ortalama süre ms) döndürür.
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return result, min(durations), sum(durations) / len(durations)
+
+##############################
+# combinations alt komutu    #
+##############################
+
+def legacy_fetch_valid_combinations(sessions_collection):
+    """
+    Aggregation öncesi uygulama: tüm session'ları okuyup null değerleri Python'da filtreler.
+    """
+    data = sessions_collection.find(
+        {},
+        {"process_title": 1, "selected_category": 1, "selected_test_type": 1}
+    )
+    return [
+        {field: entry.get(field) for field in COMBINATION_FIELDS}
+        for entry in data
+        if all(entry.get(field) is not None for field in COMBINATION_FIELDS)
+    ]
+
+def seed_sessions(sessions_collection, session_count, process_count, seed=42, batch_size=10000):
+    """
+    Gerçekçi dağılımda session dokümanları üretir: çoğu session bir kombinasyona sahiptir,
+    bir kısmında alanlar null ya da eksiktir, model_output alanı da doldurulur.
+    """
+    rng = random.Random(seed)
+    categories = ["Functional", "Non-Functional"]
+    test_types = ["Functional Testing", "Integration Testing", "Security Testing", "Compatibility Testing"]
+
+    batch = []
+    for index in range(session_count):
+        document = {"session_id": f"bench_{index:08d}", "original_prompts": [], "model_output": {"TestScenarios": []}}
+        roll = rng.random()
+        if roll < 0.8:
+            document["process_title"] = f"Process_{rng.randrange(process_count)}"
+            document["selected_category"] = rng.choice(categories)
+            document["selected_test_type"] = rng.choice(test_types)
+        elif roll < 0.9:
+            document["process_title"] = f"Process_{rng.randrange(process_count)}"
+            document["selected_category"] = None
+        batch.append(document)
+
+        if len(batch) == batch_size:
+            sessions_collection.insert_many(batch)
+            batch = []
+    if batch:
+        sessions_collection.insert_many(batch)
+
+def run_combinations_benchmark(args):
+    database = client[args.database]
+    sessions_collection = database["sessions"]
+    sessions_collection.drop()
+
+    print(f"Seeding {args.sessions} sessions into {args.database}.sessions ...")
+    seed_sessions(sessions_collection, args.sessions, args.processes)
+
+    try:
+        legacy, legacy_best, legacy_avg = timed(lambda: legacy_fetch_valid_combinations(sessions_collection), args.repeat)
+        unindexed, unindexed_best, unindexed_avg = timed(lambda: aggregate_valid_combinations(sessions_collection), args.repeat)
+        ensure_combination_index(sessions_collection)
+        indexed, indexed_best, indexed_avg = timed(lambda: aggregate_valid_combinations(sessions_collection), args.repeat)
+
+        print(f"{'variant':<32}{'rows':>10}{'best ms':>12}{'avg ms':>12}")
+        print(f"{'find + Python filter (legacy)':<32}{len(legacy):>10}{legacy_best:>12.1f}{legacy_avg:>12.1f}")
+        print(f"{'aggregation, no index':<32}{len(unindexed):>10}{unindexed_best:>12.1f}{unindexed_avg:>12.1f}")
+        print(f"{'aggregation + compound index':<32}{len(indexed):>10}{indexed_best:>12.1f}{indexed_avg:>12.1f}")
+
+        unique_legacy = {tuple(row[field] for field in COMBINATION_FIELDS) for row in legacy}
+        unique_indexed = {tuple(row[field] for field in COMBINATION_FIELDS) for row in indexed}
+        print(f"Same unique combinations: {unique_legacy == unique_indexed}")
+    finally:
+        if not args.keep:
+            client.drop_database(args.database)
+
+##############################
+# memory alt komutu          #
+##############################
+
+MEMORY_VOCABULARY = (
+    "login user password account session token order payment cart invoice report export import "
+    "search filter upload download profile settings notification email permission role admin "
+    "validate verify error message timeout retry page form field button api request response"
+).split()
+
+def make_memory_cases(count, duplicate_ratio, seed=42):
+    """
+    count adet sentetik test case üretir; duplicate_ratio oranındaki case'ler daha önceki bir case'in
+    başlığını koruyup açıklamasını biraz değiştiren kopyalarıdır.
+    """
+    rng = random.Random(seed)
+    cases = []
+    for index in range(count):
+        if cases and rng.random() < duplicate_ratio:
+            original = rng.choice(cases)
+            words = original.Description.split()
+            words[rng.randrange(len(words))] = rng.choice(MEMORY_VOCABULARY)
+            description = " ".join(words)
+            title, objective = original.Title, original.Objective
+        else:
+            title = f"Verify {' '.join(rng.sample(MEMORY_VOCABULARY, 3))} flow {index}"
+            description = " ".join(rng.choice(MEMORY_VOCABULARY) for _ in range(40))
+            objective = "Ensure " + " ".join(rng.choice(MEMORY_VOCABULARY) for _ in range(15))
+        cases.append(TestCase(
+            ScenarioID=f"TS_{index // 10:04d}",
+            TestCaseID=f"TC_{index:05d}",
+            Title=title,
+            Description=description,
+            Objective=objective
+        ))
+    return cases
+
+def stub_similarity(case1, case2, verdict_cache=None):
+    """
+    Ollama yerine kullanılan deterministik hakem: başlıkları aynı olan case'ler aynı kabul edilir.
+    """
+    return case1.Title.casefold() == case2.Title.casefold()
+
+def run_memory_benchmark(args):
+    cases = make_memory_cases(args.cases, args.duplicate_ratio)
+    TestCaseList._query_llm_similarity = staticmethod(stub_similarity)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = TestCaseList(test_cases=cases).smart_select(
+        top_k=args.top_k or None, max_workers=args.workers, near_duplicate_distance=None
+    )
+    elapsed = time.perf_counter() - start
+    run_current, run_peak = tracemalloc.get_traced_memory()
+
+    # İndirme anında olduğu gibi logları tam JSON'a dönüştür
+    tracemalloc.reset_peak()
+    exported = result.export_comparison_logs()
+    export_size = len(json.dumps(exported))
+    export_current, export_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{args.cases} cases -> {len(result.test_cases)} unique, {len(result.comparison_logs)} comparison logs "
+          f"in {elapsed:.1f}s")
+    print(f"{'phase':<36}{'current MiB':>14}{'peak MiB':>12}")
+    print(f"{'smart_select (compact logs)':<36}{run_current / 2**20:>14.1f}{run_peak / 2**20:>12.1f}")
+    print(f"{'+ exported JSON logs':<36}{export_current / 2**20:>14.1f}{export_peak / 2**20:>12.1f}")
+    print(f"Exported logs: {export_size / 2**20:.1f} MiB as JSON")
+
+##############################
+# judge alt komutu           #
+##############################
+
+def legacy_similarity_request(ollama_client, case1, case2):
+    """
+    SimilarityJudge öncesi istek: talimatlar ve case'ler tek bir kullanıcı mesajında, keep_alive ve options olmadan.
+    """
+    case1_json = {"Title": case1.Title, "Description": case1.Description, "Objective": case1.Objective}
+    case2_json = {"Title": case2.Title, "Description": case2.Description, "Objective": case2.Objective}
+    prompt_text = f"""
+You are given two test cases, each with a certain set of fields:
+- Title
+- Description
+- Objective
+
+You will decide whether these two test cases are “contextually the same” based on the following criteria:
+
+1. If both have the same Title (case-insensitive) OR their Titles are substantially similar in meaning,
+2. AND they have either the same or very similar Description and/or Objective,
+3. AND they serve essentially the same testing purpose for the same or very closely related scenarios,
+4. THEN you should conclude that these two test cases are the same.
+5. The order of importance Description > Objective > Title.
+
+Otherwise, they are considered different.
+
+Below are the two test cases in JSON format:
+
+TestCase1:
+{json.dumps(case1_json, indent=2, ensure_ascii=False)}
+
+TestCase2:
+{json.dumps(case2_json, indent=2, ensure_ascii=False)}
+
+Return your response **only** in valid JSON with the following format:
+
+{{
+  "is_same": <true or false>
+}}
+
+Where:
+- is_same = true if the test cases meet the criteria above
+- is_same = false otherwise
+
+Important:
+- Do not provide any additional text outside the JSON object.
+- Do not explain your reasoning, only provide the final JSON response.
+"""
+    response = ollama_client.chat(
+        messages=[{"role": "user", "content": prompt_text.strip()}],
+        model=SIMILARITY_MODEL,
+        format=PAIR_RESPONSE_SCHEMA,
+    )
+    return json.loads(response.get('message', {}).get('content', '')).get("is_same", False)
+
+def start_stub_server(args):
+    """
+    Her varyant için sıfır durumlu bir stub Ollama sunucusunu arka planda başlatır; (sunucu, host) döndürür.
+    """
+    server = stub_ollama.create_server(
+        port=0, connect_ms=0.0, latency_ms=0.0, load_ms=args.load_ms, prefill_ms_per_kchar=args.prefill_ms_per_kchar,
+        decode_ms_per_token=args.decode_ms_per_token
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_judge_benchmark(args):
+    cases = make_memory_cases(args.pairs + 1, duplicate_ratio=0.0)
+    pairs = [(cases[index + 1], cases[index]) for index in range(args.pairs)]
+
+    def legacy_judge(host):
+        ollama_client = OllamaClient(host=host)
+        return lambda case1, case2: legacy_similarity_request(ollama_client, case1, case2)
+
+    variants = {
+        "single user prompt (legacy)": legacy_judge,
+        "SimilarityJudge": lambda host: SimilarityJudge(host=host).is_same,
+    }
+
+    print(f"{'variant':<30}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'loads':>8}{'prefilled chars/pair':>24}")
+    for name, make_judge in variants.items():
+        if args.host:
+            server, host = None, args.host
+        else:
+            server, host = start_stub_server(args)
+        try:
+            judge = make_judge(host)
+            durations = []
+            for case1, case2 in pairs:
+                start = time.perf_counter()
+                judge(case1, case2)
+                durations.append((time.perf_counter() - start) * 1000)
+            stats = server.RequestHandlerClass.stats.snapshot() if server else {}
+        finally:
+            if server:
+                server.shutdown()
+                server.server_close()
+
+        p95 = sorted(durations)[max(0, int(len(durations) * 0.95) - 1)]
+        prefilled = f"{stats['prefilled_chars'] / stats['requests']:.0f}" if stats else "-"
+        print(f"{name:<30}{statistics.mean(durations):>10.1f}{statistics.median(durations):>10.1f}{p95:>10.1f}"
+              f"{stats.get('loads', '-'):>8}{prefilled:>24}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Selection benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    combinations = subparsers.add_parser("combinations", help="fetch_valid_combinations: legacy scan vs aggregation")
+    combinations.add_argument("--sessions", type=int, default=100000, help="number of seeded session documents")
+    combinations.add_argument("--processes", type=int, default=500, help="number of distinct process titles")
+    combinations.add_argument("--repeat", type=int, default=5, help="timed runs per variant")
+    combinations.add_argument("--database", default=BENCHMARK_DB, help="database used for the seeded data")
+    combinations.add_argument("--keep", action="store_true", help="keep the seeded database after the run")
+    combinations.set_defaults(handler=run_combinations_benchmark)
+
+    memory = subparsers.add_parser("memory", help="peak memory of a smart_select run with a stub LLM judge")
+    memory.add_argument("--cases", type=int, default=1000, help="number of generated test cases")
+    memory.add_argument("--duplicate-ratio", type=float, default=0.2, help="share of generated near copies")
+    memory.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="0 disables the candidate limit")
+    memory.add_argument("--workers", type=int, default=4, help="concurrent stub comparisons")
+    memory.set_defaults(handler=run_memory_benchmark)
+
+    judge = subparsers.add_parser("judge", help="per-pair latency of the similarity judge against a stub Ollama API")
+    judge.add_argument("--pairs", type=int, default=50, help="number of judged pairs per variant")
+    judge.add_argument("--host", help="use a running Ollama (or tools/stub_ollama.py) instead of an in-process stub")
+    judge.add_argument("--load-ms", type=float, default=2000.0, help="stub: simulated model load time")
+    judge.add_argument("--prefill-ms-per-kchar", type=float, default=20.0, help="stub: prompt processing cost")
+    judge.add_argument("--decode-ms-per-token", type=float, default=15.0, help="stub: generation cost")
+    judge.set_defaults(handler=run_judge_benchmark)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
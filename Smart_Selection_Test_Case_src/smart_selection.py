@@ -1,12 +1,21 @@
 import streamlit as st
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 import json
 from datetime import datetime
 import uuid
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 import os
-from ollama import chat
+import re
+import math
+import hashlib
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timezone
+from pymongo.errors import PyMongoError
+from ollama import Client as OllamaClient
 import streamlit_mermaid as stmd
 
 ##############################
@@ -14,35 +23,76 @@ import streamlit_mermaid as stmd
 ##############################
 
 MONGO_URI = os.getenv("MONGO_URI")  # Ortam değişkeninden URI al
-client = MongoClient(MONGO_URI)
+# Bağlantı havuzu boyutu ve zaman aşımları (ms); Smart Test uygulamasıyla aynı ortam değişkenleri kullanılır
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS
+)
 db = client["modular_test_scenario_gen"]
 collection = db["sessions"]
+verdict_cache_collection = db["similarity_verdict_cache"]  # LLM benzerlik kararlarının önbelleği
+selection_state_collection = db["smart_selection_state"]  # Kombinasyon bazında kalıcı Smart Selection durumu
+test_cases_collection = db["test_cases"]  # Smart Test'in ürettiği test case'ler (her test case ayrı doküman)
 
+# (process_title, selected_category, selected_test_type) alanları ve kombinasyon listesinin önbellek süresi
+COMBINATION_FIELDS = ("process_title", "selected_category", "selected_test_type")
+COMBINATIONS_CACHE_TTL_SECONDS = int(os.getenv("COMBINATIONS_CACHE_TTL_SECONDS", 60))
+
+def ensure_combination_index(sessions_collection=collection, state_collection=selection_state_collection):
+    """
+    Kombinasyon sorgularını destekleyen (process_title, selected_category, selected_test_type) compound index'ini
+    sessions ve smart_selection_state koleksiyonlarında oluşturur.
+    """
+    for target_collection in (sessions_collection, state_collection):
+        target_collection.create_index(
+            [(field, ASCENDING) for field in COMBINATION_FIELDS],
+            name="process_title_category_test_type"
+        )
+
+def aggregate_valid_combinations(sessions_collection=collection):
+    """
+    Benzersiz kombinasyonları sunucu tarafında $match + $group ile hesaplar.
+    Null ya da eksik alanlar elenir, boş string değerler kabul edilir. Sonuç alfabetik sıralıdır.
+    """
+    group_key = {field: f"${field}" for field in COMBINATION_FIELDS}
+    pipeline = [
+        {"$match": {field: {"$ne": None} for field in COMBINATION_FIELDS}},
+        {"$sort": {field: 1 for field in COMBINATION_FIELDS}},
+        {"$group": {"_id": group_key}},
+        {"$sort": {f"_id.{field}": 1 for field in COMBINATION_FIELDS}},
+        {"$project": {"_id": 0, **{field: f"$_id.{field}" for field in COMBINATION_FIELDS}}},
+    ]
+    return list(sessions_collection.aggregate(pipeline))
+
+@st.cache_resource(show_spinner=False)
+def _combination_index_ready():
+    ensure_combination_index()
+    return True
+
+@st.cache_data(ttl=COMBINATIONS_CACHE_TTL_SECONDS, show_spinner=False)
 def fetch_valid_combinations():
     """
     MongoDB'den benzersiz (process_title, selected_category, selected_test_type) 
     kombinasyonlarını getirir. Null değerleri filtreler, ancak boş string değerleri kabul eder.
+    Sonuç COMBINATIONS_CACHE_TTL_SECONDS boyunca önbellekte tutulur, böylece widget etkileşimleri koleksiyonu yeniden taramaz.
     """
-    data = collection.find(
-        {}, 
-        {"process_title": 1, "selected_category": 1, "selected_test_type": 1}
-    )
-    combinations = [
-        {
-            "process_title": entry.get("process_title"),
-            "selected_category": entry.get("selected_category"),
-            "selected_test_type": entry.get("selected_test_type")
-        }
-        for entry in data
-        if entry.get("process_title") is not None 
-           and entry.get("selected_category") is not None 
-           and entry.get("selected_test_type") is not None
-    ]
-    return combinations
+    _combination_index_ready()
+    return aggregate_valid_combinations()
 
 def fetch_details_by_combination(process_title, selected_category, selected_test_type):
     """
     Seçilen (process_title, selected_category, selected_test_type) kombinasyonuna göre detayları getirir.
+    Test case'ler test_cases koleksiyonundan okunup senaryo sırasıyla eski model_output.TestCases biçiminde
+    birleştirilir; test_cases kaydı olmayan eski oturumlarda session dokümanındaki model_output kullanılır.
     """
     data = collection.find_one(
         {
@@ -51,16 +101,625 @@ def fetch_details_by_combination(process_title, selected_category, selected_test
             "selected_test_type": selected_test_type
         },
         {
+            "session_id": 1,
             "process_title": 1,
             "selected_category": 1,
             "selected_test_type": 1,
             "model_output.TestCases": 1
         }
     )
+    if not data:
+        return data
+
+    case_groups = []
+    documents = test_cases_collection.find(
+        {"session_id": data.get("session_id")},
+        {"_id": 0, "scenario_index": 1, "scenario_id": 1, "test_case": 1}
+    ).sort([("scenario_index", ASCENDING), ("case_index", ASCENDING)])
+    for document in documents:
+        if not case_groups or case_groups[-1]["scenario_index"] != document["scenario_index"]:
+            case_groups.append({
+                "scenario_index": document["scenario_index"],
+                "scenario_id": document.get("scenario_id", "Unknown Scenario"),
+                "test_case": {"TestCases": []}
+            })
+        case_groups[-1]["test_case"]["TestCases"].append(document["test_case"])
+    if case_groups:
+        data["model_output"] = {"TestCases": case_groups}
     return data
 
+def extract_test_cases(details):
+    """
+    fetch_details_by_combination çıktısındaki senaryo gruplarından Smart Selection'a girecek
+    test case sözlüklerini (ScenarioID, TestCaseID, Title, Description, Objective) çıkarır.
+    """
+    test_cases = []
+    for case_group in (details or {}).get("model_output", {}).get("TestCases", []):
+        scenario_id = case_group.get("scenario_id", "Unknown Scenario")
+        for idx, c in enumerate(case_group.get("test_case", {}).get("TestCases", [])):
+            test_cases.append({
+                "ScenarioID": scenario_id,
+                "TestCaseID": c.get("TestCaseID", f"Unknown_ID_{idx}"),
+                "Title": c.get("Title", "No Title"),
+                "Description": c.get("Description", "No Description"),
+                "Objective": c.get("Objective", "No Objective")
+            })
+    return test_cases
+
+def combination_filter(process_title, selected_category, selected_test_type):
+    """
+    Bir kombinasyonu tanımlayan MongoDB filtresini döndürür.
+    """
+    return {
+        "process_title": process_title,
+        "selected_category": selected_category,
+        "selected_test_type": selected_test_type
+    }
+
+def load_selection_state(process_title, selected_category, selected_test_type):
+    """
+    Kombinasyon için kaydedilmiş Smart Selection durumunu getirir.
+    Kayıt yoksa boş bir durum döndürür: unique_cases, processed_keys ve duplicates listeleri.
+    """
+    state = selection_state_collection.find_one(
+        combination_filter(process_title, selected_category, selected_test_type),
+        {"_id": 0, "unique_cases": 1, "processed_keys": 1, "duplicates": 1}
+    )
+    return {
+        "unique_cases": (state or {}).get("unique_cases", []),
+        "processed_keys": (state or {}).get("processed_keys", []),
+        "duplicates": (state or {}).get("duplicates", []),
+    }
+
+def save_selection_state(process_title, selected_category, selected_test_type, unique_cases, processed_keys, duplicates):
+    """
+    Kombinasyonun unique case listesini, işlenmiş case anahtarlarını ve benzer case'lerini kaydeder.
+    """
+    selection_state_collection.update_one(
+        combination_filter(process_title, selected_category, selected_test_type),
+        {"$set": {
+            "unique_cases": unique_cases,
+            "processed_keys": processed_keys,
+            "duplicates": duplicates,
+            "updated_at": datetime.now()
+        }},
+        upsert=True
+    )
+
+def reset_selection_state(process_title, selected_category, selected_test_type):
+    """
+    Kombinasyonun kayıtlı Smart Selection durumunu siler; bir sonraki çalıştırma sıfırdan başlar.
+    """
+    selection_state_collection.delete_one(combination_filter(process_title, selected_category, selected_test_type))
+
+##############################################
+# 2) Yerel Vektör ve Benzerlik Fonksiyonları #
+##############################################
+
+# LLM'e gönderilecek en yakın unique case sayısı ve minimum kosinüs benzerliği
+DEFAULT_TOP_K = 5
+DEFAULT_MIN_SIMILARITY = 0.2
+# Aynı anda LLM'e gönderilebilecek en fazla karşılaştırma sayısı
+DEFAULT_MAX_WORKERS = 4
+# Tek bir LLM isteğinde değerlendirilecek unique case sayısı (1 ise her çift ayrı sorulur)
+DEFAULT_BATCH_SIZE = 1
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+def case_text(case) -> str:
+    """
+    TestCase'in karşılaştırmada kullanılan alanlarını (Title, Description, Objective) tek bir metinde birleştirir.
+    """
+    return " ".join(part for part in (case.Title, case.Description, case.Objective) if part)
+
+def embed_case(case) -> dict:
+    """
+    TestCase için LLM'e gitmeden yerel bir vektör hesaplar.
+    Kelime ve ardışık kelime çiftlerinin (bigram) frekanslarından oluşan, L2 normu 1 olan seyrek bir sözlük döndürür.
+    """
+    tokens = TOKEN_PATTERN.findall(case_text(case).lower())
+    features = Counter(tokens)
+    features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+
+    norm = math.sqrt(sum(count * count for count in features.values()))
+    if not norm:
+        return {}
+    return {feature: count / norm for feature, count in features.items()}
+
+def cosine_similarity(vector1: dict, vector2: dict) -> float:
+    """
+    Normalize edilmiş iki seyrek vektörün kosinüs benzerliğini döndürür.
+    """
+    if len(vector1) > len(vector2):
+        vector1, vector2 = vector2, vector1
+    return sum(weight * vector2.get(feature, 0.0) for feature, weight in vector1.items())
+
+def select_candidates(similarities, top_k=DEFAULT_TOP_K, min_similarity=DEFAULT_MIN_SIMILARITY):
+    """
+    Benzerlik listesinden LLM'e gönderilecek unique case indekslerini seçer.
+    min_similarity altındaki çiftler elenir, kalanlardan en benzer top_k tanesi tutulur (top_k=None ise sınır yok).
+    """
+    ranked = sorted(
+        (index for index, similarity in enumerate(similarities) if similarity >= min_similarity),
+        key=lambda index: (-similarities[index], index)
+    )
+    if top_k is not None:
+        ranked = ranked[:top_k]
+    return set(ranked)
+
+# SimHash imzaları arasında "neredeyse aynı" kabul edilen en fazla bit farkı (None ise kapalı)
+DEFAULT_NEAR_DUPLICATE_DISTANCE = 3
+SIMHASH_BITS = 64
+# SimHash imzası yalnızca en az bu kadar kelimesi olan case'ler için hesaplanır;
+# kısa metinlerde tek bir kelime farkı da birkaç bitlik fark verir, bu yüzden near_exact katmanı atlanır
+NEAR_DUPLICATE_MIN_TOKENS = int(os.getenv("NEAR_DUPLICATE_MIN_TOKENS", 16))
+# Parmak izinde alanları ayıran karakter (ASCII unit separator); alan sınırları kaydırılmış metinler çakışmaz
+FINGERPRINT_FIELD_SEPARATOR = "\x1f"
+
+def normalize_field(text) -> str:
+    """
+    Tek bir alanın büyük/küçük harf ve boşluk farklarını yok sayan normalize edilmiş hali.
+    """
+    return " ".join((text or "").casefold().split())
+
+def normalize_case_text(case) -> str:
+    """
+    Büyük/küçük harf ve boşluk farklarını yok sayan normalize edilmiş case metnini döndürür.
+    """
+    return " ".join(case_text(case).casefold().split())
+
+def exact_fingerprint(case) -> str:
+    """
+    Normalize edilmiş alanların SHA-256 özeti; yalnızca boşluk veya harf büyüklüğü farklı olan case'ler aynı özeti verir.
+    Alanlar ayrı ayrı normalize edilip FINGERPRINT_FIELD_SEPARATOR ile birleştirilir, böylece
+    ("a b", "c") ile ("a", "b c") farklı özet verir.
+    """
+    payload = FINGERPRINT_FIELD_SEPARATOR.join(
+        normalize_field(part) for part in (case.Title, case.Description, case.Objective)
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def simhash_signature(case, min_tokens=NEAR_DUPLICATE_MIN_TOKENS) -> Optional[int]:
+    """
+    Normalize edilmiş metnin kelime ve bigram özelliklerinden 64 bitlik SimHash imzası üretir.
+    Birbirine çok yakın metinlerin imzaları arasında yalnızca birkaç bit fark olur.
+    Metin min_tokens kelimeden kısaysa None döner; bu case'ler near_exact katmanında eşleştirilmez.
+    """
+    tokens = TOKEN_PATTERN.findall(normalize_case_text(case))
+    if len(tokens) < min_tokens:
+        return None
+    features = Counter(tokens)
+    features.update(f"{first} {second}" for first, second in zip(tokens, tokens[1:]))
+
+    weights = [0] * SIMHASH_BITS
+    for feature, count in features.items():
+        feature_hash = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if feature_hash >> bit & 1 else -count
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+def hamming_distance(signature1: int, signature2: int) -> int:
+    """
+    İki SimHash imzası arasındaki farklı bit sayısı.
+    """
+    return bin(signature1 ^ signature2).count("1")
+
+# Cluster modunda iki case'i aynı kümeye bağlayan minimum kosinüs benzerliği ve tek LLM isteğine giren en fazla case
+DEFAULT_CLUSTER_SIMILARITY = 0.5
+DEFAULT_MAX_CLUSTER_SIZE = 12
+
+def connected_components(count, edges):
+    """
+    0..count-1 düğümleri ve (i, j) kenarlarından bağlı bileşenleri (union-find) hesaplar.
+    Her bileşen artan indeks sırasıyla, bileşenler de ilk elemanlarına göre sıralı döner.
+    """
+    parents = list(range(count))
+
+    def find(node):
+        while parents[node] != node:
+            parents[node] = parents[parents[node]]
+            node = parents[node]
+        return node
+
+    for first, second in edges:
+        root1, root2 = find(first), find(second)
+        if root1 != root2:
+            parents[max(root1, root2)] = min(root1, root2)
+
+    components = {}
+    for node in range(count):
+        components.setdefault(find(node), []).append(node)
+    return sorted(components.values(), key=lambda component: component[0])
+
+# Büyük bir bileşen bölünürken bağlantı eşiğinin her adımda artırıldığı miktar
+CLUSTER_SPLIT_STEP = 0.05
+
+def split_component(component, vectors, link_similarity, max_cluster_size, step=CLUSTER_SPLIT_STEP):
+    """
+    max_cluster_size'dan büyük bir bileşeni benzerliğe göre böler: bağlantı eşiği step kadar artırılır ve
+    bileşen yalnızca birbirine daha benzer case'lerin bağlı kaldığı alt bileşenlere ayrılır; büyük kalan
+    alt bileşenler için işlem yinelenir. Eşik 1'i aşarsa (ör. çok sayıda birebir aynı case) kalan parça
+    ardışık dilimlere bölünür. Parçalar ilk elemanlarına göre sıralı döner.
+    """
+    if len(component) <= max_cluster_size:
+        return [component]
+    threshold = link_similarity + step
+    if threshold > 1.0:
+        return [component[start:start + max_cluster_size] for start in range(0, len(component), max_cluster_size)]
+
+    edges = [
+        (first, second)
+        for first in range(len(component))
+        for second in range(first + 1, len(component))
+        if cosine_similarity(vectors[component[first]], vectors[component[second]]) >= threshold
+    ]
+    parts = []
+    for sub_component in connected_components(len(component), edges):
+        parts.extend(split_component(
+            [component[index] for index in sub_component], vectors, threshold, max_cluster_size, step
+        ))
+    return sorted(parts, key=lambda part: part[0])
+
+##############################################
+# 3) LLM Karar Önbelleği ve Benzerlik Hakemi #
+##############################################
+
+# Benzerlik kontrolünde kullanılan model ve prompt sürümü; prompt değişirse sürüm artırılmalı
+SIMILARITY_MODEL = "llama3.2"
+SIMILARITY_PROMPT_VERSION = "v2"
+
+# Önbellek kayıtlarının ömrü (saniye) ve tutulacak en fazla kayıt sayısı
+VERDICT_CACHE_TTL_SECONDS = int(os.getenv("VERDICT_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60))
+VERDICT_CACHE_MAX_ENTRIES = int(os.getenv("VERDICT_CACHE_MAX_ENTRIES", 200000))
+
+def case_fingerprint(case) -> str:
+    """
+    TestCase'in Title/Description/Objective alanlarından içerik tabanlı bir SHA-256 özeti üretir.
+    """
+    payload = json.dumps([case.Title, case.Description, case.Objective], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def pair_cache_key(case1, case2, model=SIMILARITY_MODEL, prompt_version=SIMILARITY_PROMPT_VERSION) -> str:
+    """
+    İki case için sıradan bağımsız önbellek anahtarı üretir: (A, B) ve (B, A) aynı anahtarı verir.
+    """
+    fingerprints = sorted((case_fingerprint(case1), case_fingerprint(case2)))
+    payload = "|".join(fingerprints + [model, prompt_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class PairVerdictCache:
+    """
+    LLM'in iki case için verdiği is_same kararını MongoDB'de saklayan önbellek.
+    Kayıtlar TTL index ile VERDICT_CACHE_TTL_SECONDS sonra silinir, kayıt sayısı
+    max_entries'i aşarsa en eski kayıtlar evict() ile temizlenir.
+    Önbelleğe erişilemezse karşılaştırma LLM'e sorulmaya devam eder.
+    """
+
+    def __init__(self, cache_collection=verdict_cache_collection, model=SIMILARITY_MODEL,
+                 prompt_version=SIMILARITY_PROMPT_VERSION, ttl_seconds=VERDICT_CACHE_TTL_SECONDS,
+                 max_entries=VERDICT_CACHE_MAX_ENTRIES):
+        self.collection = cache_collection
+        self.model = model
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+
+    def _ensure_indexes(self):
+        if self._indexes_ready:
+            return
+        self.collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        self._indexes_ready = True
+
+    def get(self, case1, case2) -> Optional[bool]:
+        """
+        Önbellekteki kararı döndürür, kayıt yoksa None döner.
+        """
+        try:
+            self._ensure_indexes()
+            entry = self.collection.find_one(
+                {"_id": pair_cache_key(case1, case2, self.model, self.prompt_version)},
+                {"is_same": 1}
+            )
+        except PyMongoError:
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry["is_same"]
+
+    def put(self, case1, case2, is_same: bool):
+        """
+        LLM'den alınan kararı önbelleğe yazar.
+        """
+        try:
+            self._ensure_indexes()
+            self.collection.update_one(
+                {"_id": pair_cache_key(case1, case2, self.model, self.prompt_version)},
+                {"$set": {
+                    "is_same": is_same,
+                    "model": self.model,
+                    "prompt_version": self.prompt_version,
+                    "created_at": datetime.now(timezone.utc)
+                }},
+                upsert=True
+            )
+        except PyMongoError:
+            pass
+
+    def evict(self):
+        """
+        Kayıt sayısı max_entries'i aşarsa en eski kayıtları siler.
+        """
+        try:
+            overflow = self.collection.estimated_document_count() - self.max_entries
+            if overflow > 0:
+                oldest = self.collection.find({}, {"_id": 1}).sort("created_at", 1).limit(overflow)
+                self.collection.delete_many({"_id": {"$in": [entry["_id"] for entry in oldest]}})
+        except PyMongoError:
+            pass
+
+    def stats(self) -> dict:
+        """
+        Hit/miss sayılarını ve isabet oranını döndürür.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+# Benzerlik hakeminin Ollama ayarları. num_ctx tüm isteklerde aynı tutulur: farklı bir değer modelin yeniden yüklenmesine yol açar
+SIMILARITY_KEEP_ALIVE = os.getenv("SIMILARITY_KEEP_ALIVE", "30m")
+SIMILARITY_NUM_CTX = int(os.getenv("SIMILARITY_NUM_CTX", 4096))
+SIMILARITY_NUM_PREDICT = int(os.getenv("SIMILARITY_NUM_PREDICT", 16))  # {"is_same": ...} cevabı için üretilecek en fazla token
+# Liste cevaplarının (batch ve cluster) token bütçesi: öğe başına ve sarmalayıcı için sabit pay.
+# {"index": 12, "is_same": false}, öğesi Llama 3 tokenizer'ında 12-14 token tutar; girintili (pretty-printed)
+# çıktı için öğe başına birkaç token daha bırakılır. {"results": [ ... ]} sarmalayıcısı ve boşluklar sabit paydadır.
+SIMILARITY_LIST_ITEM_TOKENS = int(os.getenv("SIMILARITY_LIST_ITEM_TOKENS", 20))
+SIMILARITY_LIST_OVERHEAD_TOKENS = int(os.getenv("SIMILARITY_LIST_OVERHEAD_TOKENS", 16))
+SIMILARITY_TIMEOUT_SECONDS = float(os.getenv("SIMILARITY_TIMEOUT_SECONDS", 120))
+
+SIMILARITY_CRITERIA = """
+You will decide whether test cases are “contextually the same” based on the following criteria:
+
+1. If both have the same Title (case-insensitive) OR their Titles are substantially similar in meaning,
+2. AND they have either the same or very similar Description and/or Objective,
+3. AND they serve essentially the same testing purpose for the same or very closely related scenarios,
+4. THEN you should conclude that these two test cases are the same.
+5. The order of importance Description > Objective > Title.
+
+Otherwise, they are considered different.
+""".strip()
+
+# Sabit talimatlar sistem mesajında durur; sunucu bu ortak öneki (KV cache) istekler arasında yeniden kullanabilir
+PAIR_SYSTEM_PROMPT = f"""
+You are given two test cases, each with a certain set of fields:
+- Title
+- Description
+- Objective
+
+{SIMILARITY_CRITERIA}
+
+Return your response **only** in valid JSON with the following format:
+
+{{
+  "is_same": <true or false>
+}}
+
+Where:
+- is_same = true if the test cases meet the criteria above
+- is_same = false otherwise
+
+Important:
+- Do not provide any additional text outside the JSON object.
+- Do not explain your reasoning, only provide the final JSON response.
+""".strip()
+
+BATCH_SYSTEM_PROMPT = f"""
+You are given one candidate test case and a numbered list of unique test cases, each with a certain set of fields:
+- Title
+- Description
+- Objective
+
+For every unique test case, decide whether it is the same as the candidate.
+{SIMILARITY_CRITERIA}
+
+Return your response **only** in valid JSON with the following format, with exactly one entry for every unique test case index:
+
+{{
+  "results": [
+    {{"index": <unique test case index>, "is_same": <true or false>}}
+  ]
+}}
+
+Important:
+- Do not provide any additional text outside the JSON object.
+- Do not explain your reasoning, only provide the final JSON response.
+""".strip()
+
+CLUSTER_SYSTEM_PROMPT = f"""
+You are given a numbered list of test cases that look similar, each with a certain set of fields:
+- Title
+- Description
+- Objective
+
+Group the test cases so that test cases in the same group are the same and all other test cases are placed in different groups.
+{SIMILARITY_CRITERIA}
+
+Return your response **only** in valid JSON with the following format, with exactly one entry for every test case index:
+
+{{
+  "assignments": [
+    {{"index": <test case index>, "group": <group number>}}
+  ]
+}}
+
+Important:
+- Do not provide any additional text outside the JSON object.
+- Do not explain your reasoning, only provide the final JSON response.
+""".strip()
+
+PAIR_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_same": {"type": "boolean"}
+    },
+    "required": ["is_same"]
+}
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "is_same": {"type": "boolean"}
+                },
+                "required": ["index", "is_same"]
+            }
+        }
+    },
+    "required": ["results"]
+}
+
+CLUSTER_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "assignments": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "group": {"type": "integer"}
+                },
+                "required": ["index", "group"]
+            }
+        }
+    },
+    "required": ["assignments"]
+}
+
+def case_payload(case) -> str:
+    """
+    Case'in LLM'e gönderilen alanlarının (Title, Description, Objective) JSON metni.
+    """
+    return json.dumps(
+        {"Title": case.Title, "Description": case.Description, "Objective": case.Objective},
+        indent=2, ensure_ascii=False
+    )
+
+class SimilarityJudge:
+    """
+    Benzerlik kontrolleri için yeniden kullanılan Ollama istemcisi.
+    - Tek bir ollama.Client (bağlantı havuzu) tüm thread'ler arasında paylaşılır.
+    - keep_alive ile model etkileşimli çalıştırmalar arasında bellekte tutulur.
+    - Talimatlar sabit bir sistem mesajındadır, değişen kısım (case'ler) yalnızca kullanıcı mesajındadır.
+    - num_ctx sabittir; num_predict tek kararlı cevaplarda sabit, liste cevaplarında öğe sayısına göre hesaplanır.
+    """
+
+    def __init__(self, model=SIMILARITY_MODEL, host=None, keep_alive=SIMILARITY_KEEP_ALIVE,
+                 num_ctx=SIMILARITY_NUM_CTX, num_predict=SIMILARITY_NUM_PREDICT,
+                 list_item_tokens=SIMILARITY_LIST_ITEM_TOKENS, list_overhead_tokens=SIMILARITY_LIST_OVERHEAD_TOKENS,
+                 timeout=SIMILARITY_TIMEOUT_SECONDS):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.num_predict = num_predict
+        self.list_item_tokens = list_item_tokens
+        self.list_overhead_tokens = list_overhead_tokens
+        self.client = OllamaClient(host=host, timeout=timeout)  # host None ise OLLAMA_HOST kullanılır
+
+    def predict_budget(self, expected_items: Optional[int] = None) -> int:
+        """
+        Cevap için num_predict: tek kararlı cevapta num_predict, expected_items öğeli bir liste cevabında
+        list_overhead_tokens + list_item_tokens * expected_items.
+        """
+        if expected_items is None:
+            return self.num_predict
+        return self.list_overhead_tokens + self.list_item_tokens * expected_items
+
+    def ask(self, system_prompt: str, user_content: str, schema: dict, expected_items: Optional[int] = None) -> str:
+        """
+        Sistem ve kullanıcı mesajını yapılandırılmış çıktı şemasıyla gönderir, cevap metnini döndürür.
+        expected_items verilirse cevap o kadar öğeli bir listedir ve num_predict predict_budget ile hesaplanır.
+        """
+        response = self.client.chat(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_content}
+            ],
+            format=schema,
+            keep_alive=self.keep_alive,
+            options={
+                "temperature": 0,
+                "num_ctx": self.num_ctx,
+                "num_predict": self.predict_budget(expected_items)
+            }
+        )
+        return response.get('message', {}).get('content', '').strip()
+
+    def is_same(self, case1, case2) -> bool:
+        """
+        İki case'in aynı olup olmadığını sorar. Cevap geçerli JSON değilse ValueError fırlatır.
+        """
+        content = self.ask(
+            PAIR_SYSTEM_PROMPT,
+            f"TestCase1:\n{case_payload(case1)}\n\nTestCase2:\n{case_payload(case2)}",
+            PAIR_RESPONSE_SCHEMA
+        )
+        try:
+            parsed_content = json.loads(content)
+        except json.JSONDecodeError:
+            raise ValueError(f"LLM response is not valid JSON: {content}")
+        return parsed_content.get("is_same", False)
+
+    def compare_batch(self, case, unique_cases) -> str:
+        """
+        Bir case'i numaralı unique case listesiyle tek istekte karşılaştırır, ham cevap metnini döndürür.
+        """
+        unique_cases_text = "\n\n".join(
+            f"UniqueCase {index}:\n{case_payload(unique_case)}" for index, unique_case in enumerate(unique_cases)
+        )
+        return self.ask(
+            BATCH_SYSTEM_PROMPT,
+            f"Candidate TestCase:\n{case_payload(case)}\n\nUnique TestCases "
+            f"(indexes 0 to {len(unique_cases) - 1}):\n{unique_cases_text}",
+            BATCH_RESPONSE_SCHEMA,
+            expected_items=len(unique_cases)
+        )
+
+    def group_cluster(self, cluster_cases) -> str:
+        """
+        Numaralı bir case kümesini gruplandırması için tek istekte sorar, ham cevap metnini döndürür.
+        """
+        cases_text = "\n\n".join(
+            f"TestCase {index}:\n{case_payload(case)}" for index, case in enumerate(cluster_cases)
+        )
+        return self.ask(
+            CLUSTER_SYSTEM_PROMPT,
+            f"Test cases (indexes 0 to {len(cluster_cases) - 1}):\n{cases_text}",
+            CLUSTER_RESPONSE_SCHEMA,
+            expected_items=len(cluster_cases)
+        )
+
+similarity_judge = SimilarityJudge()  # Uygulama genelinde paylaşılan hakem
+
 ##############################################
-# 2) TestCase ve Smart Selection Sınıfları  #
+# 4) TestCase ve Smart Selection Sınıfları  #
 ##############################################
 
 class TestCase(BaseModel):
@@ -70,143 +729,836 @@ class TestCase(BaseModel):
     Description: Optional[str] = None
     Objective: Optional[str] = None
 
+class CaseStore:
+    """
+    Test case'leri bir kez ve sütun bazında (alan başına bir liste) tutan kompakt depo.
+    Karşılaştırma logları case'lere bu depodaki tamsayı indeksle başvurur;
+    case'in tam sözlüğü yalnızca loglar dışa aktarılırken üretilir.
+    """
+    __slots__ = ("scenario_ids", "test_case_ids", "titles", "descriptions", "objectives")
+
+    def __init__(self, cases=()):
+        self.scenario_ids = []
+        self.test_case_ids = []
+        self.titles = []
+        self.descriptions = []
+        self.objectives = []
+        for case in cases:
+            self.append(case)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def append(self, case) -> int:
+        """
+        Case'in alanlarını sütunlara ekler ve case'in indeksini döndürür.
+        """
+        self.scenario_ids.append(case.ScenarioID)
+        self.test_case_ids.append(case.TestCaseID)
+        self.titles.append(case.Title)
+        self.descriptions.append(case.Description)
+        self.objectives.append(case.Objective)
+        return len(self.titles) - 1
+
+    def to_dict(self, index) -> dict:
+        """
+        indeks'teki case'in TestCase.model_dump() ile aynı sözlüğünü üretir.
+        """
+        return {
+            "ScenarioID": self.scenario_ids[index],
+            "TestCaseID": self.test_case_ids[index],
+            "Title": self.titles[index],
+            "Description": self.descriptions[index],
+            "Objective": self.objectives[index],
+        }
+
+class ComparisonLog:
+    """
+    Tek bir karşılaştırmanın kompakt kaydı; Case1/Case2 CaseStore indeksleri olarak tutulur.
+    """
+    __slots__ = ("step", "process_id", "timestamp", "case1", "case2", "is_same", "skipped", "similarity", "resolved_by")
+
+    def __init__(self, step, case1, case2, is_same, skipped, similarity, resolved_by):
+        self.step = step
+        self.process_id = uuid.uuid4().int
+        self.timestamp = datetime.now()
+        self.case1 = case1
+        self.case2 = case2
+        self.is_same = is_same
+        self.skipped = skipped
+        self.similarity = similarity
+        self.resolved_by = resolved_by
+
+    @property
+    def pair_count(self) -> int:
+        """
+        Kaydın karara bağladığı çift sayısı.
+        """
+        return 1
+
+    def to_dict(self, store: CaseStore) -> dict:
+        return {
+            "Step": self.step,
+            "ProcessName": str(uuid.UUID(int=self.process_id)),
+            "Timestamp": self.timestamp.isoformat(),
+            "Case1": store.to_dict(self.case1),
+            "Case2": store.to_dict(self.case2),
+            "is_same": self.is_same,
+            "Skipped": self.skipped,
+            "Similarity": self.similarity,
+            "ResolvedBy": self.resolved_by,
+        }
+
+class ClusterLog:
+    """
+    Cluster modunda bir kümenin kompakt kaydı; üyeler ve gruplar CaseStore indeksleri olarak tutulur.
+    """
+    __slots__ = ("step", "process_id", "timestamp", "cluster_id", "members", "groups", "resolved_by")
+
+    def __init__(self, step, cluster_id, members, groups, resolved_by):
+        self.step = step
+        self.process_id = uuid.uuid4().int
+        self.timestamp = datetime.now()
+        self.cluster_id = cluster_id
+        self.members = tuple(members)
+        self.groups = tuple(tuple(group) for group in groups)
+        self.resolved_by = resolved_by
+
+    @property
+    def pair_count(self) -> int:
+        """
+        Kümenin karara bağladığı çift sayısı: üyelerin tüm ikilileri.
+        """
+        return len(self.members) * (len(self.members) - 1) // 2
+
+    def to_dict(self, store: CaseStore) -> dict:
+        return {
+            "Step": self.step,
+            "ProcessName": str(uuid.UUID(int=self.process_id)),
+            "Timestamp": self.timestamp.isoformat(),
+            "ClusterID": self.cluster_id,
+            "Cases": [store.to_dict(member) for member in self.members],
+            "Groups": [[store.test_case_ids[member] for member in group] for group in self.groups],
+            "ResolvedBy": self.resolved_by,
+        }
+
+# tier_stats anahtarlarının arayüzdeki etiketleri. Greedy modda sayılar çiftleri, cluster modunda kümeleri ve
+# parçalar arası karşılaştırmaları gösterir; iki mod farklı anahtarlar kullanır
+TIER_LABELS = {
+    "exact": "Exact matches",
+    "near_exact": "Near-exact matches",
+    "pruned": "Skipped by local similarity",
+    "llm": "LLM comparisons",
+    "singletons": "Unclustered cases",
+    "exact_clusters": "Exact clusters",
+    "near_exact_clusters": "Near-exact clusters",
+    "llm_clusters": "LLM cluster requests",
+    "llm_pairwise_fallbacks": "Clusters split pairwise",
+    "cross_cluster_local": "Cross-cluster local merges",
+    "cross_cluster_llm": "Cross-cluster LLM comparisons",
+}
+
+def format_tier_stats(tier_stats) -> str:
+    """
+    tier_stats'ı "Etiket: **sayı**" parçalarından oluşan tek satırlık bir metne dönüştürür.
+    """
+    return " - ".join(f"{TIER_LABELS.get(key, key)}: **{value}**" for key, value in tier_stats.items())
+
 class TestCaseList(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     test_cases: List[TestCase]
-    comparison_logs: List[dict] = []
+    comparison_logs: list = []  # ComparisonLog / ClusterLog kayıtları; JSON hali için export_comparison_logs
     duplicates: List[dict] = []  # Benzer test durumlarını saklamak için yeni bir liste
+    cache_stats: dict = {}  # Karar önbelleğinin hit/miss sayıları
+    tier_stats: dict = {}  # Greedy: her katmanın (exact, near_exact, pruned, llm) çözdüğü çift sayısı; cluster: küme sayıları
+    case_store: Optional[CaseStore] = None  # comparison_logs'taki indekslerin başvurduğu case deposu
+
+    def compared_pairs(self) -> int:
+        """
+        comparison_logs'un karara bağladığı çift sayısı; her iki modda da aynı birimle (çift) sayılır.
+        """
+        return sum(log.pair_count for log in self.comparison_logs)
+
+    def export_comparison_logs(self) -> List[dict]:
+        """
+        Kompakt karşılaştırma loglarını indirme ve gösterim için tam JSON sözlüklerine dönüştürür.
+        """
+        return [log.to_dict(self.case_store) for log in self.comparison_logs]
 
-    def smart_select(self):
+    def smart_select(self, **options):
         """
         Bu metot, test_cases listesindeki benzer (duplicate) test case'leri 
         LLM tabanlı karşılaştırma ile ayıklar, unique bir liste döndürür.
+        Parametreler ve karşılaştırma katmanları için iter_smart_select'e bakınız.
+        """
+        for event in self.iter_smart_select(**options):
+            pass
+        return event["result"]
+
+    def iter_smart_select(self, top_k=DEFAULT_TOP_K, min_similarity=DEFAULT_MIN_SIMILARITY, max_workers=DEFAULT_MAX_WORKERS,
+                          verdict_cache: Optional[PairVerdictCache] = None,
+                          near_duplicate_distance=DEFAULT_NEAR_DUPLICATE_DISTANCE, batch_size=DEFAULT_BATCH_SIZE,
+                          mode="greedy", cluster_similarity=DEFAULT_CLUSTER_SIMILARITY,
+                          max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE, initial_unique: Optional[List["TestCase"]] = None,
+                          on_warning=logging.warning):
         """
-        unique_cases = []
+        smart_select'in üreteç (generator) hali. Greedy modda her case işlendikten sonra bir ilerleme olayı üretir:
+        {"processed", "total", "case", "is_duplicate", "unique_count", "duplicate_count", "unique_cases", "duplicates"}.
+        Son olay {"done": True, "result": TestCaseList} şeklindedir; cluster modunda yalnızca bu olay üretilir.
+
+        mode="greedy" (varsayılan) her case'i sırayla mevcut unique case'lerle karşılaştırır,
+        mode="cluster" ise _cluster_select ile kümeleme tabanlı ayıklama yapar.
+
+        Karşılaştırma katmanları sırasıyla:
+        1. exact: normalize edilmiş metni birebir aynı olan case'ler LLM'e sorulmadan birleştirilir.
+        2. near_exact: SimHash imzaları near_duplicate_distance bitten az farklı olanlar da birleştirilir.
+        3. pruned: yerel vektöre göre en yakın top_k unique case (min_similarity üzerindekiler) dışındaki
+           çiftler LLM'e gönderilmez ve comparison_logs içinde "Skipped": True olarak işaretlenir.
+        4. llm: kalan belirsiz çiftler LLM'e sorulur (verdict_cache verilmişse önce önbelleğe bakılır).
+        Her katmanın çözdüğü çift sayısı tier_stats içinde döner.
+
+        Bir case'e ait karşılaştırmalar en fazla max_workers eşzamanlı istekle yürütülür.
+        Sonuçlar unique listesi sırasıyla okunduğu için çıktı sıralı çalıştırmayla aynıdır.
+        batch_size > 1 ise adaylar tek istekte batch_size'lık gruplar halinde LLM'e sorulur.
+
+        initial_unique verilirse (yalnızca greedy modda) unique liste bu case'lerle başlar;
+        test_cases içindeki yeni case'ler yalnızca bunlarla ve birbirleriyle karşılaştırılır.
+
+        Başarısız LLM karşılaştırmaları on_warning(mesaj) ile bildirilir (varsayılan logging.warning;
+        arayüz st.warning verir). on_warning yalnızca çağıran thread'den çağrılır.
+        """
+        if mode == "cluster":
+            if initial_unique:
+                raise ValueError("initial_unique is only supported in greedy mode")
+            yield {"done": True, "result": self._cluster_select(
+                cluster_similarity=cluster_similarity,
+                near_duplicate_distance=near_duplicate_distance,
+                max_cluster_size=max_cluster_size,
+                max_workers=max_workers,
+                verdict_cache=verdict_cache,
+                on_warning=on_warning
+            )}
+            return
+        if mode != "greedy":
+            raise ValueError(f"Unknown smart selection mode: {mode}")
+
+        # Loglar case'lere depodaki indeksle başvurur; unique_ids unique_cases ile paralel ilerler
+        if self.case_store is None:
+            self.case_store = CaseStore()
+        store = self.case_store
+        unique_cases = list(initial_unique or [])
+        unique_ids = [store.append(unique_case) for unique_case in unique_cases]
+        unique_vectors = [embed_case(unique_case) for unique_case in unique_cases]
+        unique_signatures = [simhash_signature(unique_case) for unique_case in unique_cases]
+        unique_fingerprints = {}  # exact fingerprint -> unique indeksi
+        for index, unique_case in enumerate(unique_cases):
+            unique_fingerprints.setdefault(exact_fingerprint(unique_case), index)
+        self.tier_stats = {"exact": 0, "near_exact": 0, "pruned": 0, "llm": 0}
         step = 1
 
-        for case in self.test_cases:
-            is_duplicate = False
-            for unique_case in unique_cases:
-                try:
-                    comparison_result = self._query_llm_similarity(case, unique_case)
-                except ValueError as e:
-                    # LLM cevabı geçersiz ya da hata varsa false kabul ediyoruz
-                    st.warning(f"LLM comparison failed: {e}")
-                    comparison_result = False
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for processed, case in enumerate(self.test_cases, start=1):
+                is_duplicate = False
+                case_id = store.append(case)
+                case_vector = embed_case(case)
+                fingerprint = exact_fingerprint(case)
+                signature = simhash_signature(case)
+                similarities = [cosine_similarity(case_vector, vector) for vector in unique_vectors]
+
+                # 1-2) Birebir ya da neredeyse aynı case'ler Ollama'ya gitmeden birleştirilir
+                matched_index, tier = self._match_fingerprint(
+                    fingerprint, signature, unique_fingerprints, unique_signatures, near_duplicate_distance
+                )
+                if matched_index is not None:
+                    self.tier_stats[tier] += 1
+                    self._log_comparison(step, case_id, unique_ids[matched_index], True, False,
+                                         similarities[matched_index], tier)
+                    step += 1
+                    self.duplicates.append({
+                        "DuplicateCase": store.to_dict(case_id),
+                        "MatchedWith": store.to_dict(unique_ids[matched_index])
+                    })
+                    is_duplicate = True
+                else:
+                    # 3-4) Belirsiz çiftler için en yakın adaylar LLM'e gönderilir
+                    is_duplicate, step = self._judge_candidates(
+                        executor, case, case_id, unique_cases, unique_ids, similarities, step,
+                        top_k, min_similarity, verdict_cache, batch_size, on_warning
+                    )
+
+                if not is_duplicate:
+                    unique_fingerprints.setdefault(fingerprint, len(unique_cases))
+                    unique_cases.append(case)
+                    unique_ids.append(case_id)
+                    unique_vectors.append(case_vector)
+                    unique_signatures.append(signature)
+
+                yield {
+                    "processed": processed,
+                    "total": len(self.test_cases),
+                    "case": case,
+                    "is_duplicate": is_duplicate,
+                    "unique_count": len(unique_cases),
+                    "duplicate_count": len(self.duplicates),
+                    "unique_cases": unique_cases,
+                    "duplicates": self.duplicates,
+                }
 
-                self.comparison_logs.append({
-                    "Step": step,
-                    "ProcessName": str(uuid.uuid4()),
-                    "Timestamp": datetime.now().isoformat(),
-                    "Case1": case.model_dump(),
-                    "Case2": unique_case.model_dump(),
-                    "is_same": comparison_result,
-                })
+        if verdict_cache is not None:
+            verdict_cache.evict()
+            self.cache_stats = verdict_cache.stats()
+
+        yield {"done": True, "result": TestCaseList(
+            test_cases=unique_cases,
+            comparison_logs=self.comparison_logs,
+            duplicates=self.duplicates,
+            cache_stats=self.cache_stats,
+            tier_stats=self.tier_stats,
+            case_store=store
+        )}
+
+    def _judge_candidates(self, executor, case, case_id, unique_cases, unique_ids, similarities, step,
+                          top_k, min_similarity, verdict_cache, batch_size, on_warning=logging.warning):
+        """
+        case'i en yakın aday unique case'lerle LLM üzerinden karşılaştırır, logları ve benzer case'i kaydeder.
+        case_id ve unique_ids case'lerin CaseStore indeksleridir. (is_duplicate, sonraki step) döndürür.
+        """
+        is_duplicate = False
+        candidates = select_candidates(similarities, top_k=top_k, min_similarity=min_similarity)
+        futures = self._dispatch_comparisons(
+            executor, case, {index: unique_cases[index] for index in candidates}, verdict_cache, batch_size
+        )
+
+        try:
+            for index in range(len(unique_cases)):
+                skipped = index not in candidates
+                resolved_by = "pruned" if skipped else "llm"
+                if skipped:
+                    # Yerel benzerliği düşük olan çift LLM'e gönderilmez
+                    comparison_result = False
+                else:
+                    try:
+                        comparison_result = futures[index].result()
+                    except Exception as e:
+                        # Geçersiz cevap, bağlantı ya da zaman aşımı hatası: çift kararsız kalır ve
+                        # farklı kabul edilir, böylece case kaybolmaz ve çalıştırma devam eder
+                        on_warning(f"LLM comparison failed: {e}")
+                        comparison_result = False
+                        resolved_by = "llm_failed"
+
+                self.tier_stats["pruned" if skipped else "llm"] += 1
+                self._log_comparison(step, case_id, unique_ids[index], comparison_result, skipped, similarities[index],
+                                     resolved_by)
                 step += 1
                 if comparison_result:
                     is_duplicate = True
                     # Benzer test durumlarını kaydet
                     self.duplicates.append({
-                        "DuplicateCase": case.model_dump(),
-                        "MatchedWith": unique_case.model_dump()
+                        "DuplicateCase": self.case_store.to_dict(case_id),
+                        "MatchedWith": self.case_store.to_dict(unique_ids[index])
                     })
                     break
+        finally:
+            # Eşleşme bulunduysa ya da bir hata oluştuysa henüz başlamamış karşılaştırmaları iptal et
+            for future in futures.values():
+                future.cancel()
+
+        return is_duplicate, step
+
+    def _cluster_select(self, cluster_similarity=DEFAULT_CLUSTER_SIMILARITY,
+                        near_duplicate_distance=DEFAULT_NEAR_DUPLICATE_DISTANCE,
+                        max_cluster_size=DEFAULT_MAX_CLUSTER_SIZE, max_workers=DEFAULT_MAX_WORKERS,
+                        verdict_cache: Optional[PairVerdictCache] = None, on_warning=logging.warning):
+        """
+        Kümeleme tabanlı ayıklama. Girdi sırasından bağımsızdır:
+        1. Yerel benzerliklerle (exact fingerprint, SimHash, kosinüs >= cluster_similarity) bir benzerlik grafı kurulur.
+        2. Grafın bağlı bileşenleri küme olarak alınır; max_cluster_size'dan büyük bileşenler split_component ile
+           benzerliğe göre parçalara bölünür.
+        3. Tüm üyeleri birebir/neredeyse aynı olan kümeler LLM'e sorulmadan birleştirilir, diğerleri için
+           LLM'e küme başına bir kez sorulur; LLM kümeyi onaylar ya da alt gruplara böler.
+        4. Bölünen bileşenlerde farklı parçalara düşen grupların temsilcileri ikinci bir geçişte birbirleriyle
+           karşılaştırılır, böylece parçalar arasında kalan benzer case'ler de birleştirilir.
+        Her grubun girdi sırasındaki ilk case'i unique listeye girer, duplicates listesi küme bazında gruplanır.
+        İkili karşılaştırmalar (küme cevabı geçersizse ve parçalar arası geçişte) verdict_cache'i kullanır.
+        tier_stats bu modda çift değil küme ve işlem sayılarını tutar (anahtarlar için TIER_LABELS'a bakınız).
+        """
+        cases = self.test_cases
+        if self.case_store is None:
+            self.case_store = CaseStore()
+        store = self.case_store
+        case_ids = [store.append(case) for case in cases]
+        vectors = [embed_case(case) for case in cases]
+        fingerprints = [exact_fingerprint(case) for case in cases]
+        signatures = [simhash_signature(case) for case in cases]
+
+        def is_near_duplicate(first, second):
+            return near_duplicate_distance is not None and None not in (signatures[first], signatures[second]) and \
+                hamming_distance(signatures[first], signatures[second]) <= near_duplicate_distance
+
+        edges = [
+            (first, second)
+            for first in range(len(cases))
+            for second in range(first + 1, len(cases))
+            if fingerprints[first] == fingerprints[second]
+            or is_near_duplicate(first, second)
+            or cosine_similarity(vectors[first], vectors[second]) >= cluster_similarity
+        ]
 
-            if not is_duplicate:
-                unique_cases.append(case)
+        clusters = []
+        split_parts = []  # Bölünen her bileşenin parçalarının küme numaraları
+        for component in connected_components(len(cases), edges):
+            parts = split_component(component, vectors, cluster_similarity, max_cluster_size)
+            if len(parts) > 1:
+                split_parts.append(list(range(len(clusters) + 1, len(clusters) + len(parts) + 1)))
+            clusters.extend(parts)
+
+        self.tier_stats = {
+            "singletons": 0, "exact_clusters": 0, "near_exact_clusters": 0, "llm_clusters": 0,
+            "llm_pairwise_fallbacks": 0, "cross_cluster_local": 0, "cross_cluster_llm": 0
+        }
+        cluster_groups = {}
+        pending_clusters = {}
+        cross_comparisons = []  # (case, eşleştiği case, is_same, similarity, resolved_by)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for cluster_id, members in enumerate(clusters, start=1):
+                if len(members) == 1:
+                    # Hiçbir case'e yakın olmayan case LLM'e sorulmadan unique kabul edilir
+                    self.tier_stats["singletons"] += 1
+                    cluster_groups[cluster_id] = ([members], None)
+                elif len({fingerprints[member] for member in members}) == 1:
+                    self.tier_stats["exact_clusters"] += 1
+                    cluster_groups[cluster_id] = ([members], "exact")
+                elif all(is_near_duplicate(members[0], member) for member in members[1:]):
+                    self.tier_stats["near_exact_clusters"] += 1
+                    cluster_groups[cluster_id] = ([members], "near_exact")
+                else:
+                    self.tier_stats["llm_clusters"] += 1
+                    pending_clusters[cluster_id] = executor.submit(
+                        self._query_llm_cluster, [cases[member] for member in members]
+                    )
+
+            try:
+                for cluster_id, future in pending_clusters.items():
+                    members = clusters[cluster_id - 1]
+                    try:
+                        groups, resolved_by = future.result(), "llm"
+                    except Exception as e:
+                        # Küme cevabı geçersizse ya da istek başarısız olduysa küme içinde ikili karşılaştırmaya dön
+                        on_warning(f"LLM cluster check failed, falling back to pairwise comparisons: {e}")
+                        self.tier_stats["llm_pairwise_fallbacks"] += 1
+                        groups = self._split_cluster_pairwise([cases[member] for member in members], verdict_cache)
+                        resolved_by = "llm_pairwise"
+                    cluster_groups[cluster_id] = ([[members[index] for index in group] for group in groups], resolved_by)
+            finally:
+                # Beklenmeyen bir hatada kuyruktaki küme isteklerini iptal et
+                for future in pending_clusters.values():
+                    future.cancel()
+
+            # Son gruplar (küme numarası, grup sırası) ile tutulur; parçalar arası birleştirmeler bunları değiştirir
+            final_groups = {
+                (cluster_id, group_index): list(group)
+                for cluster_id, (groups, _) in cluster_groups.items()
+                for group_index, group in enumerate(groups)
+            }
+
+            for part_ids in split_parts:
+                # Parçaların grupları temsilcilerinin girdi sırasıyla greedy olarak birleştirilir
+                group_keys = sorted(
+                    (key for key in final_groups if key[0] in part_ids), key=lambda key: final_groups[key][0]
+                )
+                kept_keys = []
+                for key in group_keys:
+                    representative = final_groups[key][0]
+                    candidates = {}
+                    matched_key = None
+                    for position, kept_key in enumerate(kept_keys):
+                        if kept_key[0] == key[0]:
+                            # Aynı kümedeki gruplar LLM tarafından zaten farklı bulundu
+                            continue
+                        kept_representative = final_groups[kept_key][0]
+                        similarity = cosine_similarity(vectors[representative], vectors[kept_representative])
+                        if fingerprints[representative] == fingerprints[kept_representative] \
+                                or is_near_duplicate(representative, kept_representative):
+                            self.tier_stats["cross_cluster_local"] += 1
+                            cross_comparisons.append((representative, kept_representative, True, similarity,
+                                                      "cross_cluster_local"))
+                            matched_key = kept_key
+                            break
+                        if similarity >= cluster_similarity:
+                            candidates[position] = cases[kept_representative]
+
+                    if matched_key is None and candidates:
+                        futures = self._dispatch_comparisons(executor, cases[representative], candidates, verdict_cache)
+                        try:
+                            for position in sorted(candidates):
+                                kept_representative = final_groups[kept_keys[position]][0]
+                                try:
+                                    is_same, resolved_by = futures[position].result(), "cross_cluster_llm"
+                                except Exception as e:
+                                    on_warning(f"LLM comparison failed: {e}")
+                                    is_same, resolved_by = False, "llm_failed"
+                                self.tier_stats["cross_cluster_llm"] += 1
+                                cross_comparisons.append((
+                                    representative, kept_representative, is_same,
+                                    cosine_similarity(vectors[representative], vectors[kept_representative]), resolved_by
+                                ))
+                                if is_same:
+                                    matched_key = kept_keys[position]
+                                    break
+                        finally:
+                            for future in futures.values():
+                                future.cancel()
+
+                    if matched_key is None:
+                        kept_keys.append(key)
+                    else:
+                        final_groups[matched_key] = sorted(final_groups[matched_key] + final_groups.pop(key))
+
+        unique_indices = []
+        for (cluster_id, _), group in sorted(final_groups.items()):
+            unique_indices.append(group[0])
+            if len(group) > 1:
+                self.duplicates.append({
+                    "ClusterID": cluster_id,
+                    "Representative": store.to_dict(case_ids[group[0]]),
+                    "Duplicates": [store.to_dict(case_ids[member]) for member in group[1:]]
+                })
+
+        step = 1
+        for cluster_id in sorted(cluster_groups):
+            groups, resolved_by = cluster_groups[cluster_id]
+            if resolved_by is not None:
+                self.comparison_logs.append(ClusterLog(
+                    step, cluster_id,
+                    [case_ids[member] for member in clusters[cluster_id - 1]],
+                    [[case_ids[member] for member in group] for group in groups],
+                    resolved_by
+                ))
+                step += 1
+        for representative, kept_representative, is_same, similarity, resolved_by in cross_comparisons:
+            self._log_comparison(step, case_ids[representative], case_ids[kept_representative], is_same, False,
+                                 similarity, resolved_by)
+            step += 1
+
+        if verdict_cache is not None:
+            verdict_cache.evict()
+            self.cache_stats = verdict_cache.stats()
 
         return TestCaseList(
-            test_cases=unique_cases,
+            test_cases=[cases[index] for index in sorted(unique_indices)],
             comparison_logs=self.comparison_logs,
-            duplicates=self.duplicates
+            duplicates=self.duplicates,
+            cache_stats=self.cache_stats,
+            tier_stats=self.tier_stats,
+            case_store=store
         )
 
     @staticmethod
-    def _query_llm_similarity(case1: "TestCase", case2: "TestCase") -> bool:
+    def _split_cluster_pairwise(cluster_cases: List["TestCase"],
+                                verdict_cache: Optional[PairVerdictCache] = None) -> List[List[int]]:
+        """
+        Kümeyi greedy ikili LLM karşılaştırmalarıyla gruplara ayırır (küme cevabı geçersiz olduğunda kullanılır).
+        verdict_cache verilmişse kararlar önce önbellekten okunur ve LLM'den gelenler önbelleğe yazılır.
+        """
+        groups = []
+        for index, case in enumerate(cluster_cases):
+            for group in groups:
+                try:
+                    if TestCaseList._query_llm_similarity(case, cluster_cases[group[0]], verdict_cache):
+                        group.append(index)
+                        break
+                except Exception:
+                    # Karar alınamayan çift farklı kabul edilir
+                    continue
+            else:
+                groups.append([index])
+        return groups
+
+    @staticmethod
+    def _query_llm_cluster(cluster_cases: List["TestCase"]) -> List[List[int]]:
+        """
+        Yerel benzerlikle oluşan bir kümeyi LLM'e tek istekte sorar. LLM her case'e bir grup numarası verir;
+        aynı gruptaki case'ler aynı kabul edilir. Küme içi indekslerden oluşan gruplar döndürür.
+        Cevap şemaya uymazsa ValueError fırlatır.
+        """
+        content = similarity_judge.group_cluster(cluster_cases)
+        try:
+            assignments = json.loads(content).get("assignments")
+        except (json.JSONDecodeError, AttributeError):
+            raise ValueError(f"LLM response is not valid JSON: {content}")
+
+        groups = {}
+        assigned = set()
+        for item in assignments if isinstance(assignments, list) else []:
+            index, group = (item.get("index"), item.get("group")) if isinstance(item, dict) else (None, None)
+            if not isinstance(index, int) or not isinstance(group, int) or not 0 <= index < len(cluster_cases) \
+                    or index in assigned:
+                raise ValueError(f"LLM cluster response has an invalid assignment: {item}")
+            assigned.add(index)
+            groups.setdefault(group, []).append(index)
+
+        if len(assigned) != len(cluster_cases):
+            raise ValueError(f"LLM cluster response does not assign every test case: {content}")
+
+        return sorted((sorted(members) for members in groups.values()), key=lambda members: members[0])
+
+    def _log_comparison(self, step, case_id, unique_id, is_same, skipped, similarity, resolved_by):
+        """
+        Bir karşılaştırmanın sonucunu case'lerin CaseStore indeksleriyle comparison_logs listesine ekler.
+        """
+        self.comparison_logs.append(
+            ComparisonLog(step, case_id, unique_id, is_same, skipped, round(similarity, 4), resolved_by)
+        )
+
+    @staticmethod
+    def _match_fingerprint(fingerprint, signature, unique_fingerprints, unique_signatures, near_duplicate_distance):
+        """
+        Case'i parmak izine göre mevcut unique case'lerle eşleştirir; SimHash eşleşmesinde en yakın unique case seçilir.
+        (unique indeksi, "exact" | "near_exact") ya da eşleşme yoksa (None, None) döndürür.
+        """
+        if fingerprint in unique_fingerprints:
+            return unique_fingerprints[fingerprint], "exact"
+
+        if near_duplicate_distance is not None and signature is not None:
+            # Mesafe sınırı içindeki en yakın imza seçilir; eşitlikte unique listede önce gelen kazanır
+            nearest_index, nearest_distance = None, near_duplicate_distance + 1
+            for index, unique_signature in enumerate(unique_signatures):
+                if unique_signature is None:
+                    continue
+                distance = hamming_distance(signature, unique_signature)
+                if distance < nearest_distance:
+                    nearest_index, nearest_distance = index, distance
+            if nearest_index is not None:
+                return nearest_index, "near_exact"
+
+        return None, None
+
+    def _dispatch_comparisons(self, executor, case, candidates, verdict_cache=None, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        case ile aday unique case'ler arasındaki LLM karşılaştırmalarını executor'a gönderir.
+        {unique indeksi: Future} sözlüğü döndürür. Bir karşılaştırma pozitif sonuçlanınca
+        ondan sonraki indekslere ait ve henüz başlamamış karşılaştırmalar iptal edilir;
+        daha küçük indeksler her zaman tamamlanır, böylece ilk eşleşme sıralı çalıştırmayla aynı kalır.
+        batch_size > 1 ise her grup tek bir toplu LLM isteğiyle değerlendirilir.
+        """
+        ordered_indices = sorted(candidates)
+        if batch_size and batch_size > 1:
+            futures = {index: Future() for index in ordered_indices}
+            for start in range(0, len(ordered_indices), batch_size):
+                executor.submit(
+                    self._run_comparison_batch, case, candidates, futures,
+                    ordered_indices[start:start + batch_size], verdict_cache
+                )
+        else:
+            futures = {
+                index: executor.submit(self._query_llm_similarity, case, candidates[index], verdict_cache)
+                for index in ordered_indices
+            }
+
+        def cancel_later_comparisons(matched_index):
+            def callback(future):
+                if future.cancelled() or future.exception() is not None or not future.result():
+                    return
+                for index, later_future in futures.items():
+                    if index > matched_index:
+                        later_future.cancel()
+            return callback
+
+        for index, future in futures.items():
+            future.add_done_callback(cancel_later_comparisons(index))
+        return futures
+
+    def _run_comparison_batch(self, case, candidates, futures, batch_indices, verdict_cache=None):
+        """
+        Bir grup adayı tek istekte değerlendirir ve sonuçları ilgili Future nesnelerine yazar.
+        İptal edilmiş Future'lara ait adaylar isteğe eklenmez.
+        """
+        active_indices = [index for index in batch_indices if futures[index].set_running_or_notify_cancel()]
+        if not active_indices:
+            return
+
+        try:
+            verdicts = self._query_llm_similarity_batch(
+                case, [candidates[index] for index in active_indices], verdict_cache
+            )
+        except Exception as e:
+            for index in active_indices:
+                futures[index].set_exception(e)
+            return
+
+        for index, verdict in zip(active_indices, verdicts):
+            futures[index].set_result(verdict)
+
+    @staticmethod
+    def _query_llm_similarity(case1: "TestCase", case2: "TestCase", verdict_cache: Optional[PairVerdictCache] = None) -> bool:
         """
         İki TestCase nesnesini LLM'e JSON formatında göndererek benzerlik (is_same) sonucunu döndürür.
+        verdict_cache verilmişse önce önbelleğe bakılır, LLM'den gelen karar önbelleğe yazılır.
         """
+        if verdict_cache is not None:
+            cached_verdict = verdict_cache.get(case1, case2)
+            if cached_verdict is not None:
+                return cached_verdict
 
-        # Create JSON objects
-        case1_json = case1.model_dump()
-        case2_json = case2.model_dump()
+        is_same = similarity_judge.is_same(case1, case2)
+        if verdict_cache is not None:
+            verdict_cache.put(case1, case2, is_same)
+        return is_same
 
-        # Pop the ScenarioID and TestCaseID keys
-        case1_json.pop("ScenarioID", None)
-        case1_json.pop("TestCaseID", None)
+    @staticmethod
+    def _query_llm_similarity_batch(case: "TestCase", unique_cases: List["TestCase"],
+                                    verdict_cache: Optional[PairVerdictCache] = None) -> List[bool]:
+        """
+        Bir TestCase'i birden fazla unique case ile tek bir yapılandırılmış LLM isteğinde karşılaştırır.
+        LLM'den {index, is_same} dizisi istenir ve unique_cases sırasıyla bir is_same listesi döndürülür.
+        Cevap şemaya uymazsa önbellekte olmayan çiftler tek tek _query_llm_similarity ile sorulur.
+        """
+        verdicts = [None] * len(unique_cases)
+        if verdict_cache is not None:
+            verdicts = [verdict_cache.get(case, unique_case) for unique_case in unique_cases]
 
-        case2_json.pop("ScenarioID", None)
-        case2_json.pop("TestCaseID", None)
+        pending = [index for index, verdict in enumerate(verdicts) if verdict is None]
+        if not pending:
+            return verdicts
 
-        # Prompt text for Smart Selection using LLM
-        prompt_text = f"""
-You are given two test cases, each with a certain set of fields:
-- Title
-- Description
-- Objective
+        content = similarity_judge.compare_batch(case, [unique_cases[index] for index in pending])
+        batch_verdicts = TestCaseList._parse_batch_verdicts(content, len(pending))
 
-You will decide whether these two test cases are “contextually the same” based on the following criteria:
+        if batch_verdicts is None:
+            # Şemaya uymayan cevap: çiftleri tek tek sor
+            for index in pending:
+                verdicts[index] = TestCaseList._query_llm_similarity(case, unique_cases[index], verdict_cache)
+            return verdicts
 
-1. If both have the same Title (case-insensitive) OR their Titles are substantially similar in meaning,
-2. AND they have either the same or very similar Description and/or Objective,
-3. AND they serve essentially the same testing purpose for the same or very closely related scenarios,
-4. THEN you should conclude that these two test cases are the same.
-5. The order of importance Description > Objective > Title.
+        for batch_index, index in enumerate(pending):
+            verdicts[index] = batch_verdicts[batch_index]
+            if verdict_cache is not None:
+                verdict_cache.put(case, unique_cases[index], verdicts[index])
+        return verdicts
 
-Otherwise, they are considered different.
+    @staticmethod
+    def _parse_batch_verdicts(content: str, expected_count: int) -> Optional[List[bool]]:
+        """
+        Toplu cevabı doğrular: her indeks 0..expected_count-1 aralığında tam bir kez bulunmalı
+        ve is_same boolean olmalıdır. Geçerliyse indeks sırasıyla is_same listesi, değilse None döndürür.
+        """
+        try:
+            results = json.loads(content).get("results")
+        except (json.JSONDecodeError, AttributeError):
+            return None
 
-Below are the two test cases in JSON format:
+        if not isinstance(results, list) or len(results) != expected_count:
+            return None
 
-TestCase1:
-{json.dumps(case1_json, indent=2, ensure_ascii=False)}
+        verdicts = {}
+        for item in results:
+            if not isinstance(item, dict):
+                return None
+            index, is_same = item.get("index"), item.get("is_same")
+            if not isinstance(index, int) or not isinstance(is_same, bool) or index in verdicts:
+                return None
+            if not 0 <= index < expected_count:
+                return None
+            verdicts[index] = is_same
 
-TestCase2:
-{json.dumps(case2_json, indent=2, ensure_ascii=False)}
+        return [verdicts[index] for index in range(expected_count)]
 
-Return your response **only** in valid JSON with the following format:
 
-{{
-  "is_same": <true or false>
-}}
+def case_state_key(case) -> str:
+    """
+    Case'in kalıcı durumdaki anahtarı: ScenarioID, TestCaseID ve içerik özeti.
+    Aynı ID ile yeniden üretilmiş farklı içerikli bir case yeni case olarak ele alınır.
+    """
+    return f"{case.ScenarioID}_{case.TestCaseID}:{exact_fingerprint(case)}"
 
-Where:
-- is_same = true if the test cases meet the criteria above
-- is_same = false otherwise
+# Artımlı çalıştırmada durumun kaç case'te bir kaydedileceği (kaldığı yerden devam için kontrol noktası)
+DEFAULT_CHECKPOINT_EVERY = 10
 
-Important:
-- Do not provide any additional text outside the JSON object.
-- Do not explain your reasoning, only provide the final JSON response.
-"""
-        print(prompt_text)
-        # Ollama üzerinden LLM'e istek
-        messages = [
-            {
-                "role": "user",
-                "content": prompt_text.strip()
-            }
-        ]
+def iter_incremental_smart_selection(process_title, selected_category, selected_test_type, test_cases,
+                                     checkpoint_every=DEFAULT_CHECKPOINT_EVERY, **smart_select_options):
+    """
+    Kombinasyon için kayıtlı durumu kullanarak yalnızca daha önce işlenmemiş case'leri ayıklar.
+    Yeni case'ler mevcut unique listeyle (ve birbirleriyle) karşılaştırılır.
+    iter_smart_select olaylarını üretir ve her checkpoint_every case'te bir durumu kaydeder;
+    çalıştırma yarıda kalırsa bir sonraki çağrı son kontrol noktasından devam eder.
+
+    Kayıtlı durum test_cases kapsamına indirgenir: test_cases içinde olmayan (seçimden çıkarılmış ya da aynı ID ile
+    farklı içerikle yeniden üretilmiş) unique case'ler başlangıç listesine alınmaz, eşleştiği unique case kapsam
+    dışında kalan benzer case'ler yeniden işlenir. Kaydedilen durum da yalnızca bu kapsamı içerir.
+    Olaylardaki processed/total, unique_count ve duplicate_count kayıtlı durumdan gelen case'leri de sayar.
+    Son olaydaki TestCaseList tüm unique case'leri ve tüm benzer case'leri, comparison_logs ise yalnızca bu çalıştırmanın loglarını içerir.
+    """
+    state = load_selection_state(process_title, selected_category, selected_test_type)
+    current_keys = {case_state_key(case) for case in test_cases}
 
-        response = chat(
-            messages=messages,
-            model='llama3.2',  # Örnek model ismi
-            format={
-                "type": "object",
-                "properties": {
-                    "is_same": {"type": "boolean"}
-                },
-                "required": ["is_same"]
-            },
+    # Kayıtlı unique ve benzer case'lerden yalnızca bu çalıştırmanın case'leri arasında olanlar kullanılır
+    prior_unique = [
+        case for case in (TestCase(**item) for item in state["unique_cases"]) if case_state_key(case) in current_keys
+    ]
+    unique_keys = {case_state_key(case) for case in prior_unique}
+    prior_duplicates = [
+        duplicate for duplicate in state["duplicates"]
+        if case_state_key(TestCase(**duplicate["DuplicateCase"])) in current_keys
+        and case_state_key(TestCase(**duplicate["MatchedWith"])) in unique_keys
+    ]
+    done_keys = unique_keys | {case_state_key(TestCase(**duplicate["DuplicateCase"])) for duplicate in prior_duplicates}
+    processed_keys = [key for key in state["processed_keys"] if key in done_keys]
+
+    new_cases = []
+    known_keys = set(done_keys)
+    for case in test_cases:
+        key = case_state_key(case)
+        if key not in known_keys:
+            known_keys.add(key)
+            new_cases.append(case)
+    new_keys = [case_state_key(case) for case in new_cases]
+
+    def save_checkpoint(unique_cases, processed_count, duplicates):
+        save_selection_state(
+            process_title, selected_category, selected_test_type,
+            unique_cases=[case.model_dump() for case in unique_cases],
+            processed_keys=processed_keys + new_keys[:processed_count],
+            duplicates=prior_duplicates + list(duplicates)
         )
 
-        content = response.get('message', {}).get('content', '').strip()
-        try:
-            parsed_content = json.loads(content)
-            return parsed_content.get("is_same", False)
-        except json.JSONDecodeError:
-            raise ValueError(f"LLM response is not valid JSON: {content}")
+    selection = TestCaseList(test_cases=new_cases)
+    for event in selection.iter_smart_select(initial_unique=prior_unique, **smart_select_options):
+        if event.get("done"):
+            result = event["result"]
+            save_checkpoint(result.test_cases, len(new_cases), result.duplicates)
+            yield {"done": True, "result": TestCaseList(
+                test_cases=result.test_cases,
+                comparison_logs=result.comparison_logs,
+                duplicates=prior_duplicates + result.duplicates,
+                cache_stats=result.cache_stats,
+                tier_stats=result.tier_stats,
+                case_store=result.case_store
+            )}
+            return
+
+        if event["processed"] % checkpoint_every == 0:
+            save_checkpoint(event["unique_cases"], event["processed"], event["duplicates"])
+        # unique_count kayıtlı unique case'leri zaten içerir; diğer sayılar da aynı kapsama getirilir
+        yield {
+            **event,
+            "processed": len(done_keys) + event["processed"],
+            "total": len(done_keys) + event["total"],
+            "duplicate_count": len(prior_duplicates) + event["duplicate_count"],
+        }
+
+def run_incremental_smart_selection(process_title, selected_category, selected_test_type, test_cases, **options):
+    """
+    iter_incremental_smart_selection'ı sonuna kadar çalıştırır ve son TestCaseList'i döndürür.
+    """
+    for event in iter_incremental_smart_selection(process_title, selected_category, selected_test_type, test_cases, **options):
+        pass
+    return event["result"]
 
 
 ###################################
-# 3) Streamlit Arayüz ve Mantık  #
+# 5) Streamlit Arayüz ve Mantık  #
 ###################################
 
 def main():
@@ -220,8 +1572,9 @@ def main():
     with st.expander("Workflow Steps", expanded=False):
         st.markdown("""
         ### 1. Fetch Valid Combinations
-        - Query MongoDB for combinations of `process_title`, `selected_category`, and `selected_test_type`.
+        - Query MongoDB for unique combinations of `process_title`, `selected_category`, and `selected_test_type` with an aggregation pipeline.
         - Filter out combinations with null values.
+        - The list is cached for a short time; use **Refresh Combinations** to reload it.
 
         ### 2. Select a Combination
         - Users are prompted to select a combination from the available options.
@@ -237,11 +1590,16 @@ def main():
 
         ### 5. Smart Selection
         - Once the user selects test cases, the **Smart Selection** process begins:
-            1. Test cases are compared using an LLM-based similarity check.
-            2. Similar test cases are added to the **Similar Cases** list.
-            3. Unique test cases are added to the **Unique Cases** list.
+            1. Test cases identical to an existing unique case (ignoring case and whitespace) or with a near-identical SimHash are collapsed without the LLM.
+            2. A local vector is computed for each remaining test case and only the **top-k** nearest unique cases are kept as candidates.
+            3. Candidates are compared using an LLM-based similarity check (several comparisons run concurrently), pruned pairs are logged as skipped.
+            4. Similar test cases are added to the **Similar Cases** list.
+            5. Unique test cases are added to the **Unique Cases** list.
+
+        - In **Cluster** mode, cases are grouped with a cheap local similarity graph instead, and the LLM is asked once per cluster to confirm or split it.
 
         ### 6. Display Results
+        - Progress and the unique test cases found so far are shown while the selection runs. Incremental runs are checkpointed, so a stopped run can be resumed.
         - After the process is completed, the following results are displayed:
             - Unique test cases.
             - Similar test cases.
@@ -290,7 +1648,12 @@ def main():
     if "fetched_test_cases" not in st.session_state:
         st.session_state.fetched_test_cases = []
 
-    # 1) Veritabanından geçerli kombinasyonları çek
+    if "selected_combination" not in st.session_state:
+        st.session_state.selected_combination = None
+
+    # 1) Veritabanından geçerli kombinasyonları çek (kısa süreli önbellekten)
+    if st.button("Refresh Combinations"):
+        fetch_valid_combinations.clear()
     combinations = fetch_valid_combinations()
 
     if combinations:
@@ -313,6 +1676,8 @@ def main():
             process_title = selected_entry["process_title"]
             selected_category = selected_entry["selected_category"]
             selected_test_type = selected_entry["selected_test_type"]
+            # Artımlı Smart Selection için seçili kombinasyonu hatırla
+            st.session_state.selected_combination = (process_title, selected_category, selected_test_type)
 
             # Detayları getir ve göster
             details = fetch_details_by_combination(process_title, selected_category, selected_test_type)
@@ -430,6 +1795,87 @@ def main():
     st.write("## Smart Selection")
     st.write("Smart selection process will compare the selected test cases using an LLM-based similarity check.")
 
+    # Ayıklama modu: greedy ilk eşleşme ya da kümeleme
+    selection_mode = st.radio(
+        "Deduplication mode",
+        ["greedy", "cluster"],
+        format_func=lambda mode: "Greedy (first match)" if mode == "greedy" else "Cluster (one LLM call per cluster)",
+        horizontal=True
+    )
+    cluster_similarity = DEFAULT_CLUSTER_SIMILARITY
+    if selection_mode == "cluster":
+        cluster_similarity = st.slider(
+            "Cluster link similarity",
+            min_value=0.0,
+            max_value=1.0,
+            value=DEFAULT_CLUSTER_SIMILARITY,
+            step=0.05,
+            help="Two cases whose local cosine similarity is above this value end up in the same cluster."
+        )
+
+    # LLM'e gönderilecek aday sayısını sınırlayan ön eleme ve eşzamanlılık ayarları
+    col_top_k, col_similarity, col_workers = st.columns(3)
+    with col_top_k:
+        top_k = st.number_input(
+            "Top-k nearest unique cases per comparison",
+            min_value=0,
+            value=DEFAULT_TOP_K,
+            step=1,
+            help="Only the k most similar unique cases are sent to the LLM. 0 disables the limit."
+        )
+    with col_similarity:
+        min_similarity = st.slider(
+            "Minimum cosine similarity",
+            min_value=0.0,
+            max_value=1.0,
+            value=DEFAULT_MIN_SIMILARITY,
+            step=0.05,
+            help="Pairs below this local similarity are skipped without asking the LLM."
+        )
+    with col_workers:
+        max_workers = st.number_input(
+            "Concurrent LLM comparisons",
+            min_value=1,
+            value=DEFAULT_MAX_WORKERS,
+            step=1,
+            help="Maximum number of similarity checks sent to the LLM at the same time. 1 runs them sequentially."
+        )
+
+    batch_size = st.number_input(
+        "Unique cases per LLM request",
+        min_value=1,
+        value=DEFAULT_BATCH_SIZE,
+        step=1,
+        help="Values above 1 judge one case against several unique cases in a single structured request. "
+             "Invalid batch responses fall back to per-pair requests."
+    )
+
+    near_duplicate_distance = st.slider(
+        "Near-exact SimHash distance (bits)",
+        min_value=0,
+        max_value=8,
+        value=DEFAULT_NEAR_DUPLICATE_DISTANCE,
+        help="Cases whose 64-bit SimHash signatures differ by at most this many bits are collapsed without the LLM."
+    )
+
+    incremental = st.checkbox(
+        "Resume / incremental (only process test cases not handled by the last run of this combination)",
+        value=False,
+        disabled=selection_mode != "greedy" or st.session_state.selected_combination is None,
+        help="Progress of the combination is saved every few test cases. A stopped run continues from its last "
+             "checkpoint and newly added test cases are only compared against the saved unique set. "
+             "Runs without this option leave the saved state untouched."
+    )
+    if st.session_state.selected_combination is not None and st.button("Reset Saved Smart Selection State"):
+        reset_selection_state(*st.session_state.selected_combination)
+        st.success("Saved Smart Selection state was reset for this combination.")
+
+    use_verdict_cache = st.checkbox(
+        "Reuse cached LLM verdicts",
+        value=True,
+        help="Pairs already judged with the same model and prompt version are answered from the cache."
+    )
+
     if st.button("Run Smart Selection"):
         selected_cases = []
         for case_dict in st.session_state.fetched_test_cases:
@@ -449,10 +1895,47 @@ def main():
                     st.warning(f"Skipping invalid test case: {item}. Error: {e}")
 
             if valid_data:
-                test_case_list = TestCaseList(test_cases=valid_data)
-                unique_test_cases = test_case_list.smart_select()
+                smart_select_options = dict(
+                    top_k=int(top_k) or None,
+                    min_similarity=min_similarity,
+                    max_workers=int(max_workers),
+                    verdict_cache=PairVerdictCache() if use_verdict_cache else None,
+                    near_duplicate_distance=near_duplicate_distance,
+                    batch_size=int(batch_size),
+                    mode=selection_mode,
+                    cluster_similarity=cluster_similarity,
+                    on_warning=st.warning
+                )
+                if incremental and selection_mode == "greedy" and st.session_state.selected_combination is not None:
+                    # Kayıtlı durumdan devam eden, kontrol noktalı çalıştırma; durum yalnızca Reset butonuyla silinir
+                    events = iter_incremental_smart_selection(
+                        *st.session_state.selected_combination, valid_data, **smart_select_options
+                    )
+                else:
+                    events = TestCaseList(test_cases=valid_data).iter_smart_select(**smart_select_options)
+
+                # İlerlemeyi ve bulunan unique case'leri işlendikçe göster
+                progress_bar = st.progress(0.0)
+                progress_text = st.empty()
+                st.write("#### Unique Test Cases Found")
+                unique_progress = st.container()
+                for event in events:
+                    if event.get("done"):
+                        unique_test_cases = event["result"]
+                        break
+                    progress_bar.progress(event["processed"] / event["total"])
+                    progress_text.write(
+                        f"Processed **{event['processed']}/{event['total']}** test cases - "
+                        f"unique: **{event['unique_count']}** - similar: **{event['duplicate_count']}**"
+                    )
+                    if not event["is_duplicate"]:
+                        unique_progress.write(f"- {event['case'].TestCaseID}: {event['case'].Title}")
+                progress_bar.progress(1.0)
 
                 st.success("Smart Selection completed!")
+
+                # Greedy modda her katmanın çözdüğü çift sayıları, cluster modunda küme sayıları
+                st.write(format_tier_stats(unique_test_cases.tier_stats))
                 
                 # Benzersiz test case'ler
                 with st.expander("Unique Test Cases", expanded=False):
@@ -466,14 +1949,23 @@ def main():
 
                 # Karşılaştırma logları
                 st.info("All comparison logs are here!", icon="ℹ️")
+                if unique_test_cases.cache_stats:
+                    st.write(
+                        f"Verdict cache hits: **{unique_test_cases.cache_stats['hits']}** - "
+                        f"misses: **{unique_test_cases.cache_stats['misses']}**"
+                    )
+                # Kompakt loglar yalnızca burada tam JSON'a dönüştürülür
+                comparison_logs = unique_test_cases.export_comparison_logs()
                 with st.expander("Comparison Logs", expanded=False):
-                    st.json(unique_test_cases.comparison_logs)
+                    st.json(comparison_logs)
 
                 # Download sonuçları
                 results = {
                     "unique_test_cases": [case.model_dump() for case in unique_test_cases.test_cases],
                     "similar_test_cases": unique_test_cases.duplicates,
-                    "comparison_logs": unique_test_cases.comparison_logs
+                    "comparison_logs": comparison_logs,
+                    "cache_stats": unique_test_cases.cache_stats,
+                    "tier_stats": unique_test_cases.tier_stats
                 }
 
                 results_unique_test_cases = {
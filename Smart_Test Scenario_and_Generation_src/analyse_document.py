@@ -5,14 +5,16 @@ The script uses the llama3.2 model to analyze the document content and return th
 with each test type containing a 'suitability' and 'explanation'. 
 """
 
-from llama_index.llms.ollama import Ollama
+from llm_client import DEFAULT_MODEL, get_llm
 from requests.exceptions import ConnectionError, Timeout
+from response_cache import llm_response_cache
+from retry_policy import RetryPolicy
 
 # Analyze the document content to determine its suitability for different types of testing
 # Input: document content (str)
 # Output: analysis results (str)
-def analyse_document(document):
-    """ This function analyzes the document content to determine its suitability for different types"""
+def analyse_document(document, use_cache=True):
+    """ This function analyzes the document content to determine its suitability for different types. With use_cache=False a cached analysis is not reused. """
 
     # This prompt tells the LLM how to analyze the document and what kind of test results are needed.
     prompt = """
@@ -73,9 +75,12 @@ def analyse_document(document):
     # Try to connect with the LLM and analyze the document. 
     # If there is a connection problem, it will handle it.
     try:
-        llm = Ollama(model="llama3.2", request_timeout=300.0, json_mode=False)
-        resp = llm.complete(prompt)
-        return resp.text
+        llm = get_llm(DEFAULT_MODEL, json_mode=False)
+        # The same prompt on the same model is answered from the response cache
+        return llm_response_cache.get_or_compute(
+            DEFAULT_MODEL, prompt, lambda: RetryPolicy().call(lambda: llm.complete(prompt)).text,
+            use_cache=use_cache, temperature=llm.temperature, json_mode=False
+        )
     # If there is a connection error or timeout, return an error message
     except (ConnectionError, Timeout) as e:
         return (f"Connection error or timeout occurred: {e}")
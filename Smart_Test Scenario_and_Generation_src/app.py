@@ -1,17 +1,24 @@
 """ This streamlit app is a smart test generation tool that helps users generate test scenarios based on the content of a document. """
 
 import streamlit as st
-from file_reader import read_txt, read_docx, read_xlsx, read_python
-from database import fetch_test_names, fetch_scenario_from_db, update_scenario_in_db, save_generated_prompt, get_db, get_sessions_collection, fetch_model_output_from_db
+from file_reader import READERS, DocumentCache, read_document
+from database import fetch_test_names, fetch_scenario_from_db, update_scenario_in_db, save_generated_prompt, get_db, get_sessions_collection, fetch_model_output_from_db, has_test_scenarios, save_test_scenarios, get_async_db
+from async_database import submit
 from session_manager import get_session_id
 from prompt_generate import generate_prompt
-from run_model import run_model_on_prompt, save_model_output_to_db
+from run_model import stream_model_on_prompt, save_model_output_to_db
 from analyse_document import analyse_document
 from run_judge import run_judge_on_prompt
 from validate_prompt import validate_combined_prompt
-from llama_index.llms.ollama import Ollama
 from requests.exceptions import ConnectionError, Timeout
-from generate_test_case import generate_json_structure, generate_test_case
+from generate_test_case import generate_json_structure
+from generation_scheduler import GENERATION_MAX_WORKERS, iter_generate_test_cases
+from document_chunker import PROMPT_TOKEN_BUDGET, build_chunk_prompts, iter_generate_chunk_scenarios, merge_scenarios
+from retry_policy import llm_circuit_breaker, retry_metrics
+from structured_output import GenerationStats
+from response_cache import llm_response_cache
+from index_manager import ensure_indexes
+from pymongo.errors import PyMongoError
 import json
 from create_special_test_prompt import generate_customise_base_prompt
 
@@ -35,9 +42,29 @@ session_id = get_session_id()
 # Database connection
 db = get_db()
 
+# Create the missing indexes of the hot queries once per process
+@st.cache_resource(show_spinner=False)
+def indexes_ready():
+    return ensure_indexes(db)
+
+try:
+    indexes_ready()
+except PyMongoError as e:
+    st.warning(f"Database indexes could not be created, lookups may be slow: {e}")
+
+# Generation requests and retries of this session
+if "generation_stats" not in st.session_state:
+    st.session_state.generation_stats = GenerationStats()
+
 # Set the title of the app
 st.title('Smart Test')
 
+# Opt-out of the LLM response cache for fresh document analyses and customised prompts
+use_llm_cache = st.sidebar.checkbox(
+    "Reuse cached LLM responses", value=True,
+    help="Document analyses and customised prompts of an identical request are answered from the cache. Uncheck for fresh sampling."
+)
+
 # Process Title input
 process_title = st.text_input("## Process Title", key="test_scenario_generation_process_name", placeholder="Enter the title of the process.")
 
@@ -67,39 +94,40 @@ if st.button("Save Process Title"):
 # File uploader widget
 uploaded_file = st.file_uploader("Upload file to use in smart test generation process.", type=['txt', 'docx', 'xlsx', 'py'])
 
+# Parsed uploads of this session, keyed by a hash of the file bytes, so that reruns do not parse the file again
+if "document_cache" not in st.session_state:
+    st.session_state.document_cache = DocumentCache()
+
+# Text of the uploaded document used in the prompts (None until a supported file is uploaded)
+document_content = None
+
 # Check if a file has been uploaded
 if uploaded_file is not None:
     # Extract file extension
     file_name = uploaded_file.name
     ext = file_name.split('.')[-1].lower()
 
-    # Process the file based on its extension
-    if ext == 'txt':
-        # Read the content of the uploaded file as text
-        document_content = read_txt(uploaded_file)
+    # Process the file based on its extension; the preview and the prompts share one parse
+    if ext in READERS:
+        document = read_document(uploaded_file, ext, st.session_state.document_cache)
+        document_content = document.content
 
-        
+    if ext == 'txt':
+        # Display the content of the file in an expander
         with st.expander('Text File Content'): 
-            st.text(document_content)
+            st.text(document.data)
     elif ext == 'docx':
-        # Read the content of the uploaded file as a docx file
-        document_content = read_docx(uploaded_file)
-
         # Display the content of the file in an expander
         with st.expander('DOCX File Content'):
-            st.text(document_content)
+            st.text(document.data)
     elif ext == 'xlsx':
-        df = read_xlsx(uploaded_file)
-
         # Display the content of the file in an expander
         with st.expander('Excel File Data'):
-            st.dataframe(df)
+            st.dataframe(document.data)
     elif ext == 'py':
-        document_content = read_python(uploaded_file)
-
         # Display the content of the file in an expander
         with st.expander('Python File Content'):
-            st.code(document_content, language='python')
+            st.code(document.data, language='python')
     else:
         # If the file type is not supported, show an error message
         st.error('Unsupported file type.')
@@ -117,7 +145,7 @@ if st.button("Analyse Document", key="analyse_document_content"):
         st.error("Please upload a file before analyzing the document content.")
     else:
         st.write(" document content...")
-        st.session_state.analyse_content = analyse_document(document_content)
+        st.session_state.analyse_content = analyse_document(document_content, use_cache=use_llm_cache)
         st.success("Document content analysed successfully!")
 
 # Show the analysis result in an expander if the content has been analysed
@@ -248,7 +276,7 @@ if selected_test_name:
         
         if test_prompt != "No test prompt available.":
             if not scenario_data.get("customised_prompt_status", False):
-                customised_prompt = generate_customise_base_prompt(selected_test_name, document_type, document_content, test_prompt)
+                customised_prompt = generate_customise_base_prompt(selected_test_name, document_type, document_content, test_prompt, use_cache=use_llm_cache)
                 if customised_prompt:
                     update_scenario_in_db(selected_test_name,{"test_prompt": customised_prompt, "customised_prompt_status": True},session_id=session_id)
             else:
@@ -475,6 +503,27 @@ if selected_test_name:
                 
                 # Save the generated prompt to session_state
                 st.session_state["combined_prompt"] = combined_prompt
+
+                # Split documents over the token budget into one prompt per document chunk
+                st.session_state["chunk_prompts"] = build_chunk_prompts(
+                    lambda content: generate_prompt(
+                        process_title,
+                        document_type,
+                        test_prompt,
+                        content,
+                        selected_test_name,
+                        selected_instruction_elements, 
+                        test_instruction_elements, 
+                        selected_scoring_elements, 
+                        test_scoring_elements
+                    ),
+                    document_content
+                )
+                if len(st.session_state["chunk_prompts"]) > 1:
+                    st.info(
+                        f"The document exceeds the prompt budget of {PROMPT_TOKEN_BUDGET} tokens, so its test scenarios "
+                        f"will be generated in {len(st.session_state['chunk_prompts'])} parts and merged."
+                    )
                 
                 # Save the generated prompt to the database
                 save_generated_prompt(session_id, combined_prompt)
@@ -506,18 +555,51 @@ if selected_test_name:
         #         st.warning("Please generate a prompt before running the model.")
         # Run Model with Generated Prompt button
         if st.button("Run Model on Generated Prompt"):
-            # Fetch the current session data
-            current_session = db["sessions"].find_one({"session_id": session_id})
-            
             # Check if a TestScenario already exists in the session
-            if current_session and "model_output" in current_session and "TestScenarios" in current_session["model_output"]:
+            if has_test_scenarios(session_id):
                 st.warning("A test scenario already exists in this session. Please proceed to create test cases.")
             else:
                 # Check if combined_prompt is available in session_state
                 if "combined_prompt" in st.session_state:
                     combined_prompt = st.session_state["combined_prompt"]
-                    # Take the model output
-                    model_output = run_model_on_prompt(selected_llm_model, combined_prompt)
+                    chunk_prompts = st.session_state.get("chunk_prompts", [combined_prompt])
+                    st.write("Generated test scenarios:")
+                    streamed_scenarios = st.container()
+
+                    def show_streamed_scenario(scenario):
+                        with streamed_scenarios.expander(f"{scenario['ScenarioID']}: {scenario['Title']}", expanded=False):
+                            st.json(scenario)
+
+                    if len(chunk_prompts) > 1:
+                        # Generate the scenarios of all document parts in parallel, show each part as it completes and merge them
+                        chunk_scenarios = [None] * len(chunk_prompts)
+                        progress_bar = st.progress(0.0, text=f"Generating test scenarios for {len(chunk_prompts)} document parts...")
+                        chunk_results = iter_generate_chunk_scenarios(
+                            selected_llm_model, chunk_prompts, stats=st.session_state.generation_stats
+                        )
+                        for completed, (index, scenarios, error) in enumerate(chunk_results, start=1):
+                            if error is not None:
+                                streamed_scenarios.error(f"Part {index + 1} of the document failed: {error}")
+                            elif scenarios is None:
+                                streamed_scenarios.error(f"No valid test scenarios were generated for part {index + 1} of the document.")
+                            else:
+                                with streamed_scenarios.expander(f"Part {index + 1}: {len(scenarios)} test scenarios", expanded=False):
+                                    st.json(scenarios)
+                            chunk_scenarios[index] = scenarios
+                            progress_bar.progress(
+                                completed / len(chunk_prompts), text=f"{completed} of {len(chunk_prompts)} document parts done"
+                            )
+                        merged_scenarios = merge_scenarios(chunk_scenarios, id_prefix=f"{process_title}_Test_Scenario_")
+                        st.write(f"Merged test scenarios ({len(merged_scenarios)}, duplicates across parts removed):")
+                        for scenario in merged_scenarios:
+                            show_streamed_scenario(scenario)
+                        model_output = {"TestScenarios": merged_scenarios} if merged_scenarios else None
+                    else:
+                        # Stream the model output and show every test scenario as soon as it is complete
+                        model_output = stream_model_on_prompt(
+                            selected_llm_model, combined_prompt, on_scenario=show_streamed_scenario,
+                            stats=st.session_state.generation_stats
+                        )
                     
                     # Check if the model output is available
                     if model_output:
@@ -529,7 +611,8 @@ if selected_test_name:
                         # Show a success message when the model output is saved
                         st.success("Test scenario created successfully and saved to the database!")
                     else:
-                        st.error("Model output validation failed.")
+                        # run_model/stream_model log the last error of the failed attempts
+                        st.error("No valid test scenarios could be generated after all retries. See the application log for the last error.")
                 else:
                     st.warning("Please generate a prompt before running the model.")
 
@@ -687,6 +770,15 @@ if selected_test_name:
 
         # Test Case Generation Model Selection
         test_case_generation_model = st.selectbox("Select an LLM model:", llm_models, key="test_case_generation_model")
+        # Number of scenarios generated at the same time (each model is also capped by MODEL_CONCURRENCY)
+        generation_workers = st.number_input(
+            "Parallel test case requests:",
+            min_value=1,
+            max_value=16,
+            value=GENERATION_MAX_WORKERS,
+            step=1,
+            key="generation_workers"
+        )
         
         # Create Test Case Button
         if st.button("Create Test Case"):
@@ -711,137 +803,96 @@ if selected_test_name:
                 # Call the generate_json_structure function to get the JSON structure for the test case
                 test_case_json_structure = generate_json_structure()
 
-            #     # Iterate over the test scenarios and generate test cases
-            #     for scenario in test_scenarios:
-            #         # Merge all the details into a single string
-            #         scenario_details = "\n".join(f"{key}: {value}" for key, value in scenario.items())
-
-            #         # Combine the selected test case prompts
-            #         combined_prompts = []
-            #         # Iterate over the selected test cases and add the prompts to the list
-            #         for test_case_type, is_selected in selected_test_cases.items():
-            #             # Check if the test case type is selected
-            #             if is_selected:
-            #                 # Get the specific prompt for the test case type
-            #                 specific_prompt = test_case_prompts.get(test_case_type, "")
-            #                 # Add the test case type and specific prompt to the combined prompts list
-            #                 combined_prompts.append(f"Test Case Type: {test_case_type}\n{specific_prompt}")
-                    
-            #         # Create a prompt for the scenario details
-            #         scenario_details_text = f"Scenario Details:\n{scenario_details}"
-
-            #         # For combined prompts, perform the merging process separately
-            #         combined_prompts_text = "Combined Test Case Prompts:\n" + "\n\n".join(combined_prompts)
-
-            #         # Convert the JSON structure to a string
-            #         test_case_structure_text = str(test_case_json_structure)
-
-            #         # Merge all the prompts and details into a single prompt
-            #         combined_prompt = (
-            #             f"{test_case_main_prompt}\n\n"
-            #             f"{scenario_details_text}\n\n"
-            #             f"{combined_prompts_text}\n\n"
-            #             f"{test_case_structure_text}\n\n"
-            #         )
-
-            #         # Try to generate a test case from the LLM and handle exceptions
-            #         try:
-            #             # Generate a test case from the combined prompt using the LLM model
-            #             test_case_llm_output_json = generate_test_case(test_case_generation_model, combined_prompt, max_retries=3)
-            #         except Exception as e:
-            #             # Show an error message if an exception occurs during test case generation from LLM
-            #             st.error(f"An error occurred while generating test case from LLM: {e}")
-            #             # Set the test case LLM output to an error message
-            #             test_case_llm_output_json = {"error": "Failed to generate test case"}
-
-            #         # Save the generated test case to the database
-            #         test_case_data = {
-            #             "scenario_id": scenario.get("ScenarioID", "Unknown"),
-            #             "combined_prompt": combined_prompt,
-            #             "test_case": test_case_llm_output_json
-            #         }
-            #         # Append the generated test case to the list
-            #         generated_test_cases.append(test_case_data)
-
-            #         # Update the scenario in the database with the generated test case
-            #         update_scenario_in_db(
-            #             selected_test_name,
-            #             test_case_data,
-            #             session_id=session_id
-            #         )
-
-            # # Show a success message if test cases are generated successfully
-            # if generated_test_cases:
-            #     st.success("Test cases created successfully and saved to the database!")
-            #     # Display the generated test cases in expanders
-            #     st.write("### Generated Test Cases")
-            #     # Iterate over the generated test cases and display them in expanders
-            #     for i, test_case in enumerate(generated_test_cases):
-            #         # Create an expander for each test case and display the test case inside it
-            #         with st.expander(f"Test Case {i + 1}: Scenario ID - {test_case['scenario_id']}", expanded=False):
-            #             st.json(test_case["test_case"])
-            # else:
-            #     # Show a warning message if no test cases are generated
-            #     st.warning("No test cases were generated. Please select at least one test case type.")
-            # Iterate over the test scenarios and generate test cases
-            for scenario in test_scenarios:
-                # Merge all the details into a single string
-                scenario_details = "\n".join(f"{key}: {value}" for key, value in scenario.items())
-
-                # Combine the selected test case prompts
-                combined_prompts = []
-                for test_case_type, is_selected in selected_test_cases.items():
-                    if is_selected:
-                        specific_prompt = test_case_prompts.get(test_case_type, "")
-                        combined_prompts.append(f"Test Case Type: {test_case_type}\n{specific_prompt}")
-
-                scenario_details_text = f"Scenario Details:\n{scenario_details}"
-                combined_prompts_text = "Combined Test Case Prompts:\n" + "\n\n".join(combined_prompts)
-                test_case_structure_text = str(test_case_json_structure)
-
-                # Merge all prompts into a single combined prompt
-                combined_prompt = (
-                    f"{test_case_main_prompt}\n\n"
-                    f"{scenario_details_text}\n\n"
-                    f"{combined_prompts_text}\n\n"
-                    f"{test_case_structure_text}\n\n"
+                # Build the combined prompt of each test scenario
+                scenario_prompts = []
+                for scenario in test_scenarios:
+                    # Merge all the details into a single string
+                    scenario_details = "\n".join(f"{key}: {value}" for key, value in scenario.items())
+
+                    # Combine the selected test case prompts
+                    combined_prompts = []
+                    for test_case_type, is_selected in selected_test_cases.items():
+                        if is_selected:
+                            specific_prompt = test_case_prompts.get(test_case_type, "")
+                            combined_prompts.append(f"Test Case Type: {test_case_type}\n{specific_prompt}")
+
+                    scenario_details_text = f"Scenario Details:\n{scenario_details}"
+                    combined_prompts_text = "Combined Test Case Prompts:\n" + "\n\n".join(combined_prompts)
+                    test_case_structure_text = str(test_case_json_structure)
+
+                    # Merge all prompts into a single combined prompt
+                    combined_prompt = (
+                        f"{test_case_main_prompt}\n\n"
+                        f"{scenario_details_text}\n\n"
+                        f"{combined_prompts_text}\n\n"
+                        f"{test_case_structure_text}\n\n"
+                    )
+                    scenario_prompts.append(combined_prompt)
+
+                # Store the scenarios one document each (also moves a legacy session's model output out of the session document)
+                save_test_scenarios(session_id, test_scenarios, db)
+
+                # Generate the test cases of all scenarios in parallel, save and show each scenario as it completes
+                test_case_outputs = [None] * len(test_scenarios)
+                save_futures = []
+                progress_bar = st.progress(0.0)
+                progress_text = st.empty()
+                generation_results = iter_generate_test_cases(
+                    test_case_generation_model, scenario_prompts, max_workers=int(generation_workers), max_retries=3,
+                    stats=st.session_state.generation_stats
                 )
+                for completed, (index, test_case_llm_output_json, error) in enumerate(generation_results, start=1):
+                    if error is not None:
+                        st.error(f"An error occurred while generating test case from LLM: {error}")
+                        test_case_llm_output_json = {"error": "Failed to generate test case"}
+                    test_case_outputs[index] = test_case_llm_output_json
+                    # Save the scenario's test cases on the database event loop without holding up the next results
+                    save_futures.append(submit(get_async_db().save_test_case_result(
+                        session_id, index, test_scenarios[index].get("ScenarioID", "Unknown"),
+                        scenario_prompts[index], test_case_llm_output_json, db.name
+                    )))
+
+                    progress_bar.progress(completed / len(test_scenarios))
+                    progress_text.write(
+                        f"Generated test cases for **{completed}/{len(test_scenarios)}** scenarios "
+                        f"(last: {test_scenarios[index].get('ScenarioID', 'Unknown')})"
+                    )
 
-                try:
-                    test_case_llm_output_json = generate_test_case(test_case_generation_model, combined_prompt, max_retries=3)
-                except Exception as e:
-                    st.error(f"An error occurred while generating test case from LLM: {e}")
-                    test_case_llm_output_json = {"error": "Failed to generate test case"}
-
-                test_case_data = {
-                    "scenario_id": scenario.get("ScenarioID", "Unknown"),
-                    "combined_prompt": combined_prompt,
-                    "test_case": test_case_llm_output_json,
-                }
-
-                generated_test_cases.append(test_case_data)
-
-            # Save `TestScenarios` and `TestCases` in `model_output`
-            model_output_to_save = {
-                "TestScenarios": test_scenarios,  # Assuming `test_scenarios` contains original scenario details
-                "TestCases": generated_test_cases,  # Assuming `generated_test_cases` contains test case outputs
-            }
-
-            # Call the updated save function to save in the 'sessions' collection
-            save_model_output_to_db(session_id, model_output_to_save, db)
-
-            # Confirmation message
-            if generated_test_cases:
-                st.success("Test cases created successfully and saved to the database!")
-                st.write("### Generated Test Cases")
-                for i, test_case in enumerate(generated_test_cases):
-                    with st.expander(f"Test Case {i + 1}: Scenario ID - {test_case['scenario_id']}", expanded=False):
-                        st.json(test_case["test_case"])
-            else:
-                st.warning("No test cases were generated. Please select at least one test case type.")
+                # Wait until every scenario's test cases are saved
+                for save_future in save_futures:
+                    save_future.result()
+
+                # Reassemble the generated test cases in scenario order
+                for scenario, combined_prompt, test_case_llm_output_json in zip(test_scenarios, scenario_prompts, test_case_outputs):
+                    test_case_data = {
+                        "scenario_id": scenario.get("ScenarioID", "Unknown"),
+                        "combined_prompt": combined_prompt,
+                        "test_case": test_case_llm_output_json,
+                    }
+
+                    generated_test_cases.append(test_case_data)
+
+                # Confirmation message
+                if generated_test_cases:
+                    st.success("Test cases created successfully and saved to the database!")
+                    st.write("### Generated Test Cases")
+                    for i, test_case in enumerate(generated_test_cases):
+                        with st.expander(f"Test Case {i + 1}: Scenario ID - {test_case['scenario_id']}", expanded=False):
+                            st.json(test_case["test_case"])
+                else:
+                    st.warning("No test cases were generated. Please select at least one test case type.")
 
 
 
     else:
         # Show a warning message if the required fields are not provided
-        st.info("Please provide all the required inputs!",icon="ℹ️")
\ No newline at end of file
+        st.info("Please provide all the required inputs!",icon="ℹ️")
+
+# LLM retry and cache metrics of this server process, shown in the sidebar after every run of the script
+with st.sidebar.expander("LLM Metrics", expanded=False):
+    st.write(f"Circuit state: **{llm_circuit_breaker.state}**")
+    st.json(retry_metrics.snapshot())
+    st.write("Generation requests of this session")
+    st.json(st.session_state.generation_stats.snapshot())
+    st.write("LLM response cache")
+    st.json(llm_response_cache.stats())
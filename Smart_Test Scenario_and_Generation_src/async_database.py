@@ -0,0 +1,411 @@
+""" This module is the asynchronous MongoDB data access layer of the app (Motor), with configurable connection pools and timeouts and a background event loop for synchronous callers. """
+
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+
+from bson.binary import Binary
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, UpdateOne
+
+# MongoDB URI and database name
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "modular_test_scenario_gen")
+
+# Connection pool size per client and timeouts (milliseconds; a socket timeout of 0 waits without limit)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 0))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 10000))
+
+# Seconds the current default prompt version is reused before default_prompts is read again
+DEFAULT_PROMPTS_REFRESH_SECONDS = int(os.getenv("DEFAULT_PROMPTS_REFRESH_SECONDS", 300))
+
+# Max number of (database, session_id, test_name) scenarios kept in the in-process scenario cache, and the seconds
+# a cached scenario is reused; another app process may change the session's overrides within this time
+SCENARIO_CACHE_MAX_ENTRIES = int(os.getenv("SCENARIO_CACHE_MAX_ENTRIES", 1000))
+SCENARIO_CACHE_TTL_SECONDS = float(os.getenv("SCENARIO_CACHE_TTL_SECONDS", 60))
+
+# Test case prompts larger than this many bytes are stored zlib-compressed
+LARGE_PROMPT_THRESHOLD_BYTES = int(os.getenv("LARGE_PROMPT_THRESHOLD_BYTES", 16 * 1024))
+
+# Build the client options of the Motor clients (and of the pymongo clients they wrap)
+def client_options():
+    """ Returns the pool size and timeout options of a MongoDB client. """
+    return {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS or None,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    }
+
+# Default prompt sets by version (a version never changes) and the current version with the time it was read
+_prompt_sets = {}
+_current_prompt_set = {"version": None, "loaded_at": 0.0}
+
+# (resolved scenario, time.monotonic() when loaded) by (database name, session_id, test_name), least recently used first
+_scenario_cache = OrderedDict()
+_scenario_cache_lock = threading.Lock()
+
+# field name of a test's overrides in prompt_overrides
+def override_key(test_name):
+    """ Returns the test name as a field name; dots and a leading $ are not allowed in MongoDB field names. """
+    key = test_name.replace(".", "\uff0e")
+    return "\uff04" + key[1:] if key.startswith("$") else key
+
+# merge a default prompt with the session's overrides
+def resolve_prompt(default_prompt, overrides):
+    """ Returns the effective prompt: the default prompt with the overridden fields replaced. """
+    if default_prompt is None:
+        return None
+    return {**default_prompt, "customised_prompt_status": False, **(overrides or {})}
+
+# remove cached scenarios after a write
+def invalidate_scenario_cache(session_id, test_name=None):
+    """
+    Drops the cached scenario of (session_id, test_name), or every cached scenario of the session if test_name is None,
+    in every database.
+    """
+    with _scenario_cache_lock:
+        for key in [key for key in _scenario_cache if key[1] == session_id and test_name in (None, key[2])]:
+            del _scenario_cache[key]
+
+# forget the cached default prompts, e.g. after switching to another database
+def reset_prompt_caches():
+    _prompt_sets.clear()
+    _current_prompt_set.update(version=None, loaded_at=0.0)
+    with _scenario_cache_lock:
+        _scenario_cache.clear()
+
+# fields that store a test case prompt
+def pack_prompt(prompt):
+    """ Returns the prompt as text, or as zlib-compressed bytes if it is larger than LARGE_PROMPT_THRESHOLD_BYTES. """
+    data = (prompt or "").encode("utf-8")
+    if len(data) > LARGE_PROMPT_THRESHOLD_BYTES:
+        return {"combined_prompt": None, "combined_prompt_zlib": Binary(zlib.compress(data))}
+    return {"combined_prompt": prompt, "combined_prompt_zlib": None}
+
+# read a test case prompt stored by pack_prompt
+def unpack_prompt(document):
+    """ Returns the test case prompt of a test_scenarios document. """
+    if document.get("combined_prompt_zlib") is not None:
+        return zlib.decompress(document["combined_prompt_zlib"]).decode("utf-8")
+    return document.get("combined_prompt")
+
+class AsyncDatabase:
+    """
+    Asynchronous access to the app's collections. Motor clients are bound to an event loop, so one client
+    (with its own connection pool) is created lazily per event loop that uses this object.
+    """
+
+    def __init__(self, uri=MONGO_URI, database_name=MONGO_DB_NAME, client_factory=AsyncIOMotorClient, **options):
+        self.uri = uri
+        self.database_name = database_name
+        self.client_factory = client_factory
+        self.options = {**client_options(), **options}
+        self._clients = weakref.WeakKeyDictionary()  # event loop -> client
+        self._lock = threading.Lock()
+
+    def client(self):
+        """ Returns the client of the running event loop. """
+        return self.client_for_loop(asyncio.get_running_loop())
+
+    def client_for_loop(self, loop):
+        """ Returns the client bound to the event loop, which may be running in another thread. """
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = self.client_factory(self.uri, io_loop=loop, **self.options)
+                self._clients[loop] = client
+            return client
+
+    def database(self, name=None):
+        return self.client()[name or self.database_name]
+
+    def close(self):
+        """ Closes the clients of all event loops. """
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), weakref.WeakKeyDictionary()
+        for client in clients:
+            client.close()
+
+    async def fetch_test_names(self):
+        return [doc["test_name"] async for doc in self.database()["default_prompts"].find({}, {"test_name": 1})]
+
+    async def publish_default_prompt_set(self):
+        """
+        Reads the default_prompts collection and stores it in default_prompt_versions under the SHA-256 of its content.
+        An unchanged collection maps to the existing version. Returns the version.
+        """
+        prompts = await self.database()["default_prompts"].find().to_list(None)
+        payload = json.dumps(prompts, sort_keys=True, default=str, ensure_ascii=False)
+        version = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        await self.database()["default_prompt_versions"].update_one(
+            {"_id": version},
+            {"$setOnInsert": {"prompts": prompts, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        _prompt_sets[version] = {prompt["test_name"]: prompt for prompt in prompts}
+        return version
+
+    async def get_current_prompt_set_version(self):
+        """ Returns the version of the current default prompts, publishing it at most every DEFAULT_PROMPTS_REFRESH_SECONDS. """
+        if _current_prompt_set["version"] is None or time.monotonic() - _current_prompt_set["loaded_at"] > DEFAULT_PROMPTS_REFRESH_SECONDS:
+            _current_prompt_set["version"] = await self.publish_default_prompt_set()
+            _current_prompt_set["loaded_at"] = time.monotonic()
+        return _current_prompt_set["version"]
+
+    async def get_default_prompt_set(self, version):
+        """ Returns {test_name: default prompt} of the version; versions are immutable, so each is read only once per process. """
+        if version not in _prompt_sets:
+            document = await self.database()["default_prompt_versions"].find_one({"_id": version})
+            _prompt_sets[version] = {prompt["test_name"]: prompt for prompt in (document or {}).get("prompts", [])}
+        return _prompt_sets[version]
+
+    async def load_scenario(self, test_name, session_id=None):
+        """
+        Returns the scenario of the test without the rest of the session document: only the prompt set version
+        and the test's overrides are fetched, or with $elemMatch the test's element of a legacy original_prompts copy.
+        """
+        session_data = await self.database()["sessions"].find_one(
+            {"session_id": session_id},
+            {
+                "_id": 0,
+                "prompt_set_version": 1,
+                f"prompt_overrides.{override_key(test_name)}": 1,
+                "original_prompts": {"$elemMatch": {"test_name": test_name}},
+            }
+        )
+        if not session_data:
+            return None
+
+        if "prompt_set_version" in session_data:
+            prompt_set = await self.get_default_prompt_set(session_data["prompt_set_version"])
+            return resolve_prompt(
+                prompt_set.get(test_name),
+                session_data.get("prompt_overrides", {}).get(override_key(test_name))
+            )
+
+        # legacy session with a full copy of the default prompts
+        return next(iter(session_data.get("original_prompts", [])), None)
+
+    async def fetch_scenario(self, test_name, session_id=None):
+        """
+        Returns a copy of the session's scenario of the test, cached in-process by (database, session_id, test_name).
+        update_scenario of this process drops the entry; a change made by another process is seen once the entry
+        is older than SCENARIO_CACHE_TTL_SECONDS.
+        """
+        key = (self.database_name, session_id, test_name)
+        scenario = None
+        with _scenario_cache_lock:
+            entry = _scenario_cache.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= SCENARIO_CACHE_TTL_SECONDS:
+                scenario = entry[0]
+                _scenario_cache.move_to_end(key)
+        if scenario is None:
+            scenario = await self.load_scenario(test_name, session_id)
+            if scenario is None:
+                return None
+            with _scenario_cache_lock:
+                _scenario_cache[key] = (scenario, time.monotonic())
+                _scenario_cache.move_to_end(key)
+                while len(_scenario_cache) > SCENARIO_CACHE_MAX_ENTRIES:
+                    _scenario_cache.popitem(last=False)
+        # The pages edit nested fields of the scenario in place, so the cached scenario is never handed out
+        return copy.deepcopy(scenario)
+
+    async def update_scenario(self, test_name, updated_data, session_id=None):
+        """ Stores the updated fields as overrides of the session's default prompt set (or in a legacy original_prompts copy). """
+        collection = self.database()["sessions"]
+        result = await collection.update_one(
+            {"session_id": session_id, "prompt_set_version": {"$exists": True}},
+            {"$set": {f"prompt_overrides.{override_key(test_name)}.{key}": value for key, value in updated_data.items()}}
+        )
+        if not result.matched_count:
+            # legacy session: update the copied prompt in original_prompts
+            await collection.update_one(
+                {"session_id": session_id, "original_prompts.test_name": test_name},
+                {"$set": {f"original_prompts.$.{key}": value for key, value in updated_data.items()}}
+            )
+
+        # the cached scenario is read again on the next fetch
+        invalidate_scenario_cache(session_id, test_name)
+
+    async def initialize_session(self, session_id):
+        """ Creates the session with a reference to the current default prompts, without copying them. """
+        version = await self.get_current_prompt_set_version()
+        if await self.get_default_prompt_set(version):
+            await self.database()["sessions"].update_one(
+                {"session_id": session_id},
+                {"$setOnInsert": {"prompt_set_version": version, "prompt_overrides": {}}},
+                upsert=True  # an existing session with the same id is kept
+            )
+            invalidate_scenario_cache(session_id)
+
+    async def save_generated_prompt(self, session_id, prompt):
+        await self.database()["sessions"].update_one(
+            {"session_id": session_id}, {"$set": {"generated_prompt": prompt}}, upsert=True
+        )
+
+    async def save_test_scenarios(self, session_id, test_scenarios, database_name=None):
+        """
+        Upserts one test_scenarios document per scenario, keyed by (session_id, scenario_index), and removes the
+        scenarios and test cases of an earlier, longer result. A scenario whose content changed loses the test case
+        status and prompt of its old content, and its old test cases are removed.
+        """
+        database = self.database(database_name)
+        collection = database["test_scenarios"]
+        stored = {
+            document["scenario_index"]: document.get("scenario")
+            async for document in collection.find({"session_id": session_id}, {"_id": 0, "scenario_index": 1, "scenario": 1})
+        }
+        changed = [index for index, scenario in enumerate(test_scenarios) if stored.get(index) != scenario]
+        operations = [
+            UpdateOne(
+                {"session_id": session_id, "scenario_index": index},
+                {
+                    "$set": {"scenario_id": test_scenarios[index].get("ScenarioID", "Unknown"), "scenario": test_scenarios[index]},
+                    "$unset": {"test_case_status": "", "test_case_error": "", "combined_prompt": "", "combined_prompt_zlib": ""},
+                },
+                upsert=True
+            )
+            for index in changed
+        ]
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+        await collection.delete_many({"session_id": session_id, "scenario_index": {"$gte": len(test_scenarios)}})
+        await database["test_cases"].delete_many({
+            "session_id": session_id,
+            "$or": [{"scenario_index": {"$gte": len(test_scenarios)}}, {"scenario_index": {"$in": changed}}],
+        })
+
+    async def save_test_case_result(self, session_id, scenario_index, scenario_id, combined_prompt, test_case, database_name=None):
+        """
+        Saves the result of one scenario's test case generation: the prompt and the status on the scenario's
+        test_scenarios document and one test_cases document per test case, keyed by (session_id, scenario_index, case_index).
+        test_case is the LLM output ({"TestCases": [...]}) or {"error": ...} if the generation failed.
+        """
+        database = self.database(database_name)
+        cases = [] if "error" in test_case else test_case.get("TestCases", [])
+        operations = [
+            UpdateOne(
+                {"session_id": session_id, "scenario_index": scenario_index, "case_index": case_index},
+                {"$set": {"scenario_id": scenario_id, "test_case": case}},
+                upsert=True
+            )
+            for case_index, case in enumerate(cases)
+        ]
+        if operations:
+            await database["test_cases"].bulk_write(operations, ordered=False)
+        await database["test_cases"].delete_many(
+            {"session_id": session_id, "scenario_index": scenario_index, "case_index": {"$gte": len(cases)}}
+        )
+        await database["test_scenarios"].update_one(
+            {"session_id": session_id, "scenario_index": scenario_index},
+            {"$set": {
+                "scenario_id": scenario_id,
+                "test_case_status": "error" if "error" in test_case else "generated",
+                "test_case_error": test_case.get("error"),
+                **pack_prompt(combined_prompt),
+            }},
+            upsert=True
+        )
+
+    async def save_model_output(self, session_id, model_output, database_name=None):
+        """ Saves the scenarios and, if the output has TestCases, the test cases of every scenario concurrently. """
+        await self.save_test_scenarios(session_id, model_output.get("TestScenarios", []), database_name)
+        await asyncio.gather(*(
+            self.save_test_case_result(
+                session_id, scenario_index, test_case_data.get("scenario_id", "Unknown"),
+                test_case_data.get("combined_prompt"), test_case_data.get("test_case") or {}, database_name
+            )
+            for scenario_index, test_case_data in enumerate(model_output.get("TestCases", []))
+        ))
+
+    async def has_test_scenarios(self, session_id, database_name=None):
+        """ Returns True if the session has test scenarios, in test_scenarios or in a legacy model_output. """
+        database = self.database(database_name)
+        if await database["test_scenarios"].find_one({"session_id": session_id}, {"_id": 1}) is not None:
+            return True
+        return await database["sessions"].find_one(
+            {"session_id": session_id, "model_output.TestScenarios": {"$exists": True}}, {"_id": 1}
+        ) is not None
+
+    async def fetch_model_output(self, session_id):
+        """
+        Returns {"TestScenarios": [...]} and, once test cases were generated, "TestCases": [{"scenario_id",
+        "combined_prompt", "test_case"}] in scenario order; the model_output of a legacy session; or None.
+        """
+        database = self.database()
+        scenarios = await database["test_scenarios"].find(
+            {"session_id": session_id}, {"_id": 0}
+        ).sort("scenario_index", ASCENDING).to_list(None)
+        if not scenarios:
+            # legacy session with the model output in the session document
+            document = await database["sessions"].find_one({"session_id": session_id}, {"model_output": 1})
+            return document["model_output"] if document and "model_output" in document else None
+
+        model_output = {"TestScenarios": [document["scenario"] for document in scenarios if "scenario" in document]}
+        if any("test_case_status" in document for document in scenarios):
+            cases = defaultdict(list)
+            test_case_documents = database["test_cases"].find(
+                {"session_id": session_id}, {"_id": 0, "scenario_index": 1, "test_case": 1}
+            ).sort([("scenario_index", ASCENDING), ("case_index", ASCENDING)])
+            async for document in test_case_documents:
+                cases[document["scenario_index"]].append(document["test_case"])
+            model_output["TestCases"] = [
+                {
+                    "scenario_id": document["scenario_id"],
+                    "combined_prompt": unpack_prompt(document),
+                    "test_case": (
+                        {"error": document["test_case_error"]} if document["test_case_status"] == "error"
+                        else {"TestCases": cases[document["scenario_index"]]}
+                    ),
+                }
+                for document in scenarios if "test_case_status" in document
+            ]
+        return model_output
+
+# Shared by the synchronous facade in database.py and the asynchronous callers
+async_db = AsyncDatabase()
+
+# Event loop of the synchronous callers, running in a daemon thread
+_background = {"loop": None, "thread": None}
+_background_lock = threading.Lock()
+
+def get_background_loop():
+    """ Returns the background event loop, starting it on first use. """
+    with _background_lock:
+        if _background["loop"] is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="async-database", daemon=True)
+            thread.start()
+            _background.update(loop=loop, thread=thread)
+        return _background["loop"]
+
+# Schedule a coroutine on the background loop without waiting for it
+def submit(coroutine):
+    """ Runs the coroutine on the background event loop and returns its concurrent.futures.Future. """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_background_loop())
+
+# Run a coroutine from synchronous code
+def run_sync(coroutine, timeout=None):
+    """ Runs the coroutine on the background event loop and returns its result; must not be called from that loop. """
+    if threading.current_thread() is _background["thread"]:
+        coroutine.close()
+        raise RuntimeError("run_sync() cannot wait for the background event loop from inside it; await the coroutine instead.")
+    return submit(coroutine).result(timeout)
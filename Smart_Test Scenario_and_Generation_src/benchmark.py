@@ -0,0 +1,637 @@
+"""
+This script measures the generator's LLM request path against the stub Ollama server (tools/stub_ollama.py),
+and the session lookups with and without indexes against the MongoDB server of MONGO_URI.
+
+Usage:
+    python benchmark.py clients --requests 50
+    python benchmark.py generation --scenarios 30 --concurrency 1,2,4
+    python benchmark.py retries --requests 50 --fail-rate 0.3 --bad-json-rate 0.2
+    python benchmark.py structured --requests 100 --partial-rate 0.4 --bad-json-rate 0.1
+    python benchmark.py streaming --requests 10 --items 10 --latency-ms 2000
+    python benchmark.py chunks --pages 200
+    python benchmark.py indexes --sessions 10000,100000,1000000
+    python benchmark.py sessions --sessions 200
+    python benchmark.py fetch --reruns 200 --model-output-mb 4
+    python benchmark.py model-output --scenarios 100,500 --cases 5
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+import bson
+from llama_index.llms.ollama import Ollama
+
+import async_database
+import database
+import document_chunker
+import index_manager
+import generation_scheduler
+import llm_client
+import retry_policy
+import structured_output
+
+# The stub server is shared by both tools (tools/stub_ollama.py in the repository root)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import stub_ollama
+from generate_test_case import generate_test_case
+from generation_scheduler import iter_generate_test_cases
+from prompt_generate import generate_prompt
+from run_model import run_model_on_prompt, save_model_output_to_db, stream_model_on_prompt
+
+BENCHMARK_PROMPT = "Generate test scenarios for the login page. Return the TestScenarios JSON structure."
+
+# Start a fresh stub server in a background thread
+def start_stub_server(args):
+    """ Starts a stub server on a free port and returns (server, base_url). """
+    server = stub_ollama.create_server(
+        port=0, connect_ms=args.connect_ms, latency_ms=args.latency_ms,
+        items=getattr(args, "items", 3), fail_rate=getattr(args, "fail_rate", 0.0),
+        bad_json_rate=getattr(args, "bad_json_rate", 0.0), partial_rate=getattr(args, "partial_rate", 0.0),
+        prose_rate=getattr(args, "prose_rate", 0.0), seed=0
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# Previous request path: a new Ollama object (and HTTP client) for every request
+def complete_with_new_client(base_url, model, prompt):
+    llm = Ollama(model=model, base_url=base_url, request_timeout=300.0, json_mode=True)
+    return llm.complete(prompt)
+
+# Current request path: the shared client from llm_client
+def complete_with_registry(base_url, model, prompt):
+    return llm_client.get_llm(model, json_mode=True).complete(prompt)
+
+def run_clients_benchmark(args):
+    variants = {
+        "new Ollama per request": complete_with_new_client,
+        "llm_client registry": complete_with_registry,
+    }
+
+    print(f"{'variant':<26}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'connections':>13}{'/api/show':>11}")
+    for name, complete in variants.items():
+        server, base_url = start_stub_server(args)
+        llm_client.OLLAMA_BASE_URL = base_url
+        llm_client.reset_llm_clients()
+        try:
+            durations = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                complete(base_url, args.model, BENCHMARK_PROMPT)
+                durations.append((time.perf_counter() - start) * 1000)
+
+            # The full run_model path must work against the same server
+            if run_model_on_prompt(args.model, BENCHMARK_PROMPT) is None:
+                print("Warning: run_model_on_prompt returned no scenarios")
+            stats = server.RequestHandlerClass.stats.snapshot()
+        finally:
+            llm_client.reset_llm_clients()
+            server.shutdown()
+            server.server_close()
+
+        p95 = sorted(durations)[max(0, int(len(durations) * 0.95) - 1)]
+        print(f"{name:<26}{statistics.mean(durations):>10.1f}{statistics.median(durations):>10.1f}{p95:>10.1f}"
+              f"{stats['connections']:>13}{stats['show']:>11}")
+
+def run_generation_benchmark(args):
+    server, base_url = start_stub_server(args)
+    llm_client.OLLAMA_BASE_URL = base_url
+    llm_client.reset_llm_clients()
+    prompts = [
+        f"Scenario Details:\nScenarioID: Bench_Test_Scenario_{index}\n\nReturn the \"TestCases\" JSON structure."
+        for index in range(args.scenarios)
+    ]
+
+    try:
+        # Previous "Create Test Case" loop: one scenario after the other
+        start = time.perf_counter()
+        for prompt in prompts:
+            generate_test_case(args.model, prompt, max_retries=3)
+        sequential = time.perf_counter() - start
+
+        print(f"{'variant':<28}{'wall s':>10}{'speedup':>10}")
+        print(f"{'sequential':<28}{sequential:>10.2f}{1.0:>10.2f}")
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            generation_scheduler.MODEL_CONCURRENCY[args.model] = concurrency
+            generation_scheduler._model_semaphores.clear()
+
+            start = time.perf_counter()
+            results = [None] * len(prompts)
+            for index, output, error in iter_generate_test_cases(args.model, prompts, max_workers=concurrency):
+                results[index] = error or output
+            elapsed = time.perf_counter() - start
+
+            failed = sum(1 for result in results if not isinstance(result, dict))
+            label = f"scheduler, concurrency {concurrency}"
+            print(f"{label:<28}{elapsed:>10.2f}{sequential / elapsed:>10.2f}" + (f"  ({failed} failed)" if failed else ""))
+    finally:
+        llm_client.reset_llm_clients()
+        server.shutdown()
+        server.server_close()
+
+# Generate the test cases of every prompt and return (successes, wall seconds)
+def generate_all(model, prompts):
+    successes = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        try:
+            generate_test_case(model, prompt, max_retries=3)
+            successes += 1
+        except Exception:
+            pass
+    return successes, time.perf_counter() - start
+
+def run_retries_benchmark(args):
+    retry_policy.RETRY_BASE_DELAY = args.base_delay
+    prompts = [f"Scenario Details:\nScenarioID: Bench_Test_Scenario_{index}\n\nReturn the \"TestCases\" JSON structure." for index in range(args.requests)]
+
+    print(f"{'variant':<34}{'ok':>6}{'wall s':>9}{'transport':>11}{'schema':>8}{'fast fail':>11}")
+    def report(name, successes, elapsed):
+        metrics = retry_policy.retry_metrics.snapshot()
+        print(f"{name:<34}{successes:>6}{elapsed:>9.2f}{metrics['transport_retries']:>11}"
+              f"{metrics['schema_retries']:>8}{metrics['fast_failures']:>11}")
+
+    # Faulty server: injected 503s and truncated JSON are retried within their own budgets
+    server, base_url = start_stub_server(args)
+    llm_client.OLLAMA_BASE_URL = base_url
+    llm_client.reset_llm_clients()
+    try:
+        retry_policy.retry_metrics.reset()
+        successes, elapsed = generate_all(args.model, prompts)
+        report(f"faulty server ({args.fail_rate:.0%} 503, {args.bad_json_rate:.0%} bad JSON)", successes, elapsed)
+        stats = server.RequestHandlerClass.stats.snapshot()
+        print(f"  stub: {stats['requests']} requests, {stats['failed']} injected 503, {stats['bad_json']} truncated JSON")
+    finally:
+        llm_client.reset_llm_clients()
+        server.shutdown()
+        server.server_close()
+
+    # Server down: without the circuit breaker every call spends its whole transport budget
+    server, base_url = start_stub_server(args)
+    server.server_close()
+    llm_client.OLLAMA_BASE_URL = base_url
+    llm_client.reset_llm_clients()
+    for name, threshold in (("server down, no circuit breaker", 10 ** 9), ("server down, circuit breaker", retry_policy.CIRCUIT_FAILURE_THRESHOLD)):
+        retry_policy.llm_circuit_breaker.record_success()
+        retry_policy.llm_circuit_breaker.failure_threshold = threshold
+        retry_policy.retry_metrics.reset()
+        successes, elapsed = generate_all(args.model, prompts)
+        report(name, successes, elapsed)
+    retry_policy.llm_circuit_breaker.failure_threshold = retry_policy.CIRCUIT_FAILURE_THRESHOLD
+    llm_client.reset_llm_clients()
+
+# Previous run_model path: clean the text and discard the whole answer when one scenario misses a key
+def legacy_run_model(model, prompt, max_retries=3):
+    """ Returns (test scenarios or None, number of LLM requests). """
+    llm = llm_client.get_llm(model, json_mode=True)
+    for attempt in range(1, max_retries + 1):
+        text = llm.complete(prompt).text.replace('\n', '').replace('\\n', '').replace('\\"', '"')
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict) and all(
+            all(key in scenario for key in structured_output.SCENARIO_KEYS) for scenario in data.get("TestScenarios", [None])
+        ):
+            return data, attempt
+    return None, max_retries
+
+def run_structured_benchmark(args):
+    print(f"{'variant':<30}{'requests':>10}{'full regen':>12}{'repairs':>9}{'scenarios':>11}{'failed':>8}")
+
+    # Previous path, plain JSON mode
+    server, base_url = start_stub_server(args)
+    llm_client.OLLAMA_BASE_URL = base_url
+    llm_client.reset_llm_clients()
+    try:
+        requests, scenarios, failed = 0, 0, 0
+        for _ in range(args.requests):
+            output, used = legacy_run_model(args.model, BENCHMARK_PROMPT)
+            requests += used
+            scenarios += len(output["TestScenarios"]) if output else 0
+            failed += output is None
+        print(f"{'previous (json, discard all)':<30}{requests:>10}{requests - args.requests + failed:>12}{0:>9}{scenarios:>11}{failed:>8}")
+    finally:
+        llm_client.reset_llm_clients()
+        server.shutdown()
+        server.server_close()
+
+    # Current path with salvage and repair, first in plain JSON mode and then with the JSON schema format
+    for name, use_schema in (("salvage + repair (json)", False), ("salvage + repair (schema)", True)):
+        server, base_url = start_stub_server(args)
+        llm_client.OLLAMA_BASE_URL = base_url
+        llm_client.reset_llm_clients()
+        structured_output.STRUCTURED_OUTPUT = use_schema
+        stats = structured_output.GenerationStats()
+        try:
+            scenarios, failed = 0, 0
+            for _ in range(args.requests):
+                output = run_model_on_prompt(args.model, BENCHMARK_PROMPT, stats=stats)
+                scenarios += len(output["TestScenarios"]) if output else 0
+                failed += output is None
+        finally:
+            llm_client.reset_llm_clients()
+            server.shutdown()
+            server.server_close()
+        counts = stats.snapshot()
+        print(f"{name:<30}{counts['requests'] + counts['repair_requests']:>10}{counts['invalid_responses'] - failed:>12}"
+              f"{counts['repair_requests']:>9}{scenarios:>11}{failed:>8}")
+    structured_output.STRUCTURED_OUTPUT = True
+
+# Time to the first scenario and to the full answer of one generation
+def time_generation(generate, model, prompt):
+    """ Returns (seconds to the first scenario or None, total seconds). """
+    first = []
+    start = time.perf_counter()
+    output = generate(model, prompt, lambda scenario: first or first.append(time.perf_counter() - start))
+    total = time.perf_counter() - start
+    if output and not first:
+        first.append(total)
+    return (first[0] if first else None), total
+
+def run_streaming_benchmark(args):
+    variants = {
+        "blocking (run_model)": lambda model, prompt, on_scenario: run_model_on_prompt(model, prompt, max_retries=1),
+        "streaming (stream_model)": lambda model, prompt, on_scenario: stream_model_on_prompt(model, prompt, on_scenario, max_retries=1),
+    }
+
+    print(f"{'variant':<28}{'answer':<12}{'first scenario s':>18}{'total s':>10}")
+    for answer, prose_rate, use_schema in (("valid", 0.0, True), ("malformed", 1.0, False)):
+        args.prose_rate = prose_rate
+        structured_output.STRUCTURED_OUTPUT = use_schema
+        for name, generate in variants.items():
+            server, base_url = start_stub_server(args)
+            llm_client.OLLAMA_BASE_URL = base_url
+            llm_client.reset_llm_clients()
+            try:
+                timings = [time_generation(generate, args.model, BENCHMARK_PROMPT) for _ in range(args.requests)]
+            finally:
+                llm_client.reset_llm_clients()
+                server.shutdown()
+                server.server_close()
+            firsts = [first for first, _ in timings if first is not None]
+            first_text = f"{statistics.mean(firsts):.2f}" if firsts else "-"
+            print(f"{name:<28}{answer:<12}{first_text:>18}{statistics.mean(total for _, total in timings):>10.2f}")
+    structured_output.STRUCTURED_OUTPUT = True
+
+# Build a requirement document of about the given number of pages (~1500 characters per page)
+def make_long_document(pages):
+    rng = random.Random(0)
+    sections = []
+    for chapter in range(1, pages // 4 + 2):
+        sections.append(f"{chapter}. MODULE {chapter} REQUIREMENTS")
+        for section in range(1, 6):
+            sections.append(f"{chapter}.{section} Feature {section}")
+            sections.append(" ".join(
+                f"The system shall handle case {chapter}.{section}.{number} with input validation and error messages."
+                for number in range(rng.randint(10, 20))
+            ))
+    return "\n\n".join(sections)[:pages * 1500]
+
+def run_chunks_benchmark(args):
+    document = make_long_document(args.pages)
+    build_prompt = lambda content: generate_prompt(
+        "Bench", "Requirement Document", "Generate functional test scenarios.", content, "Functional Tests", {}, {}, {}, {}
+    )
+    prompts = document_chunker.build_chunk_prompts(build_prompt, document, token_budget=args.budget)
+    print(f"document: {len(document)} characters, ~{document_chunker.estimate_tokens(document)} tokens")
+    print(f"single prompt: ~{document_chunker.estimate_tokens(build_prompt(document))} tokens")
+    print(f"chunked: {len(prompts)} prompts, max ~{max(document_chunker.estimate_tokens(prompt) for prompt in prompts)} tokens "
+          f"(budget {args.budget})")
+
+    server, base_url = start_stub_server(args)
+    llm_client.OLLAMA_BASE_URL = base_url
+    llm_client.reset_llm_clients()
+    try:
+        for concurrency in (int(value) for value in args.concurrency.split(",")):
+            generation_scheduler.MODEL_CONCURRENCY[args.model] = concurrency
+            generation_scheduler._model_semaphores.clear()
+            start = time.perf_counter()
+            chunk_scenarios = [None] * len(prompts)
+            for index, scenarios, _ in document_chunker.iter_generate_chunk_scenarios(args.model, prompts, max_workers=concurrency):
+                chunk_scenarios[index] = scenarios
+            merged = document_chunker.merge_scenarios(chunk_scenarios, id_prefix="Bench_Test_Scenario_")
+            failed = sum(1 for scenarios in chunk_scenarios if scenarios is None)
+            print(f"concurrency {concurrency}: {time.perf_counter() - start:.2f} s, {len(merged)} merged scenarios"
+                  + (f", {failed} chunks failed" if failed else ""))
+    finally:
+        llm_client.reset_llm_clients()
+        server.shutdown()
+        server.server_close()
+
+# Build a synthetic session document like the ones the app stores
+def make_session(number, rng):
+    return {
+        "session_id": str(uuid.UUID(int=rng.getrandbits(128))),
+        "process_title": f"Process {number}",
+        "selected_category": rng.choice(["Functional Tests", "Non-Functional Tests"]),
+        "selected_test_type": rng.choice(["Unit Test", "Integration Test", "Performance Test", "Security Test"]),
+        "prompt_set_version": "0" * 64,
+        "prompt_overrides": {"Test 3": {"test_prompt": "x" * 200, "customised_prompt_status": True}},
+        "generated_prompt": "x" * 500,
+    }
+
+# Median and p95 latency (ms) of one find_one, averaged over the session, prompt override and process_title shapes
+def time_lookups(collection, sample, lookups):
+    durations = []
+    for session in sample[:lookups]:
+        start = time.perf_counter()
+        collection.find_one({"session_id": session["session_id"]})
+        collection.find_one({"session_id": session["session_id"]}, {"prompt_set_version": 1, "prompt_overrides.Test 3": 1})
+        collection.find_one({"process_title": session["process_title"]})
+        durations.append((time.perf_counter() - start) * 1000 / 3)
+    durations.sort()
+    return statistics.median(durations), durations[max(0, int(len(durations) * 0.95) - 1)]
+
+def run_indexes_benchmark(args):
+    db = database.client[args.database]
+    collection = db["sessions"]
+    collection.drop()
+    rng = random.Random(0)
+    sample = []
+    try:
+        print(f"{'sessions':>10}{'no index p50':>14}{'p95 ms':>9}{'indexed p50':>13}{'p95 ms':>9}{'explain':>10}")
+        for size in (int(value) for value in args.sessions.split(",")):
+            # Grow the collection to size without indexes
+            collection.drop_indexes()
+            while collection.estimated_document_count() < size:
+                batch = [make_session(number, rng) for number in range(
+                    collection.estimated_document_count(), min(size, collection.estimated_document_count() + 10000))]
+                collection.insert_many(batch)
+                sample.extend(rng.sample(batch, min(len(batch), args.lookups)))
+            rng.shuffle(sample)
+            plain = time_lookups(collection, sample, args.lookups)
+
+            index_manager.ensure_indexes(db, [spec for spec in index_manager.INDEX_SPECS if spec["collection"] == "sessions"])
+            indexed = time_lookups(collection, sample, args.lookups)
+            shapes = [shape for shape in index_manager.QUERY_SHAPES if shape["collection"] == "sessions"]
+            collscans = sum(report["collscan"] for report in index_manager.explain_query_shapes(db, shapes))
+            print(f"{size:>10}{plain[0]:>14.2f}{plain[1]:>9.2f}{indexed[0]:>13.3f}{indexed[1]:>9.3f}"
+                  f"{(f'{collscans} scans' if collscans else 'IXSCAN'):>10}")
+    finally:
+        database.client.drop_database(args.database)
+
+# Point the database module and the async data access layer at a scratch database
+@contextlib.contextmanager
+def scratch_database(name):
+    """ Yields the scratch database, drops it afterwards and restores the production database. """
+    production_db, production_name = database.db, async_database.async_db.database_name
+    database.db = database.client[name]
+    async_database.async_db.database_name = name
+    async_database.reset_prompt_caches()
+    try:
+        yield database.db
+    finally:
+        database.client.drop_database(name)
+        database.db = production_db
+        async_database.async_db.database_name = production_name
+        async_database.reset_prompt_caches()
+
+# Previous session creation: a full copy of default_prompts in every session
+def legacy_initialize_session(session_id):
+    data = list(database.get_default_prompts_collection().find())
+    for item in data:
+        item["customised_prompt_status"] = False
+    database.get_sessions_collection().insert_one({"session_id": session_id, "original_prompts": data})
+
+def run_sessions_benchmark(args):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_data", "default_prompts.json"), encoding="utf-8") as f:
+        default_prompts = json.load(f)
+    for prompt in default_prompts:
+        prompt.pop("_id", None)
+
+    with scratch_database(args.database):
+        database.db["default_prompts"].insert_many(default_prompts)
+        variants = {
+            "copy default_prompts": legacy_initialize_session,
+            "prompt set + overrides": database.initialize_session,
+        }
+        print(f"{len(default_prompts)} default prompts, {args.sessions} sessions per variant")
+        print(f"{'variant':<26}{'create mean ms':>16}{'p95 ms':>9}{'bytes/session':>15}{'edited bytes':>14}")
+        for name, initialize in variants.items():
+            database.db["sessions"].drop()
+            async_database.reset_prompt_caches()
+            durations = []
+            for number in range(args.sessions):
+                start = time.perf_counter()
+                initialize(f"bench_{number:06d}")
+                durations.append((time.perf_counter() - start) * 1000)
+
+            # Session size before and after the user customised the prompt of one test
+            session = database.db["sessions"].find_one({"session_id": "bench_000000"})
+            size = len(bson.encode(session))
+            test_name = default_prompts[0]["test_name"]
+            database.update_scenario_in_db(test_name, {"test_prompt": "Customised " + default_prompts[0]["test_prompt"],
+                                                       "customised_prompt_status": True}, session_id="bench_000000")
+            edited_size = len(bson.encode(database.db["sessions"].find_one({"session_id": "bench_000000"})))
+            if database.fetch_scenario_from_db(test_name, session_id="bench_000000")["customised_prompt_status"] is not True:
+                print("Warning: the customised prompt was not read back")
+
+            durations.sort()
+            p95 = durations[max(0, int(len(durations) * 0.95) - 1)]
+            print(f"{name:<26}{statistics.mean(durations):>16.2f}{p95:>9.2f}{size:>15}{edited_size:>14}")
+
+# Previous scenario fetch: the whole session document, searched in Python
+def legacy_fetch_scenario(test_name, session_id):
+    session_data = database.get_sessions_collection().find_one({"session_id": session_id})
+    if session_data:
+        return next((prompt for prompt in session_data.get("original_prompts", []) if prompt["test_name"] == test_name), None)
+    return None
+
+def run_fetch_benchmark(args):
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_data", "default_prompts.json"), encoding="utf-8") as f:
+        default_prompts = json.load(f)
+    for prompt in default_prompts:
+        prompt.pop("_id", None)
+        prompt["customised_prompt_status"] = False
+    test_name = default_prompts[-1]["test_name"]
+
+    # A session with a large generation result, as after Run Model and Create Test Case
+    scenarios = [{"ScenarioID": f"S{number}", "Title": f"Scenario {number}", "Description": "x" * 400} for number in range(200)]
+    model_output = {"TestScenarios": scenarios, "TestCases": []}
+    while len(bson.encode(model_output)) < args.model_output_mb * 1024 * 1024:
+        model_output["TestCases"].append({"scenario_id": "S1", "combined_prompt": "y" * 20000, "test_case": {"TestCases": scenarios[:5]}})
+
+    with scratch_database(args.database):
+        database.db["default_prompts"].insert_many([dict(prompt) for prompt in default_prompts])
+        database.db["sessions"].insert_one({"session_id": "legacy", "original_prompts": default_prompts,
+                                            "generated_prompt": "z" * 50000, "model_output": model_output})
+        database.initialize_session("current")
+        database.get_sessions_collection().update_one(
+            {"session_id": "current"}, {"$set": {"generated_prompt": "z" * 50000, "model_output": model_output}})
+
+        variants = {
+            "full document + scan": legacy_fetch_scenario,
+            "projection": database.load_scenario_from_db,
+            "projection + cache": database.fetch_scenario_from_db,
+        }
+        print(f"session document: {len(bson.encode(database.get_sessions_collection().find_one({'session_id': 'legacy'}))) / 1024 / 1024:.1f} MB, "
+              f"{args.reruns} fetches of '{test_name}' per variant")
+        print(f"{'variant':<24}{'session':<10}{'mean ms':>10}{'p95 ms':>10}")
+        for name, fetch in variants.items():
+            for session_id in ("legacy", "current"):
+                if fetch is legacy_fetch_scenario and session_id == "current":
+                    continue
+                async_database.invalidate_scenario_cache(session_id)
+                durations = []
+                for _ in range(args.reruns):
+                    start = time.perf_counter()
+                    scenario = fetch(test_name, session_id)
+                    durations.append((time.perf_counter() - start) * 1000)
+                if not scenario or scenario["test_name"] != test_name:
+                    print(f"Warning: {name} returned no scenario for the {session_id} session")
+                durations.sort()
+                p95 = durations[max(0, int(len(durations) * 0.95) - 1)]
+                print(f"{name:<24}{session_id:<10}{statistics.mean(durations):>10.3f}{p95:>10.3f}")
+
+# Synthetic Create Test Case result: scenarios, and per scenario its prompt and generated test cases
+def make_model_output(scenario_count, case_count, prompt_chars):
+    scenarios = [{"ScenarioID": f"Bench_Test_Scenario_{number}", "Title": f"Scenario {number}", "Description": "d" * 400,
+                  "Objective": "o" * 200, "Category": "Functional", "Comments": ""} for number in range(scenario_count)]
+    test_cases = [
+        {
+            "scenario_id": scenario["ScenarioID"],
+            "combined_prompt": f"Scenario Details:\n{scenario['ScenarioID']}\n" + "Test Case Type: Positive\n" * (prompt_chars // 24),
+            "test_case": {"TestCases": [{"ScenarioID": scenario["ScenarioID"], "TestCaseID": f"TC{number}", "Title": "t" * 80,
+                                         "Description": "d" * 600, "Objective": "o" * 200, "Category": "Positive",
+                                         "Comments": ""} for number in range(case_count)]},
+        }
+        for scenario in scenarios
+    ]
+    return {"TestScenarios": scenarios, "TestCases": test_cases}
+
+def run_model_output_benchmark(args):
+    print(f"{'scenarios':>10}{'layout':>12}{'largest doc MB':>16}{'save ms':>10}{'per-scenario save ms':>22}{'fetch ms':>10}")
+    with scratch_database(args.database) as db:
+        for scenario_count in (int(value) for value in args.scenarios.split(",")):
+            model_output = make_model_output(scenario_count, args.cases, args.prompt_chars)
+            for name in ("session", "normalized"):
+                for collection in ("sessions", "test_scenarios", "test_cases"):
+                    db[collection].drop()
+                index_manager.ensure_indexes(db, [spec for spec in index_manager.INDEX_SPECS
+                                                  if spec["collection"] in ("sessions", "test_scenarios", "test_cases")])
+
+                start = time.perf_counter()
+                if name == "session":
+                    # Previous layout: one $set of the whole model_output on the session document
+                    document_size = len(bson.encode({"model_output": model_output}))
+                    if document_size > 16 * 1024 * 1024:
+                        print(f"{scenario_count:>10}{name:>12}{document_size / 1024 / 1024:>16.1f}   exceeds the 16 MB document limit")
+                        continue
+                    db["sessions"].update_one({"session_id": "bench"}, {"$set": {"model_output": model_output}}, upsert=True)
+                else:
+                    save_model_output_to_db("bench", model_output, db)
+                save_ms = (time.perf_counter() - start) * 1000
+
+                # Saving the result of one more scenario while Create Test Case runs
+                last = model_output["TestCases"][-1]
+                start = time.perf_counter()
+                if name == "session":
+                    db["sessions"].update_one({"session_id": "bench"}, {"$set": {"model_output": model_output}})
+                else:
+                    database.save_test_case_result("bench", scenario_count - 1, last["scenario_id"], last["combined_prompt"], last["test_case"], db)
+                scenario_ms = (time.perf_counter() - start) * 1000
+
+                start = time.perf_counter()
+                fetched = database.fetch_model_output_from_db("bench")
+                fetch_ms = (time.perf_counter() - start) * 1000
+                if fetched != model_output:
+                    print(f"Warning: the {name} layout did not return the saved model output")
+
+                largest = max(len(bson.encode(document)) for collection in ("sessions", "test_scenarios", "test_cases")
+                              for document in db[collection].find())
+                print(f"{scenario_count:>10}{name:>12}{largest / 1024 / 1024:>16.3f}{save_ms:>10.1f}{scenario_ms:>22.2f}{fetch_ms:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Smart Test generator benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    clients = subparsers.add_parser("clients", help="per-request cost: new Ollama client vs shared llm_client registry")
+    clients.add_argument("--requests", type=int, default=50, help="sequential requests per variant")
+    clients.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    clients.add_argument("--connect-ms", type=float, default=20.0, help="stub: simulated cost of a new connection")
+    clients.add_argument("--latency-ms", type=float, default=50.0, help="stub: simulated generation time")
+    clients.set_defaults(handler=run_clients_benchmark)
+
+    generation = subparsers.add_parser("generation", help="wall-clock time of test case generation: sequential vs scheduler")
+    generation.add_argument("--scenarios", type=int, default=30, help="number of scenarios in the session")
+    generation.add_argument("--concurrency", default="1,2,4", help="comma-separated per-model concurrency caps")
+    generation.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    generation.add_argument("--connect-ms", type=float, default=20.0, help="stub: simulated cost of a new connection")
+    generation.add_argument("--latency-ms", type=float, default=500.0, help="stub: simulated generation time")
+    generation.set_defaults(handler=run_generation_benchmark)
+
+    retries = subparsers.add_parser("retries", help="retry policy under injected faults and with the server down")
+    retries.add_argument("--requests", type=int, default=50, help="test case generations per variant")
+    retries.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    retries.add_argument("--fail-rate", type=float, default=0.3, help="stub: share of requests answered with HTTP 503")
+    retries.add_argument("--bad-json-rate", type=float, default=0.2, help="stub: share of truncated JSON answers")
+    retries.add_argument("--base-delay", type=float, default=0.2, help="backoff base delay in seconds")
+    retries.add_argument("--connect-ms", type=float, default=20.0, help="stub: simulated cost of a new connection")
+    retries.add_argument("--latency-ms", type=float, default=20.0, help="stub: simulated generation time")
+    retries.set_defaults(handler=run_retries_benchmark)
+
+    structured = subparsers.add_parser("structured", help="LLM requests per scenario answer: discard-all vs salvage/repair vs JSON schema")
+    structured.add_argument("--requests", type=int, default=100, help="scenario generations per variant")
+    structured.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    structured.add_argument("--items", type=int, default=5, help="stub: scenarios per answer")
+    structured.add_argument("--partial-rate", type=float, default=0.4, help="stub: share of JSON answers with one incomplete scenario")
+    structured.add_argument("--bad-json-rate", type=float, default=0.1, help="stub: share of truncated JSON answers")
+    structured.add_argument("--connect-ms", type=float, default=0.0, help="stub: simulated cost of a new connection")
+    structured.add_argument("--latency-ms", type=float, default=0.0, help="stub: simulated generation time")
+    structured.set_defaults(handler=run_structured_benchmark)
+
+    streaming = subparsers.add_parser("streaming", help="time to first scenario and to abort a malformed answer: blocking vs streaming")
+    streaming.add_argument("--requests", type=int, default=10, help="scenario generations per variant")
+    streaming.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    streaming.add_argument("--items", type=int, default=10, help="stub: scenarios per answer")
+    streaming.add_argument("--connect-ms", type=float, default=0.0, help="stub: simulated cost of a new connection")
+    streaming.add_argument("--latency-ms", type=float, default=2000.0, help="stub: simulated generation time of one answer")
+    streaming.set_defaults(handler=run_streaming_benchmark)
+
+    chunks = subparsers.add_parser("chunks", help="map-reduce scenario generation for a long document")
+    chunks.add_argument("--pages", type=int, default=200, help="document length in pages (~1500 characters each)")
+    chunks.add_argument("--budget", type=int, default=document_chunker.PROMPT_TOKEN_BUDGET, help="token budget per prompt")
+    chunks.add_argument("--concurrency", default="1,4", help="comma-separated per-model concurrency caps")
+    chunks.add_argument("--model", default=llm_client.DEFAULT_MODEL)
+    chunks.add_argument("--items", type=int, default=5, help="stub: scenarios per answer")
+    chunks.add_argument("--connect-ms", type=float, default=0.0, help="stub: simulated cost of a new connection")
+    chunks.add_argument("--latency-ms", type=float, default=500.0, help="stub: simulated generation time per chunk")
+    chunks.set_defaults(handler=run_chunks_benchmark)
+
+    indexes = subparsers.add_parser("indexes", help="session lookup latency without and with the indexes of index_manager")
+    indexes.add_argument("--sessions", default="10000,100000,1000000", help="comma-separated collection sizes")
+    indexes.add_argument("--lookups", type=int, default=200, help="lookups of each query shape per size")
+    indexes.add_argument("--database", default="modular_test_scenario_gen_benchmark", help="scratch database, dropped afterwards")
+    indexes.set_defaults(handler=run_indexes_benchmark)
+
+    sessions = subparsers.add_parser("sessions", help="session creation time and size: copied default prompts vs prompt set references")
+    sessions.add_argument("--sessions", type=int, default=200, help="sessions created per variant")
+    sessions.add_argument("--database", default="modular_test_scenario_gen_benchmark", help="scratch database, dropped afterwards")
+    sessions.set_defaults(handler=run_sessions_benchmark)
+
+    fetch = subparsers.add_parser("fetch", help="scenario fetch on every rerun: full session document vs projection vs cache")
+    fetch.add_argument("--reruns", type=int, default=200, help="fetches per variant")
+    fetch.add_argument("--model-output-mb", type=float, default=4.0, help="size of the session's model_output")
+    fetch.add_argument("--database", default="modular_test_scenario_gen_benchmark", help="scratch database, dropped afterwards")
+    fetch.set_defaults(handler=run_fetch_benchmark)
+
+    model_output = subparsers.add_parser("model-output", help="storage of generated scenarios and test cases: session document vs normalized collections")
+    model_output.add_argument("--scenarios", default="100,500", help="comma-separated scenario counts")
+    model_output.add_argument("--cases", type=int, default=5, help="test cases per scenario")
+    model_output.add_argument("--prompt-chars", type=int, default=30000, help="size of each scenario's test case prompt")
+    model_output.add_argument("--database", default="modular_test_scenario_gen_benchmark", help="scratch database, dropped afterwards")
+    model_output.set_defaults(handler=run_model_output_benchmark)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 """ This module generates a specialized test prompt based on the provided inputs, including a document's type, content, and a selected test name. The generated prompt is customized to align with the selected test name and the document's characteristics, ensuring precise and context-specific test scenario generation. The resulting prompt is designed to guide the creation of high-quality test scenarios that adhere to ISTQB standards and methodologies. The module utilizes the llama3.2 model through the Ollama. """
 
-from llama_index.llms.ollama import Ollama
-from requests.exceptions import ConnectionError, Timeout
+from llm_client import DEFAULT_MODEL, get_llm
+from requests.exceptions import ConnectionError
+from response_cache import llm_response_cache
+from retry_policy import SCHEMA_ERROR, TRANSPORT_ERROR, CircuitOpenError, RetryPolicy, classify_error
 import json
 
 # Function to create a specialized test prompt based on the provided inputs
@@ -63,53 +65,51 @@ def create_customise_test_prompt(selected_test_name, document_type, document_con
 
 
 # Function to generate a specialized test prompt based on the provided inputs
-def generate_customise_base_prompt(selected_test_name, document_type, document_content, test_prompt, max_retries=3):
+def generate_customise_base_prompt(selected_test_name, document_type, document_content, test_prompt, max_retries=3, use_cache=True):
     """
     This function generates a specialized test prompt based on the provided inputs, including a document's type, content, and a selected test name.
     The generated prompt is customized to align with the selected test name and the document's characteristics, ensuring precise and context-specific test scenario generation.
     The resulting prompt is designed to guide the creation of high-quality test scenarios that adhere to ISTQB standards and methodologies.
     The function handles potential connection errors and retries the request up to a maximum. Max retries can be adjusted as needed but the default is 3.
+    Generated prompts are reused from the LLM response cache unless use_cache is False.
     """
 
     # Create a customised test prompt based on the provided inputs
     customised_prompt = create_customise_test_prompt(selected_test_name, document_type, document_content, test_prompt)
-    # Initialize the number of attempts
-    attempts = 0
-
-    # Try to generate a specialized test prompt using the LLM model
-    while attempts < max_retries:
-        # Attempt to connect to the LLM model and generate a specialized test prompt
-        try:
-            llm = Ollama(model="llama3.2", request_timeout=300.0, json_mode=True) # Initialize the LLM model
-            resp = llm.complete(customised_prompt) # Generate a specialized test prompt
-            
-            # Parse the JSON text into a Python dictionary
-            generated_customise_prompt = json.loads(resp.text)  # JSON string to dict
-            
-            # Check if the parsed JSON contains the required key
-            if "custom_test_prompt" in generated_customise_prompt:
-                return generated_customise_prompt["custom_test_prompt"]
-            else:
-                raise KeyError("Expected 'custom_test_prompt' key not found in the response.")
-
-        except (json.JSONDecodeError, KeyError) as e:
+    # Transport errors and invalid outputs each get max_retries attempts
+    policy = RetryPolicy(transport_attempts=max_retries, schema_attempts=max_retries)
+
+    # One attempt: connect to the LLM model and generate a specialized test prompt
+    def attempt():
+        llm = get_llm(DEFAULT_MODEL, json_mode=True) # Get the shared LLM client
+        resp = llm.complete(customised_prompt) # Generate a specialized test prompt
+
+        # Parse the JSON text into a Python dictionary
+        generated_customise_prompt = json.loads(resp.text)  # JSON string to dict
+
+        # Check if the parsed JSON contains the required key
+        if "custom_test_prompt" in generated_customise_prompt:
+            return generated_customise_prompt["custom_test_prompt"]
+        else:
+            raise KeyError("Expected 'custom_test_prompt' key not found in the response.")
+
+    try:
+        # The same inputs on the same model are answered from the response cache
+        llm = get_llm(DEFAULT_MODEL, json_mode=True)
+        return llm_response_cache.get_or_compute(
+            DEFAULT_MODEL, customised_prompt, lambda: policy.call(attempt),
+            use_cache=use_cache, temperature=llm.temperature, json_mode=True
+        )
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class == SCHEMA_ERROR:
             # JSON parsing error or missing key
-            attempts += 1
-            # Retry if attempts are within the limit
-            if attempts >= max_retries:
-                raise ValueError(f"Error: All attempts failed. Last error: {e}")
-        except (ConnectionError, Timeout) as e:
-            # Connection or timeout error
-            attempts += 1
-            # Retry if attempts are within the limit
-            if attempts >= max_retries:
-                raise ConnectionError(f"Error: All attempts failed due to connection issues. Last error: {e}")
-        except Exception as e:
-            # Any other unexpected error
-            attempts += 1
-            # Retry if attempts are within the limit
-            if attempts >= max_retries:
-                raise RuntimeError(f"Error: All attempts failed due to an unexpected error. Last error: {e}")
+            raise ValueError(f"Error: All attempts failed. Last error: {e}")
+        if error_class == TRANSPORT_ERROR or isinstance(e, CircuitOpenError):
+            # Connection or timeout error, or the server is known to be down
+            raise ConnectionError(f"Error: All attempts failed due to connection issues. Last error: {e}")
+        # Any other unexpected error
+        raise RuntimeError(f"Error: All attempts failed due to an unexpected error. Last error: {e}")
 
 
 # # Testing Area
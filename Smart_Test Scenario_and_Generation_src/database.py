@@ -1,16 +1,30 @@
-""" 
+"""
 This script includes functions to interact with MongoDB and fetch data from it.
 It includes functions to fetch test names, fetch scenarios, update scenarios, initialize session, save generated prompt and fetch model output from MongoDB.
+
+Sessions do not copy the default prompts. A session references a versioned snapshot of the default_prompts
+collection (prompt_set_version) and stores only the fields the user changed (prompt_overrides.<test_name>.<field>).
+The effective prompt is the default prompt merged with the overrides at read time.
+
+Generated test scenarios and test cases are not stored in the session document either. They are stored one document
+per scenario in test_scenarios and one document per test case in test_cases; fetch_model_output_from_db reassembles
+the {"TestScenarios": [...], "TestCases": [...]} model output from them.
+
+The data functions are a synchronous facade over the asynchronous data access layer in async_database.py:
+they run its coroutines on a background event loop, so the Streamlit pages keep calling them as before.
+
+Only the data functions are asynchronous. The collection getters below, the response cache, the index manager and
+the LLM generation threads keep using pymongo synchronously, and Smart Selection has its own pymongo client.
+Their client is the pymongo client wrapped by the Motor client of the background loop, so both share one pool.
 """
 
-import os
-from pymongo import MongoClient
+import async_database
+from async_database import MONGO_DB_NAME, get_background_loop, run_sync
 
-# MongoDB URI from environment variable
-MONGO_URI = os.getenv("MONGO_URI")
-# MongoDB client and database
-client = MongoClient(MONGO_URI)
-db = client["modular_test_scenario_gen"]  # Database name
+# Synchronous MongoDB client and database for direct collection access: the pymongo client (delegate) of the
+# background loop's Motor client, so the facade and the direct accesses share one connection pool
+client = async_database.async_db.client_for_loop(get_background_loop()).delegate
+db = client[MONGO_DB_NAME]  # Database name
 
 # getter function for database and collections
 def get_db():
@@ -27,90 +41,117 @@ def get_default_prompts_collection():
     """ Returns the default_prompts collection """
     return db["default_prompts"]
 
+# getter function for the versioned snapshots of the default prompts
+def get_default_prompt_versions_collection():
+    """ Returns the default_prompt_versions collection """
+    return db["default_prompt_versions"]
+
+# getter function for the generated test scenarios, one document per scenario
+def get_test_scenarios_collection():
+    """ Returns the test_scenarios collection """
+    return db["test_scenarios"]
+
+# getter function for the generated test cases, one document per test case
+def get_test_cases_collection():
+    """ Returns the test_cases collection """
+    return db["test_cases"]
+
+# getter function for the asynchronous data access layer
+def get_async_db():
+    """ Returns the AsyncDatabase shared by the facade and the asynchronous callers """
+    return async_database.async_db
+
+# database name of an optional database argument
+def database_name(db):
+    return db.name if db is not None else None
+
+# publish the current default prompts as a version
+def publish_default_prompt_set():
+    """ Stores the current default_prompts collection as a version in default_prompt_versions and returns the version. """
+    return run_sync(get_async_db().publish_default_prompt_set())
+
+# get the current default prompt version
+def get_current_prompt_set_version():
+    """ Returns the version of the current default prompts, publishing it at most every DEFAULT_PROMPTS_REFRESH_SECONDS. """
+    return run_sync(get_async_db().get_current_prompt_set_version())
+
+# get the default prompts of a version
+def get_default_prompt_set(version):
+    """ Returns {test_name: default prompt} of the version; versions are immutable, so each is read only once per process. """
+    return run_sync(get_async_db().get_default_prompt_set(version))
+
 # fetch test names from the database
 def fetch_test_names():
-    """ 
+    """
     get the default prompts collection
     fetch all the documents from the collection
-    return the test names from the documents 
+    return the test names from the documents
     """
-    collection = get_default_prompts_collection()
-    return [doc["test_name"] for doc in collection.find()]
+    return run_sync(get_async_db().fetch_test_names())
+
+# load one scenario of a session from the database
+def load_scenario_from_db(test_name, session_id=None):
+    """ Returns the scenario of the test without the rest of the session document (no cache). """
+    return run_sync(get_async_db().load_scenario(test_name, session_id))
 
 # fetch scenario from the database
 def fetch_scenario_from_db(test_name, session_id=None):
     """
     Takes the test name and session id as input and returns the scenario from the database.
+    The scenario is the default prompt of the session's prompt set merged with the session's overrides.
+    Scenarios are cached in-process by (database, session_id, test_name) until update_scenario_in_db changes them,
+    for at most SCENARIO_CACHE_TTL_SECONDS, so changes made by another app process are picked up.
     """
-    collection = get_sessions_collection()
-    session_data = collection.find_one({"session_id": session_id})
-    if session_data:
-        return next(
-            (prompt for prompt in session_data.get("original_prompts", []) if prompt["test_name"] == test_name),
-            None
-        )
-
-    return None
+    return run_sync(get_async_db().fetch_scenario(test_name, session_id))
 
 # update scenario in the database with the updated data
 def update_scenario_in_db(test_name, updated_data, session_id=None):
     """
     Takes the test name, updated data and session id as input and updates the scenario in the database.
+    Only the updated fields are stored, as overrides of the session's default prompt set.
     """
-    # get the sessions collection
-    collection = get_sessions_collection()
-    
-    # find the seesion data with the session id
-    # update the original prompt with the updated data
-    # update the collection with the updated data
-    collection.update_one(
-        {
-            "session_id": session_id,
-            "original_prompts.test_name": test_name
-        },
-        {
-            "$set": {
-                f"original_prompts.$.{key}": value 
-                for key, value in updated_data.items()
-            }
-        }
-    )
+    run_sync(get_async_db().update_scenario(test_name, updated_data, session_id))
 
-# initialize session in the database with the session id and default prompts data from the default prompts collection
+# initialize session in the database with the session id and the current default prompt set
 def initialize_session(session_id):
-    """ initialize session with default prompts data """
-    # get source collection and target collection for default prompts and sessions"""
-    source_collection = get_default_prompts_collection()
-    target_collection = get_sessions_collection()
-
-    # get all the documents from the source collection
-    data = list(source_collection.find())
-
-    # if data is present, update the customised_prompt_status to False
-    if data:
-        for item in data:
-            item["customised_prompt_status"] = False # set the customised_prompt_status to False
-        # insert the data into the target collection
-        session_data = {
-            "session_id": session_id, # session id for the session
-            "original_prompts": data, # original prompts data from the source collection
-        }
-        # insert the session data into the target collection
-        target_collection.insert_one(session_data)
+    """ initialize session with a reference to the current default prompts, without copying them """
+    run_sync(get_async_db().initialize_session(session_id))
 
 # save generated prompt in the database with the session id and the generated prompt
 def save_generated_prompt(session_id, prompt):
     """ Generated prompt is saved in the database """
-    # the main collection of sessions
-    collection = get_sessions_collection()
-    # update the collection with the generated prompt
-    collection.update_one(
-        {"session_id": session_id}, # find the document with the session id
-        {"$set": {"generated_prompt": prompt}}, # update the generated prompt
-        upsert=True # if the document does not exist, insert it
-    )
+    run_sync(get_async_db().save_generated_prompt(session_id, prompt))
+
+# save the generated test scenarios, one document per scenario
+def save_test_scenarios(session_id, test_scenarios, db=None):
+    """
+    Upserts one test_scenarios document per scenario, keyed by (session_id, scenario_index), and removes the
+    scenarios and test cases of an earlier, longer result. A changed scenario loses its old test cases and status.
+    """
+    run_sync(get_async_db().save_test_scenarios(session_id, test_scenarios, database_name(db)))
 
-# tak
+# save the test cases generated for one scenario
+def save_test_case_result(session_id, scenario_index, scenario_id, combined_prompt, test_case, db=None):
+    """
+    Saves the result of one scenario's test case generation: the prompt and the status on the scenario's
+    test_scenarios document and one test_cases document per test case, keyed by (session_id, scenario_index, case_index).
+    test_case is the LLM output ({"TestCases": [...]}) or {"error": ...} if the generation failed.
+    """
+    run_sync(get_async_db().save_test_case_result(
+        session_id, scenario_index, scenario_id, combined_prompt, test_case, database_name(db)
+    ))
+
+# save a whole model output
+def save_model_output(session_id, model_output, db=None):
+    """ Saves the scenarios and, if the output has TestCases, the test cases of every scenario. """
+    run_sync(get_async_db().save_model_output(session_id, model_output, database_name(db)))
+
+# check if test scenarios were generated in the session
+def has_test_scenarios(session_id, db=None):
+    """ Returns True if the session has test scenarios, in test_scenarios or in a legacy model_output. """
+    return run_sync(get_async_db().has_test_scenarios(session_id, database_name(db)))
+
+# fetch the model output of the session
 def fetch_model_output_from_db(session_id):
     """
     Takes the session id as input and returns the model output from the database.
@@ -119,14 +160,10 @@ def fetch_model_output_from_db(session_id):
     session_id (str): The session id to fetch the model output.
 
     Returns:
-    str: The model output from the database.
+    dict: {"TestScenarios": [...]} and, once test cases were generated, "TestCases": [{"scenario_id",
+    "combined_prompt", "test_case"}] in scenario order; the model_output of a legacy session; or None.
     """
-    collection = get_sessions_collection()
-    document = collection.find_one({"session_id": session_id})
-    if document and "model_output" in document:
-        return document["model_output"]
-    else:
-        return None
+    return run_sync(get_async_db().fetch_model_output(session_id))
 
 # Save the model output to the database using the session ID
 def save_test_cases_to_db(session_id, generated_test_cases, db):
@@ -135,4 +172,4 @@ def save_test_cases_to_db(session_id, generated_test_cases, db):
         {"session_id": session_id},
         {"$set": {"TestCases": generated_test_cases}},
         upsert=True
-    )
\ No newline at end of file
+    )
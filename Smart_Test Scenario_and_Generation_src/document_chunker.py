@@ -0,0 +1,150 @@
+""" This module splits long documents on structural boundaries, generates test scenarios per chunk in parallel and merges the results. """
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from generation_scheduler import GENERATION_MAX_WORKERS, get_model_semaphore
+from run_model import run_model_on_prompt
+
+# Token budget of one scenario prompt (instructions + document chunk) and the estimated characters per token
+PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 6000))
+CHARS_PER_TOKEN = float(os.getenv("LLM_CHARS_PER_TOKEN", 3.5))
+
+# Document chunks never get less than this many tokens, even if the instructions use most of the budget
+MIN_CHUNK_TOKENS = 500
+
+# Lines that start a new section: markdown headings, numbered headings ("2.", "3.1", "4.2.1)"),
+# chapter/section words (any case) and short all-caps titles (case-sensitive, so ordinary short lines do not match)
+HEADING_PATTERN = re.compile(
+    r"^\s*(#{1,6}\s+\S|\d+(\.\d+)*[.)]?\s+\S|(?i:chapter|section|part|appendix|bölüm)\b|[A-Z][A-Z0-9 ,&/\-]{3,60}$)"
+)
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+# Estimate the number of tokens of a text
+def estimate_tokens(text):
+    """ Returns a conservative token estimate from the length of the text. """
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+# Split a text into pieces of at most max_chars, trying separators from coarse to fine
+def split_oversized(text, max_chars):
+    """ Splits a block that does not fit into one chunk by lines, then by sentences, then by characters. """
+    if len(text) <= max_chars:
+        return [text]
+    for pieces in (text.split("\n"), SENTENCE_END_PATTERN.split(text)):
+        if len(pieces) > 1:
+            return [part for piece in pieces for part in split_oversized(piece, max_chars) if part.strip()]
+    return [text[index:index + max_chars] for index in range(0, len(text), max_chars)]
+
+# Split a document into structural blocks (sections and paragraphs)
+def split_blocks(document):
+    """ Returns (is_heading, text) blocks: paragraphs split on blank lines, with a new block at every heading line. """
+    blocks = []
+    for paragraph in re.split(r"\n\s*\n", document):
+        current = []
+        for line in paragraph.split("\n"):
+            if HEADING_PATTERN.match(line) and current:
+                blocks.append((HEADING_PATTERN.match(current[0]) is not None, "\n".join(current)))
+                current = []
+            current.append(line)
+        if current and "".join(current).strip():
+            blocks.append((HEADING_PATTERN.match(current[0]) is not None, "\n".join(current)))
+    return blocks
+
+# Split a document into chunks that fit into the token budget
+def split_document(document, max_tokens):
+    """
+    Packs the structural blocks of the document into chunks of at most max_tokens (estimated).
+    A new chunk preferably starts at a heading once the current chunk is half full; blocks larger
+    than a chunk are split by lines, sentences and finally characters.
+    """
+    max_chars = max(1, int(max_tokens * CHARS_PER_TOKEN))
+    if len(document) <= max_chars:
+        return [document]
+
+    chunks, current, current_size = [], [], 0
+    for is_heading, block in split_blocks(document):
+        for piece in split_oversized(block, max_chars):
+            separator = 2 if current else 0
+            if current and (
+                current_size + separator + len(piece) > max_chars or (is_heading and current_size >= max_chars / 2)
+            ):
+                chunks.append("\n\n".join(current))
+                current, current_size, separator = [], 0, 0
+            current.append(piece)
+            current_size += separator + len(piece)
+            is_heading = False
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# Build one scenario prompt per document chunk
+def build_chunk_prompts(build_prompt, document_content, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    build_prompt(document_content) returns the full scenario prompt for a document content.
+    Returns a list with the single full prompt if it fits into token_budget, otherwise one prompt per chunk,
+    each at most token_budget tokens (estimated) and marked with its part number.
+    """
+    full_prompt = build_prompt(document_content)
+    if estimate_tokens(full_prompt) <= token_budget:
+        return [full_prompt]
+
+    # Leave room for the instructions and the part marker in every prompt
+    overhead = estimate_tokens(build_prompt("")) + 50
+    chunks = split_document(document_content, max(MIN_CHUNK_TOKENS, token_budget - overhead))
+    return [
+        build_prompt(
+            f"(Part {index} of {len(chunks)} of the document. Generate test scenarios only for this part.)\n{chunk}"
+        )
+        for index, chunk in enumerate(chunks, start=1)
+    ]
+
+# Generate the test scenarios of every chunk prompt and yield each result as soon as it is ready
+def iter_generate_chunk_scenarios(model, prompts, max_workers=GENERATION_MAX_WORKERS, max_retries=3, stats=None):
+    """
+    Sends every chunk prompt to run_model_on_prompt on a pool of max_workers threads; each attempt holds the
+    model's semaphore. Yields (index, test_scenarios, error) in completion order; test_scenarios is None if the
+    chunk failed, error is the exception raised while generating the chunk or None.
+    """
+    # Generate one chunk; every attempt holds the model's semaphore
+    def generate(prompt):
+        return run_model_on_prompt(
+            model, prompt, max_retries=max_retries, stats=stats, concurrency_limit=get_model_semaphore(model)
+        )
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        futures = {executor.submit(generate, prompt): index for index, prompt in enumerate(prompts)}
+        for future in as_completed(futures):
+            try:
+                output = future.result()
+            except Exception as e:
+                yield futures[future], None, e
+            else:
+                yield futures[future], (output["TestScenarios"] if output else None), None
+
+# Normalize a title for duplicate detection
+def normalize_title(title):
+    return re.sub(r"[^\w]+", " ", str(title)).strip().lower()
+
+# Merge the scenarios of all chunks
+def merge_scenarios(chunk_scenarios, id_prefix=None):
+    """
+    Merges the scenario lists of the chunks in chunk order and drops duplicates (same title, or same
+    ScenarioID and title). Every chunk numbers its scenarios from 1, so with id_prefix the merged
+    scenarios are renumbered as id_prefix + 1..n to keep the ScenarioIDs unique.
+    """
+    merged, seen_titles, seen_ids = [], set(), set()
+    for scenarios in chunk_scenarios:
+        for scenario in scenarios or []:
+            title = normalize_title(scenario.get("Title", ""))
+            scenario_key = (scenario.get("ScenarioID"), title)
+            if (title and title in seen_titles) or scenario_key in seen_ids:
+                continue
+            seen_titles.add(title)
+            seen_ids.add(scenario_key)
+            merged.append(dict(scenario))
+
+    if id_prefix:
+        for number, scenario in enumerate(merged, start=1):
+            scenario["ScenarioID"] = f"{id_prefix}{number}"
+    return merged
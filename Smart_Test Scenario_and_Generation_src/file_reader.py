@@ -1,6 +1,10 @@
-""" This module contains functions to read different types of files. """
+""" This module contains functions to read different types of files and a per-session cache of the parsed documents. """
 
+import hashlib
 import io
+import os
+from collections import OrderedDict
+
 import docx
 import pandas as pd
 
@@ -28,3 +32,66 @@ def read_python(file):
     """Read the Python (.py) file."""
     file_content = file.read().decode('utf-8')
     return file_content
+
+# Max memory (MB) of the parsed documents kept per session
+DOCUMENT_CACHE_MAX_MB = float(os.getenv("DOCUMENT_CACHE_MAX_MB", 64))
+
+# Readers of the supported file extensions
+READERS = {"txt": read_txt, "docx": read_docx, "xlsx": read_xlsx, "py": read_python}
+
+class ParsedDocument:
+    """
+    An uploaded document parsed once: raw holds the upload bytes, content the text used in the prompts
+    and data the parsed form shown in the preview (the DataFrame of an xlsx file, otherwise the text).
+    """
+
+    __slots__ = ("raw", "content", "data", "size")
+
+    def __init__(self, raw, content, data):
+        self.raw = raw
+        self.content = content
+        self.data = data
+        self.size = len(raw) + len(content.encode("utf-8"))
+        if isinstance(data, pd.DataFrame):
+            self.size += int(data.memory_usage(deep=True).sum())
+
+class DocumentCache:
+    """ LRU cache of parsed documents keyed by a hash of the upload bytes, bounded by max_bytes. """
+
+    def __init__(self, max_bytes=DOCUMENT_CACHE_MAX_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()  # (sha256, ext) -> ParsedDocument
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get_or_parse(self, raw, ext):
+        """ Returns the parsed document of the bytes, parsing it only if it is not cached. """
+        key = (hashlib.sha256(raw).hexdigest(), ext)
+        document = self._documents.get(key)
+        if document is not None:
+            self.hits += 1
+            self._documents.move_to_end(key)
+            return document
+
+        self.misses += 1
+        data = READERS[ext](io.BytesIO(raw))
+        content = data.to_csv(index=False) if isinstance(data, pd.DataFrame) else data
+        document = ParsedDocument(raw, content, data)
+
+        # Evict the least recently used documents; a document larger than the bound is returned but not kept
+        if document.size <= self.max_bytes:
+            while self.total_bytes + document.size > self.max_bytes:
+                _, evicted = self._documents.popitem(last=False)
+                self.total_bytes -= evicted.size
+            self._documents[key] = document
+            self.total_bytes += document.size
+        return document
+
+# Function to read an uploaded file through the document cache
+def read_document(file, ext, cache):
+    """ Returns the ParsedDocument of the uploaded file; the file is parsed only the first time its bytes are seen. """
+    return cache.get_or_parse(file.getvalue(), ext)
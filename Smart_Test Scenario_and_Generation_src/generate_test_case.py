@@ -1,8 +1,11 @@
 """ This module contains the function to generate test cases based on the generated test scenario. """
 
-from llama_index.llms.ollama import Ollama
-from requests.exceptions import ConnectionError, Timeout
-import json
+from contextlib import nullcontext
+
+from llm_client import get_llm
+from requests.exceptions import ConnectionError
+from retry_policy import SCHEMA_ERROR, TRANSPORT_ERROR, CircuitOpenError, RetryPolicy, classify_error
+from structured_output import TEST_CASE_KEYS, TEST_CASES_SCHEMA, complete_items
 
 # Function to generate a JSON structure for test scenarios
 def generate_json_structure():
@@ -48,51 +51,33 @@ def generate_json_structure():
     return json_structure
 
 # Function to generate test cases based on the generated test scenario
-def generate_test_case(model, combined_prompt, max_retries=3):
+def generate_test_case(model, combined_prompt, max_retries=3, stats=None, concurrency_limit=None):
     """
     Generates test cases based on the generated test scenario.
+    The TestCases JSON schema is passed as the output format; test cases that miss required keys are
+    re-requested on their own and requests are counted in stats (GenerationStats), if given.
+    concurrency_limit (e.g. the model's semaphore) is held during each attempt, not during the retry backoff.
     """
 
-    # Initialize the number of attempts
-    attempts = 0
-    required_keys = {
-        "ScenarioID",
-        "TestCaseID",
-        "Title",
-        "Description",
-        "Objective",
-        "Category",
-        "Comments",
-    }
-    
-    # Try to generate test cases using the LLM model
-    while attempts < max_retries:
-        # Attempt to connect to the LLM model and generate test cases
-        try:
-            # Initialize the LLM model
-            llm = Ollama(model=model, request_timeout=300.0, json_mode=True)
-            resp = llm.complete(combined_prompt) # Generate test cases
-            
-            # Parse the JSON text into a Python dictionary
-            try:
-                test_case_llm_output_json = json.loads(resp.text)  # JSON string to dict
-            except json.JSONDecodeError as decode_error:
-                raise ValueError(f"Failed to parse JSON from LLM response: {decode_error}")
-            # Return the validated JSON output
-            return test_case_llm_output_json
-        
-        except (json.JSONDecodeError, KeyError) as e:
+    # Transport errors and invalid outputs each get max_retries attempts
+    policy = RetryPolicy(transport_attempts=max_retries, schema_attempts=max_retries)
+
+    # One attempt: connect to the LLM model and generate test cases
+    def attempt():
+        with concurrency_limit or nullcontext():
+            llm = get_llm(model, json_mode=True)
+            return complete_items(llm, combined_prompt, "TestCases", TEST_CASE_KEYS, TEST_CASES_SCHEMA, stats)
+
+    try:
+        # Return the validated JSON output
+        return policy.call(attempt)
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class == SCHEMA_ERROR:
             # JSON parsing error or missing key
-            attempts += 1
-            if attempts >= max_retries:
-                raise ValueError(f"Error: All attempts failed. Last error: {e}")
-        except (ConnectionError, Timeout) as e:
-            # Connection or timeout error
-            attempts += 1
-            if attempts >= max_retries:
-                raise ConnectionError(f"Error: All attempts failed due to connection issues. Last error: {e}")
-        except Exception as e:
-            # Any other unexpected error
-            attempts += 1
-            if attempts >= max_retries:
-                raise RuntimeError(f"Error: All attempts failed due to an unexpected error. Last error: {e}")
+            raise ValueError(f"Error: All attempts failed. Last error: {e}")
+        if error_class == TRANSPORT_ERROR or isinstance(e, CircuitOpenError):
+            # Connection or timeout error, or the server is known to be down
+            raise ConnectionError(f"Error: All attempts failed due to connection issues. Last error: {e}")
+        # Any other unexpected error
+        raise RuntimeError(f"Error: All attempts failed due to an unexpected error. Last error: {e}")
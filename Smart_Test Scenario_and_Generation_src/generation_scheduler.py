@@ -0,0 +1,58 @@
+""" This module generates test cases for many scenarios in parallel, with a bounded worker pool and a per-model concurrency cap. """
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from generate_test_case import generate_test_case
+
+# Number of scenarios generated at the same time by one request
+GENERATION_MAX_WORKERS = int(os.getenv("GENERATION_MAX_WORKERS", 4))
+
+# Max concurrent requests per model across all sessions, e.g. MODEL_CONCURRENCY="llama3.2=4,codellama=1".
+# Keep it at or below OLLAMA_NUM_PARALLEL of the Ollama host; extra requests would only queue on the server.
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("DEFAULT_MODEL_CONCURRENCY", 2))
+MODEL_CONCURRENCY = {
+    name.strip(): int(limit)
+    for name, limit in (
+        entry.split("=", 1) for entry in os.getenv("MODEL_CONCURRENCY", "").split(",") if "=" in entry
+    )
+}
+
+_lock = threading.Lock()
+_model_semaphores = {}  # model -> threading.BoundedSemaphore
+
+# Get the concurrency cap of a model
+def get_model_semaphore(model):
+    """ Returns the process-wide semaphore that limits concurrent requests to the model. """
+    with _lock:
+        semaphore = _model_semaphores.get(model)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(MODEL_CONCURRENCY.get(model, DEFAULT_MODEL_CONCURRENCY))
+            _model_semaphores[model] = semaphore
+        return semaphore
+
+# Generate test cases for all prompts and yield each result as soon as it is ready
+def iter_generate_test_cases(model, prompts, max_workers=GENERATION_MAX_WORKERS, max_retries=3, stats=None):
+    """
+    Sends every prompt to generate_test_case on a pool of max_workers threads. Each attempt holds the model's
+    semaphore, so a request waiting for its retry backoff does not block the other requests to the model.
+    Yields (index, test_case_output, error) in completion order; index is the position of the prompt
+    in prompts, error is the exception raised by generate_test_case or None. Requests are counted in stats, if given.
+    """
+    if not prompts:
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        futures = {
+            executor.submit(
+                generate_test_case, model, prompt, max_retries=max_retries, stats=stats,
+                concurrency_limit=get_model_semaphore(model)
+            ): index
+            for index, prompt in enumerate(prompts)
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
@@ -0,0 +1,224 @@
+"""
+This module creates and verifies the MongoDB indexes behind the application's hot queries
+and checks with explain() that every known query shape is answered by an index.
+
+Usage:
+    python index_manager.py ensure
+    python index_manager.py verify
+    python index_manager.py explain
+"""
+
+import argparse
+import logging
+import sys
+
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from database import get_db
+
+# Fields of a (process_title, selected_category, selected_test_type) combination
+COMBINATION_KEYS = [("process_title", ASCENDING), ("selected_category", ASCENDING), ("selected_test_type", ASCENDING)]
+
+# Indexes of the hot queries. The combination index also serves the process_title lookups, which use its prefix.
+INDEX_SPECS = [
+    {"collection": "sessions", "keys": [("session_id", ASCENDING)], "name": "session_id", "unique": True},
+    {"collection": "sessions", "keys": COMBINATION_KEYS, "name": "process_title_category_test_type"},
+    {"collection": "smart_selection_state", "keys": COMBINATION_KEYS, "name": "process_title_category_test_type"},
+    {"collection": "smart_selection_results", "keys": COMBINATION_KEYS, "name": "process_title_category_test_type"},
+    {"collection": "test_scenarios", "keys": [("session_id", ASCENDING), ("scenario_index", ASCENDING)], "name": "session_scenario", "unique": True},
+    {"collection": "test_cases", "keys": [("session_id", ASCENDING), ("scenario_index", ASCENDING), ("case_index", ASCENDING)],
+     "name": "session_scenario_case", "unique": True},
+    {"collection": "llm_response_cache", "keys": [("expires_at", ASCENDING)], "name": "expires_at_1", "expireAfterSeconds": 0},
+    {"collection": "llm_response_cache", "keys": [("last_used_at", ASCENDING)], "name": "last_used_at_1"},
+]
+
+# Query shapes of the application (filter and optional sort) with the code that issues them
+QUERY_SHAPES = [
+    {
+        "name": "session by id",
+        "collection": "sessions",
+        "filter": {"session_id": "?"},
+        "source": "database.fetch_scenario_from_db, fetch_model_output_from_db, save_generated_prompt; app.py",
+    },
+    {
+        "name": "session prompt override",
+        "collection": "sessions",
+        "filter": {"session_id": "?", "prompt_set_version": {"$exists": True}},
+        "source": "database.update_scenario_in_db",
+    },
+    {
+        "name": "legacy session prompt update",
+        "collection": "sessions",
+        "filter": {"session_id": "?", "original_prompts.test_name": "?"},
+        "source": "database.update_scenario_in_db (sessions with original_prompts)",
+    },
+    {
+        "name": "session by process title",
+        "collection": "sessions",
+        "filter": {"process_title": "?"},
+        "source": "app.py (Save Process Title)",
+    },
+    {
+        "name": "session by combination",
+        "collection": "sessions",
+        "filter": {"process_title": "?", "selected_category": "?", "selected_test_type": "?"},
+        "source": "smart_selection.fetch_details_by_combination",
+    },
+    {
+        "name": "selection state by combination",
+        "collection": "smart_selection_state",
+        "filter": {"process_title": "?", "selected_category": "?", "selected_test_type": "?"},
+        "source": "smart_selection.load_selection_state, save_selection_state",
+    },
+    {
+        "name": "selection result by combination",
+        "collection": "smart_selection_results",
+        "filter": {"process_title": "?", "selected_category": "?", "selected_test_type": "?"},
+        "source": "batch_smart_selection.save_result_to_mongo",
+    },
+    {
+        "name": "scenarios of a session",
+        "collection": "test_scenarios",
+        "filter": {"session_id": "?"},
+        "sort": [("scenario_index", ASCENDING)],
+        "source": "database.fetch_model_output_from_db, has_test_scenarios, save_test_scenarios",
+    },
+    {
+        "name": "test cases of a session",
+        "collection": "test_cases",
+        "filter": {"session_id": "?"},
+        "sort": [("scenario_index", ASCENDING), ("case_index", ASCENDING)],
+        "source": "database.fetch_model_output_from_db; smart_selection.fetch_details_by_combination",
+    },
+    {
+        "name": "test cases of a scenario",
+        "collection": "test_cases",
+        "filter": {"session_id": "?", "scenario_index": 0, "case_index": {"$gte": 0}},
+        "source": "database.save_test_case_result",
+    },
+    {
+        "name": "LLM cache LRU eviction",
+        "collection": "llm_response_cache",
+        "filter": {},
+        "sort": [("last_used_at", ASCENDING)],
+        "source": "response_cache.ResponseCache.set",
+    },
+]
+
+# Key pattern of an index as a comparable tuple
+def key_pattern(keys):
+    return tuple((field, int(direction)) for field, direction in keys)
+
+# Return the index specs that are not in the database
+def verify_indexes(db=None, specs=INDEX_SPECS):
+    """
+    Returns the specs whose key pattern has no index in its collection. An index with the same keys
+    counts even if it was created under another name (e.g. by smart_selection.ensure_combination_index).
+    """
+    db = db if db is not None else get_db()
+    missing = []
+    for spec in specs:
+        existing = {key_pattern(info["key"]) for info in db[spec["collection"]].index_information().values()}
+        if key_pattern(spec["keys"]) not in existing:
+            missing.append(spec)
+    return missing
+
+# Create the missing indexes
+def ensure_indexes(db=None, specs=INDEX_SPECS):
+    """
+    Creates every index of specs that does not exist yet and returns the "collection.name" of the created ones.
+    If a unique index cannot be built because the collection already holds duplicates, a non-unique index
+    with the same keys is created instead and a warning is logged.
+    """
+    db = db if db is not None else get_db()
+    created = []
+    for spec in verify_indexes(db, specs):
+        collection = db[spec["collection"]]
+        options = {key: value for key, value in spec.items() if key not in ("collection", "keys")}
+        try:
+            collection.create_index(spec["keys"], **options)
+        except (DuplicateKeyError, OperationFailure) as e:
+            if not options.get("unique") or getattr(e, "code", None) != 11000:
+                raise
+            logging.warning(f"{spec['collection']} has duplicate {spec['name']} values, creating a non-unique index: {e}")
+            options.pop("unique")
+            collection.create_index(spec["keys"], **options)
+        created.append(f"{spec['collection']}.{spec['name']}")
+    return created
+
+# Collect the stages and index names of an explain() plan
+def plan_stages(plan):
+    """ Returns (stages, index_names) of every stage of the plan tree, classic and slot-based engine alike. """
+    stages, index_names = [], []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            index_names.append(plan["indexName"])
+        children = plan.values()
+    elif isinstance(plan, list):
+        children = plan
+    else:
+        return stages, index_names
+    for child in children:
+        if isinstance(child, (dict, list)):
+            child_stages, child_indexes = plan_stages(child)
+            stages.extend(child_stages)
+            index_names.extend(child_indexes)
+    return stages, index_names
+
+# Run explain() for every query shape and flag the collection scans
+def explain_query_shapes(db=None, shapes=QUERY_SHAPES):
+    """
+    Explains every query shape (with its filter values as placeholders) and returns one report per shape:
+    the winning plan's stages and indexes, the examined keys and documents, and collscan=True if the
+    winning plan scans the whole collection.
+    """
+    db = db if db is not None else get_db()
+    reports = []
+    for shape in shapes:
+        cursor = db[shape["collection"]].find(shape["filter"])
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        explain = cursor.limit(1).explain()
+        stages, index_names = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        execution = explain.get("executionStats", {})
+        reports.append({
+            "name": shape["name"],
+            "collection": shape["collection"],
+            "source": shape["source"],
+            "stages": stages,
+            "indexes": index_names,
+            "keys_examined": execution.get("totalKeysExamined"),
+            "docs_examined": execution.get("totalDocsExamined"),
+            "collscan": "COLLSCAN" in stages,
+        })
+    return reports
+
+def main():
+    parser = argparse.ArgumentParser(description="Create, verify and explain the MongoDB indexes of the application.")
+    parser.add_argument("command", choices=["ensure", "verify", "explain"])
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        created = ensure_indexes()
+        print("created: " + (", ".join(created) if created else "none, all indexes exist"))
+    elif args.command == "verify":
+        missing = verify_indexes()
+        for spec in missing:
+            print(f"missing: {spec['collection']}.{spec['name']} {spec['keys']}")
+        print("all indexes exist" if not missing else f"{len(missing)} indexes missing")
+        sys.exit(1 if missing else 0)
+    else:
+        reports = explain_query_shapes()
+        for report in reports:
+            flag = "COLLSCAN" if report["collscan"] else "ok"
+            print(f"{flag:<9}{report['name']:<34}{' > '.join(report['stages']):<28}"
+                  f"index={','.join(report['indexes']) or '-'} keys={report['keys_examined']} docs={report['docs_examined']}")
+            if report["collscan"]:
+                print(f"         issued by {report['source']}")
+        sys.exit(1 if any(report["collscan"] for report in reports) else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+""" This module keeps one shared LLM client per model so that every request reuses the same pooled HTTP connections. """
+
+import os
+import threading
+
+import httpx
+from llama_index.llms.ollama import Ollama
+from ollama import Client
+
+# Ollama server and how long a model stays loaded after the last request
+OLLAMA_BASE_URL = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Default model used by the analysis, prompt customisation and judge steps
+DEFAULT_MODEL = "llama3.2"
+
+# Request timeout (seconds) and per-model overrides, e.g. LLM_MODEL_TIMEOUTS="codellama=600,mistral=450"
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", 300.0))
+MODEL_TIMEOUTS = {
+    name.strip(): float(timeout)
+    for name, timeout in (
+        entry.split("=", 1) for entry in os.getenv("LLM_MODEL_TIMEOUTS", "").split(",") if "=" in entry
+    )
+}
+
+# Size of the connection pool shared by all requests to one model
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 8))
+
+_lock = threading.Lock()
+_http_clients = {}  # model -> ollama.Client
+_llms = {}  # (model, json_mode) -> Ollama
+
+# Get the request timeout of a model
+def get_request_timeout(model):
+    """ Returns the request timeout of the model, falling back to the default timeout. """
+    return MODEL_TIMEOUTS.get(model, DEFAULT_REQUEST_TIMEOUT)
+
+# Get the pooled Ollama HTTP client of a model
+def get_http_client(model):
+    """ Returns the ollama.Client of the model, creating it with a keep-alive connection pool on first use. """
+    with _lock:
+        http_client = _http_clients.get(model)
+        if http_client is None:
+            http_client = Client(
+                host=OLLAMA_BASE_URL,
+                timeout=get_request_timeout(model),
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+            )
+            _http_clients[model] = http_client
+        return http_client
+
+# Get the shared LLM of a model
+def get_llm(model=DEFAULT_MODEL, json_mode=False):
+    """
+    Returns the shared llama_index Ollama LLM for (model, json_mode).
+    The LLM is created once and reuses the model's pooled HTTP client, so the model's context window
+    is looked up only on the first request and no connection is opened per request.
+    """
+    http_client = get_http_client(model)
+    with _lock:
+        llm = _llms.get((model, json_mode))
+        if llm is None:
+            llm = Ollama(
+                model=model,
+                base_url=OLLAMA_BASE_URL,
+                request_timeout=get_request_timeout(model),
+                json_mode=json_mode,
+                keep_alive=OLLAMA_KEEP_ALIVE,
+                client=http_client
+            )
+            _llms[(model, json_mode)] = llm
+        return llm
+
+# Close and forget all clients
+def reset_llm_clients():
+    """ Closes all pooled HTTP clients and clears the registry (e.g. after changing OLLAMA_BASE_URL). """
+    with _lock:
+        for http_client in _http_clients.values():
+            http_client.close()
+        _http_clients.clear()
+        _llms.clear()
@@ -0,0 +1,153 @@
+""" This module caches LLM responses in MongoDB, keyed by a hash of the full prompt and the model parameters, with TTL and LRU eviction. """
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import PyMongoError
+
+from database import get_db
+
+# Cache switch, entry lifetime (seconds) and max number of entries (least recently used entries are evicted first)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 5000))
+
+# Eviction trims the collection to this share of max_entries, so it runs once per batch of new entries, not on every write.
+# The in-process entry count is re-read from the collection after this many new entries (other processes write too).
+LLM_CACHE_EVICTION_TARGET = float(os.getenv("LLM_CACHE_EVICTION_TARGET", 0.9))
+LLM_CACHE_COUNT_REFRESH_INSERTS = int(os.getenv("LLM_CACHE_COUNT_REFRESH_INSERTS", 100))
+
+# Build the cache key of a request
+def make_cache_key(model, prompt, **params):
+    """ Returns the SHA-256 of the model, the full prompt and the request parameters (e.g. temperature, format). """
+    payload = json.dumps({"model": model, "prompt": prompt, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    LLM response cache in the llm_response_cache collection. Expired entries are removed by a TTL index
+    on expires_at; when the collection grows over max_entries, the least recently used entries are removed down to
+    LLM_CACHE_EVICTION_TARGET of max_entries. The entry count is tracked in-process between periodic re-reads.
+    Hits and misses of this process are counted for the UI. Cache errors never fail the LLM call.
+    """
+
+    def __init__(self, collection=None, ttl_seconds=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self._collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+        self._entry_count = None  # approximate number of entries, None until first read
+        self._inserts_since_count = 0
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            self._collection = get_db()["llm_response_cache"]
+        if not self._indexes_ready:
+            self._collection.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+            self._collection.create_index([("last_used_at", ASCENDING)])
+            self._indexes_ready = True
+        return self._collection
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self):
+        """ Returns hits, misses, bypassed lookups and the hit rate of this process. """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def get(self, key):
+        """ Returns the cached response of the key or None, and marks the entry as recently used. """
+        now = datetime.now(timezone.utc)
+        entry = self.collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$gt": now}},
+            {"$set": {"last_used_at": now}, "$inc": {"hits": 1}},
+            projection={"response": 1}
+        )
+        return entry["response"] if entry else None
+
+    def set(self, key, response, model):
+        """ Stores the response of the key and evicts the least recently used entries once over max_entries. """
+        now = datetime.now(timezone.utc)
+        result = self.collection.update_one(
+            {"_id": key},
+            {
+                "$set": {
+                    "response": response,
+                    "model": model,
+                    "last_used_at": now,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                },
+                "$setOnInsert": {"created_at": now, "hits": 0},
+            },
+            upsert=True
+        )
+        if result.upserted_id is not None and self._track_insert():
+            self.evict()
+
+    def _track_insert(self):
+        """ Counts a new entry and returns True if the collection is (probably) over max_entries. """
+        with self._lock:
+            self._inserts_since_count += 1
+            if self._entry_count is not None and self._inserts_since_count < LLM_CACHE_COUNT_REFRESH_INSERTS:
+                self._entry_count += 1
+                return self._entry_count > self.max_entries
+        count = self.collection.estimated_document_count()
+        with self._lock:
+            self._entry_count, self._inserts_since_count = count, 0
+        return count > self.max_entries
+
+    def evict(self):
+        """ Removes the least recently used entries down to LLM_CACHE_EVICTION_TARGET of max_entries. """
+        count = self.collection.estimated_document_count()
+        overflow = count - int(self.max_entries * LLM_CACHE_EVICTION_TARGET)
+        if overflow > 0:
+            oldest = [doc["_id"] for doc in self.collection.find({}, {"_id": 1}).sort("last_used_at", ASCENDING).limit(overflow)]
+            count -= self.collection.delete_many({"_id": {"$in": oldest}}).deleted_count
+        with self._lock:
+            self._entry_count, self._inserts_since_count = count, 0
+
+    def get_or_compute(self, model, prompt, compute, use_cache=True, **params):
+        """
+        Returns the cached response of (model, prompt, params) or calls compute() and caches its result.
+        With use_cache=False the lookup is skipped for fresh sampling, but the new response still replaces
+        the cached one. Errors raised by compute() are not cached. LLM_CACHE_ENABLED=0 turns the cache off.
+        """
+        if not LLM_CACHE_ENABLED:
+            return compute()
+
+        key = make_cache_key(model, prompt, **params)
+        if use_cache:
+            try:
+                cached = self.get(key)
+            except PyMongoError as e:
+                logging.warning(f"LLM response cache lookup failed: {e}")
+                cached = None
+            if cached is not None:
+                self._count("hits")
+                return cached
+            self._count("misses")
+        else:
+            self._count("bypassed")
+
+        response = compute()
+        try:
+            self.set(key, response, model)
+        except PyMongoError as e:
+            logging.warning(f"LLM response cache update failed: {e}")
+        return response
+
+# Shared by analyse_document and generate_customise_base_prompt
+llm_response_cache = ResponseCache()
@@ -0,0 +1,194 @@
+""" This module provides the retry policy shared by the LLM calls: jittered exponential backoff, separate budgets for transport and schema errors, a circuit breaker and retry metrics. """
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+from ollama import ResponseError
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+
+# Error classes
+TRANSPORT_ERROR = "transport"  # The server could not be reached, timed out or is overloaded
+SCHEMA_ERROR = "schema"  # The server answered but the output is not valid JSON or misses required keys
+FATAL_ERROR = "fatal"  # Retrying cannot help (e.g. unknown model, programming error)
+
+# Backoff for transport errors (seconds); schema errors are retried immediately because the server is healthy
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 1.0))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 30.0))
+
+# Consecutive transport failures that open the circuit, and how long it stays open (seconds)
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("LLM_CIRCUIT_RESET_TIMEOUT", 30.0))
+
+class SchemaError(ValueError):
+    """ The LLM answered, but its output does not match the expected structure. """
+
+class CircuitOpenError(ConnectionError):
+    """ The LLM server failed repeatedly; calls fail fast until the circuit is half-open again. """
+
+# Classify an exception raised by an LLM call
+def classify_error(error):
+    """ Returns TRANSPORT_ERROR, SCHEMA_ERROR or FATAL_ERROR for the exception. """
+    if isinstance(error, (json.JSONDecodeError, KeyError, SchemaError)):
+        return SCHEMA_ERROR
+    if isinstance(error, ResponseError):
+        # 429 and 5xx mean the server is overloaded or failing; other status codes will not change on retry
+        return TRANSPORT_ERROR if error.status_code == 429 or error.status_code >= 500 else FATAL_ERROR
+    if isinstance(error, CircuitOpenError):
+        return FATAL_ERROR
+    if isinstance(error, (httpx.TransportError, RequestsConnectionError, RequestsTimeout, ConnectionError, TimeoutError)):
+        return TRANSPORT_ERROR
+    return FATAL_ERROR
+
+class RetryMetrics:
+    """ Thread-safe retry counters shown in the UI. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._values = {
+                "calls": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "transport_retries": 0,
+                "schema_retries": 0,
+                "fast_failures": 0,
+                "backoff_seconds": 0.0,
+            }
+
+    def increment(self, key, amount=1):
+        with self._lock:
+            self._values[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            values = dict(self._values)
+        values["backoff_seconds"] = round(values["backoff_seconds"], 2)
+        return values
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive transport failures. While open, calls fail fast with
+    CircuitOpenError; after reset_timeout seconds one trial call is let through (half-open).
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if self.clock() - self._opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        """ Raises CircuitOpenError if the call must fail fast. """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self.clock() - self._opened_at < self.reset_timeout or self._trial_running:
+                raise CircuitOpenError("LLM server is unavailable (circuit open); failing fast.")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logging.warning("LLM circuit opened after %d consecutive transport failures.", self._failures)
+                self._opened_at = self.clock()
+            self._trial_running = False
+
+# Shared by all LLM calls of the process (the registry in llm_client talks to a single Ollama host)
+llm_circuit_breaker = CircuitBreaker()
+retry_metrics = RetryMetrics()
+
+class RetryPolicy:
+    """
+    Runs an LLM call with separate retry budgets:
+    - transport errors are retried up to transport_attempts times with full-jitter exponential backoff,
+    - schema errors (invalid JSON, missing keys) are retried up to schema_attempts times without waiting,
+    - fatal errors are raised immediately.
+    The last error is re-raised when a budget is exhausted, so callers keep their own error handling.
+    """
+
+    def __init__(self, transport_attempts=3, schema_attempts=3, base_delay=None, max_delay=None,
+                 circuit_breaker=None, metrics=None, sleep=time.sleep):
+        self.transport_attempts = transport_attempts
+        self.schema_attempts = schema_attempts
+        self.base_delay = RETRY_BASE_DELAY if base_delay is None else base_delay
+        self.max_delay = RETRY_MAX_DELAY if max_delay is None else max_delay
+        self.circuit_breaker = circuit_breaker or llm_circuit_breaker
+        self.metrics = metrics or retry_metrics
+        self.sleep = sleep
+
+    def backoff_delay(self, retry_number):
+        """ Full jitter: a random delay between 0 and base_delay * 2^(retry_number - 1), capped at max_delay. """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry_number - 1)))
+
+    def call(self, operation):
+        """ Calls operation() until it succeeds or a retry budget is exhausted, and returns its result. """
+        self.metrics.increment("calls")
+        attempts = {TRANSPORT_ERROR: 0, SCHEMA_ERROR: 0}
+        budgets = {TRANSPORT_ERROR: self.transport_attempts, SCHEMA_ERROR: self.schema_attempts}
+
+        while True:
+            try:
+                self.circuit_breaker.before_call()
+            except CircuitOpenError:
+                self.metrics.increment("fast_failures")
+                self.metrics.increment("failed")
+                raise
+
+            try:
+                result = operation()
+            except Exception as e:
+                error_class = classify_error(e)
+                if error_class == TRANSPORT_ERROR:
+                    self.circuit_breaker.record_failure()
+                else:
+                    # The server answered, so it is reachable
+                    self.circuit_breaker.record_success()
+
+                if error_class == FATAL_ERROR:
+                    self.metrics.increment("failed")
+                    raise
+                attempts[error_class] += 1
+                if attempts[error_class] >= budgets[error_class]:
+                    logging.error(f"LLM call failed after {attempts[error_class]} {error_class} attempts: {e}")
+                    self.metrics.increment("failed")
+                    raise
+
+                self.metrics.increment(f"{error_class}_retries")
+                if error_class == TRANSPORT_ERROR:
+                    delay = self.backoff_delay(attempts[error_class])
+                    logging.warning(f"Transport error, retrying in {delay:.2f}s: {e}")
+                    self.metrics.increment("backoff_seconds", delay)
+                    self.sleep(delay)
+                else:
+                    logging.warning(f"Invalid LLM output, retrying: {e}")
+                continue
+
+            self.circuit_breaker.record_success()
+            self.metrics.increment("succeeded")
+            return result
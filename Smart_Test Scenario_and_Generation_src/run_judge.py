@@ -1,7 +1,8 @@
 """ This module is used to run the judge on the prompt and uploaded file. """
 
-from llama_index.llms.ollama import Ollama
+from llm_client import DEFAULT_MODEL, get_llm
 from requests.exceptions import ConnectionError, Timeout
+from retry_policy import RetryPolicy
 import json
 import logging
 
@@ -35,9 +36,8 @@ def run_judge_on_prompt(judge_combined_prompt, uploaded_file):
     # print(50*"-")
 
     # Run the judge with the prompt and uploaded file content to get the control data using llama3.2 model
-    llm = Ollama(model="llama3.2", request_timeout=300.0, json_mode=True)
-    resp = llm.complete(prompt)
-    control_data = json.loads(resp.text)
+    llm = get_llm(DEFAULT_MODEL, json_mode=True)
+    control_data = RetryPolicy().call(lambda: json.loads(llm.complete(prompt).text))
 
     # Return the control data
     if control_data:
@@ -1,112 +1,75 @@
 """ This script is used to run the model on the prompt and save the output to the database. """
 
-from llama_index.llms.ollama import Ollama
-from requests.exceptions import ConnectionError, Timeout
-import json
+from database import save_model_output
+from llm_client import get_llm
+from retry_policy import SCHEMA_ERROR, TRANSPORT_ERROR, CircuitOpenError, RetryPolicy, classify_error
+from structured_output import SCENARIO_KEYS, TEST_SCENARIOS_SCHEMA, complete_items, stream_items
+from contextlib import nullcontext
 import logging
 
-# Validation of JSON structure (expected format) with the required keys
-def validate_json_structure(data):
-    """ Validates that the JSON structure matches the expected format defined by Formal-LLM."""
-    required_keys = {"TestScenarios"}
-    if isinstance(data, dict) and required_keys.issubset(data.keys()):
-        for scenario in data["TestScenarios"]:
-            if not all(key in scenario for key in [
-                "ScenarioID", "Title", "Description", 
-                "Objective", "Category", "Comments"
-            ]):
-                return False
-        return True
-    return False
-
-# Run the model on the prompt and return the test scenarios. If it does not be successful, retry up to 3 times.
-def run_model_on_prompt(model, prompt, max_retries=3):
-    # Initialize retry count
-    attempts = 0
-
-    # Retry up to 3 times
-    while attempts < max_retries:
-        try:
-            # Run the model on the prompt to generate test scenarios
-            llm = Ollama(model=model, request_timeout=300.0, json_mode=True)
-            resp = llm.complete(prompt)
-
-            # Log the raw response for debugging purposes
-            logging.info(f"Attempt {attempts + 1}: Raw response received: {resp.text}")
-
-            # Parse the JSON text into a Python dictionary
-            test_scenarios_dict = parse_json_response(resp.text)
-
-            if test_scenarios_dict:
-                # Save the JSON file if parsing was successful
-                return test_scenarios_dict
-            else:
-                logging.warning("Parsed JSON does not match the expected structure. Retrying...")
-
-        except (ConnectionError, Timeout) as e:
-            logging.error(f"Connection error or timeout occurred: {e}")
-        except Exception as e:
-            logging.error(f"An unexpected error occurred: {e}")
-
-        # Increment the retry count
-        attempts += 1
-
-    # If all attempts fail, log and print an error message
-    logging.error("All attempts to parse the JSON response failed after 3 tries.")
-
-    # Control the JSON structure
-    print("Error: All attempts to parse the JSON response failed after 3 tries.")
-
-# Parse the JSON response, ensuring it matches the expected format. Returns the dictionary if successful, None otherwise.
-def parse_json_response(json_text):
+# Log why a scenario generation finally failed; the caller shows the failure to the user
+def log_generation_failure(error, max_retries, action):
+    """ Logs the final error of a failed RetryPolicy call, by the error class of classify_error. """
+    if isinstance(error, CircuitOpenError):
+        # The circuit breaker stopped the call, so the request was not sent (again)
+        logging.error(f"Could not {action}: the LLM server is unavailable and the request was not sent. {error}")
+    elif classify_error(error) == TRANSPORT_ERROR:
+        logging.error(f"Could not {action}: connection error or timeout after {max_retries} tries. Last error: {error}")
+    elif classify_error(error) == SCHEMA_ERROR:
+        logging.error(f"Could not {action}: no valid JSON response after {max_retries} tries. Last error: {error}")
+    else:
+        logging.error(f"Could not {action}: an unexpected error occurred: {error}")
+
+# Run the model on the prompt and return the test scenarios. Failed attempts are retried by the shared retry policy.
+def run_model_on_prompt(model, prompt, max_retries=3, stats=None, concurrency_limit=None):
     """
-    Parses the JSON response, ensuring it matches the expected format.
-    Returns the dictionary if successful, None otherwise.
+    Requests the test scenarios with the TestScenarios JSON schema as the output format.
+    Scenarios that miss required keys are re-requested on their own; the whole answer is regenerated
+    only when no scenario is valid. Requests and retries are counted in stats (GenerationStats), if given.
+    concurrency_limit (e.g. the model's semaphore) is held during each attempt, not during the retry backoff.
+    Returns {"TestScenarios": [...]} or None if all attempts fail.
     """
-    try:
-        # Clean the JSON text by removing newlines and escape characters
-        json_text = json_text.replace('\n', '').replace('\\n', '').replace('\\"', '"')
+    # Transport errors and invalid outputs each get max_retries attempts
+    policy = RetryPolicy(transport_attempts=max_retries, schema_attempts=max_retries)
 
-        # Load the JSON text into a Python dictionary
-        parsed_data = json.loads(json_text)
+    # One attempt: run the model on the prompt and keep the valid test scenarios
+    def attempt():
+        with concurrency_limit or nullcontext():
+            llm = get_llm(model, json_mode=True)
+            return complete_items(llm, prompt, "TestScenarios", SCENARIO_KEYS, TEST_SCENARIOS_SCHEMA, stats)
 
-        # Control the JSON structure
-        if validate_json_structure(parsed_data):
-            return parsed_data
-        else:
-            logging.warning("Parsed JSON does not match the expected structure.")
-            return None
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decoding failed: {e}")
-        return None
+    try:
+        return policy.call(attempt)
+    except Exception as e:
+        log_generation_failure(e, max_retries, "generate the test scenarios")
 
-# Save the model output to the database using the session ID
-def validate_json_structure(data):
+# Stream the model output and hand over every test scenario as soon as it is complete
+def stream_model_on_prompt(model, prompt, on_scenario=None, max_retries=3, stats=None):
     """
-    Validates that the JSON structure matches the expected format defined by Formal-LLM.
-    This ensures the response aligns with the constraints and requirements.
+    Streaming variant of run_model_on_prompt: on_scenario(scenario) is called for every valid scenario
+    as soon as its closing brace arrives, so the UI can render the scenarios progressively.
+    A malformed answer is aborted early; it is regenerated only if no scenario had arrived yet.
+    Returns {"TestScenarios": [...]} or None if all attempts fail.
     """
-    required_keys = {"TestScenarios"}
-    if isinstance(data, dict) and required_keys.issubset(data.keys()):
-        # Additional checks for the structure of each scenario can be implemented here
-        for scenario in data["TestScenarios"]:
-            if not all(key in scenario for key in ["ScenarioID", "Title", "Description", "Objective", "Category", "Comments"]):
-                return False
-        return True
-    return False
+    # Transport errors and invalid outputs each get max_retries attempts
+    policy = RetryPolicy(transport_attempts=max_retries, schema_attempts=max_retries)
+
+    # One attempt: stream the answer and keep the valid test scenarios
+    def attempt():
+        llm = get_llm(model, json_mode=True)
+        return stream_items(llm, prompt, "TestScenarios", SCENARIO_KEYS, TEST_SCENARIOS_SCHEMA, on_scenario, stats)
 
+    try:
+        return policy.call(attempt)
+    except Exception as e:
+        log_generation_failure(e, max_retries, "stream the test scenarios")
 
 # Save the model output to the database using the session ID
 # If each session is running independently and one session is not switched to the next before it is completed, 
 # there is no risk of data being mixed up. Therefore, the existing save_model_output_to_db function will be sufficient.
 def save_model_output_to_db(session_id, model_output, db):
     """
-    Saves the model output to the 'sessions' collection under the specified session ID.
+    Saves the model output of the session: one test_scenarios document per scenario and,
+    if the output has TestCases, one test_cases document per generated test case.
     """
-    collection = db["sessions"]
-    collection.update_one(
-        {"session_id": session_id},  # Match the document with the session_id
-        {"$set": {"model_output": model_output}},  # Update or insert 'model_output' at the root level
-        upsert=True  # Create the document if it doesn't exist
-    )
-
+    save_model_output(session_id, model_output, db)
@@ -0,0 +1,302 @@
+""" This module requests schema-constrained JSON from the LLM, keeps the valid items of partially valid answers and re-requests only the missing ones, with a blocking and a streaming path. """
+
+import json
+import logging
+import os
+import threading
+
+from retry_policy import FATAL_ERROR, SchemaError, classify_error
+
+# Pass the JSON schema as the Ollama "format" (requires Ollama 0.5+); set LLM_STRUCTURED_OUTPUT=0 to fall back to plain JSON mode
+STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "1") != "0"
+
+# Required keys of one test scenario and one test case
+SCENARIO_KEYS = ["ScenarioID", "Title", "Description", "Objective", "Category", "Comments"]
+TEST_CASE_KEYS = ["ScenarioID", "TestCaseID", "Title", "Description", "Objective", "Category", "Comments"]
+
+# Build the JSON schema of an answer that holds a list of items under list_key
+def build_list_schema(list_key, item_keys):
+    """ Returns a JSON schema for {list_key: [{key: string, ...}]} with every item key required. """
+    return {
+        "type": "object",
+        "properties": {
+            list_key: {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {key: {"type": "string"} for key in item_keys},
+                    "required": list(item_keys),
+                },
+            },
+        },
+        "required": [list_key],
+    }
+
+TEST_SCENARIOS_SCHEMA = build_list_schema("TestScenarios", SCENARIO_KEYS)
+TEST_CASES_SCHEMA = build_list_schema("TestCases", TEST_CASE_KEYS)
+
+class GenerationStats:
+    """ Thread-safe counters of the generation requests of one session, shown in the UI. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {
+            "requests": 0,
+            "invalid_responses": 0,
+            "repair_requests": 0,
+            "salvaged_items": 0,
+            "repaired_items": 0,
+        }
+
+    def increment(self, key, amount=1):
+        with self._lock:
+            self._values[key] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+# Check that an item has all required keys
+def is_valid_item(item, item_keys):
+    return isinstance(item, dict) and all(key in item for key in item_keys)
+
+# Parse an answer and split its items into valid and invalid ones
+def parse_items(text, list_key, item_keys):
+    """
+    Parses the JSON answer and returns (items, invalid_items): items is the list under list_key with None
+    in place of every invalid item, invalid_items the invalid items themselves.
+    Raises SchemaError if the answer is not JSON or has no list under list_key.
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise SchemaError(f"Failed to parse JSON from LLM response: {e}")
+    if not isinstance(data, dict) or not isinstance(data.get(list_key), list):
+        raise SchemaError(f"Expected a '{list_key}' list in the LLM response.")
+
+    items, invalid_items = [], []
+    for item in data[list_key]:
+        if is_valid_item(item, item_keys):
+            items.append(item)
+        else:
+            items.append(None)
+            invalid_items.append(item)
+    return items, invalid_items
+
+class IncrementalItemParser:
+    """
+    Incremental parser for a streamed answer of the form {..., list_key: [{...}, {...}], ...}.
+    feed() returns the list elements completed by the chunk, i.e. as soon as their closing brace arrives.
+    A SchemaError is raised at the first character that cannot belong to such an answer, so a malformed
+    answer can be aborted without waiting for the rest of the completion.
+    """
+
+    def __init__(self, list_key, max_preamble=2000):
+        self.list_key = list_key
+        self.max_preamble = max_preamble  # characters allowed before the list starts
+        self.state = "start"  # start -> object -> (key) -> list -> object -> closed
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_chars = None  # characters of the current string at depth 1 (a key candidate)
+        self.last_string = None
+        self.list_done = False
+        self.item_chars = None  # characters of the current list element
+        self.consumed = 0
+
+    def feed(self, chunk):
+        """ Consumes a chunk of the answer and returns the list elements completed by it. """
+        completed = []
+        for char in chunk:
+            self.consumed += 1
+            item = self._feed_char(char)
+            if item is not None:
+                completed.append(item)
+        if self.state != "list" and not self.list_done and self.consumed > self.max_preamble:
+            raise SchemaError(f"No '{self.list_key}' list in the first {self.max_preamble} characters of the answer.")
+        return completed
+
+    def finish(self):
+        """ Raises SchemaError if the answer ended before the list and the object were closed. """
+        if self.state != "closed" or not self.list_done:
+            raise SchemaError(f"The answer ended before the '{self.list_key}' list was complete.")
+
+    def _feed_char(self, char):
+        if self.item_chars is not None:
+            self.item_chars.append(char)
+
+        # Inside a string only the end of the string matters
+        if self.in_string:
+            if self.escape:
+                self.escape = False
+            elif char == "\\":
+                self.escape = True
+            elif char == '"':
+                self.in_string = False
+                if self.string_chars is not None:
+                    self.last_string = "".join(self.string_chars)
+                    self.string_chars = None
+                return None
+            if self.string_chars is not None:
+                self.string_chars.append(char)
+            return None
+
+        if self.state == "start":
+            if char == "{":
+                self.state, self.depth = "object", 1
+            elif not char.isspace():
+                raise SchemaError(f"The answer does not start with a JSON object: {char!r}")
+            return None
+
+        if self.state == "key":
+            # After "list_key": the value must be a list
+            if char == "[":
+                self.state, self.depth = "list", 2
+            elif not char.isspace():
+                raise SchemaError(f"'{self.list_key}' is not a list in the answer.")
+            return None
+
+        if self.state == "list" and self.depth == 2:
+            # Between the list elements only objects, commas and the end of the list are allowed
+            if char == "{":
+                self.item_chars = [char]
+                self.depth = 3
+            elif char == "]":
+                self.state, self.depth, self.list_done = "object", 1, True
+            elif char != "," and not char.isspace():
+                raise SchemaError(f"Unexpected {char!r} between the elements of '{self.list_key}'.")
+            return None
+
+        if self.state == "closed":
+            return None
+
+        if char == '"':
+            self.in_string = True
+            self.string_chars = [] if self.state == "object" and self.depth == 1 else None
+        elif char in "{[":
+            self.depth += 1
+        elif char in "}]":
+            self.depth -= 1
+            if self.state == "list" and self.depth == 2:
+                # A list element is complete
+                text = "".join(self.item_chars)
+                self.item_chars = None
+                try:
+                    return json.loads(text)
+                except json.JSONDecodeError as e:
+                    raise SchemaError(f"Malformed element in '{self.list_key}': {e}")
+            if self.depth == 0:
+                self.state = "closed"
+        elif char == ":" and self.state == "object" and self.depth == 1 and self.last_string == self.list_key:
+            self.state = "key"
+        return None
+
+# Build the follow-up prompt that asks only for the incomplete items
+def build_repair_prompt(prompt, list_key, item_keys, invalid_items):
+    return (
+        f"{prompt}\n\n"
+        f"Your previous answer contained {len(invalid_items)} incomplete item(s) in \"{list_key}\":\n"
+        f"{json.dumps(invalid_items, ensure_ascii=False)}\n\n"
+        f"Return only these {len(invalid_items)} item(s), completed so that each has all of the keys "
+        f"{', '.join(item_keys)}, in the same JSON structure: {{\"{list_key}\": [...]}}"
+    )
+
+# Re-request the incomplete items once and return the ones that came back valid
+def repair_items(llm, prompt, list_key, item_keys, invalid_items, output_format, stats=None):
+    if stats is not None:
+        stats.increment("repair_requests")
+    repaired = []
+    try:
+        resp = llm.complete(build_repair_prompt(prompt, list_key, item_keys, invalid_items), format=output_format)
+        repaired = [item for item in parse_items(resp.text, list_key, item_keys)[0] if item][:len(invalid_items)]
+    except SchemaError as e:
+        logging.warning(f"Repair request returned no valid items: {e}")
+    if stats is not None:
+        stats.increment("repaired_items", len(repaired))
+    return repaired
+
+# Request a list of items from the LLM and re-request only the invalid ones
+def complete_items(llm, prompt, list_key, item_keys, schema, stats=None):
+    """
+    Sends the prompt with the JSON schema as the output format and returns {list_key: [valid items]}.
+    If some items miss required keys, only those are requested again (once); items that are still invalid
+    are dropped. Raises SchemaError if the answer has no valid item at all, so that the retry policy
+    regenerates it.
+    """
+    output_format = schema if STRUCTURED_OUTPUT else "json"
+    if stats is not None:
+        stats.increment("requests")
+    resp = llm.complete(prompt, format=output_format)
+    logging.info(f"Raw response received: {resp.text}")
+
+    try:
+        items, invalid_items = parse_items(resp.text, list_key, item_keys)
+        if not any(items):
+            raise SchemaError(f"No item in '{list_key}' has all required keys.")
+    except SchemaError:
+        if stats is not None:
+            stats.increment("invalid_responses")
+        raise
+
+    if invalid_items:
+        logging.warning(f"{len(invalid_items)} of {len(items)} items miss required keys; re-requesting only those.")
+        if stats is not None:
+            stats.increment("salvaged_items", len(items) - len(invalid_items))
+        repaired = repair_items(llm, prompt, list_key, item_keys, invalid_items, output_format, stats)
+
+        # Put the repaired items in the places of the invalid ones
+        repaired_iter = iter(repaired)
+        items = [item if item else next(repaired_iter, None) for item in items]
+
+    return {list_key: [item for item in items if item]}
+
+# Stream a list of items from the LLM and hand over every valid item as soon as it is complete
+def stream_items(llm, prompt, list_key, item_keys, schema, on_item=None, stats=None):
+    """
+    Streams the answer and calls on_item(item) for every valid item as soon as its closing brace arrives.
+    Returns {list_key: [valid items]}; incomplete items are re-requested once at the end and appended.
+    A malformed answer is aborted at the first character that cannot belong to a valid answer. The items
+    received before the error are kept; without any, SchemaError is raised so that the retry policy
+    regenerates the answer.
+    """
+    output_format = schema if STRUCTURED_OUTPUT else "json"
+    if stats is not None:
+        stats.increment("requests")
+    parser = IncrementalItemParser(list_key)
+    items, invalid_items = [], []
+
+    # Keep a streamed or repaired item and show it if it is valid
+    def accept(item):
+        if is_valid_item(item, item_keys):
+            items.append(item)
+            if on_item is not None:
+                on_item(item)
+        else:
+            invalid_items.append(item)
+
+    stream = llm.stream_complete(prompt, format=output_format)
+    try:
+        for resp in stream:
+            for item in parser.feed(resp.delta or ""):
+                accept(item)
+        parser.finish()
+    except Exception as e:
+        if isinstance(e, SchemaError) and stats is not None:
+            stats.increment("invalid_responses")
+        if not items or classify_error(e) == FATAL_ERROR:
+            raise
+        logging.warning(f"Streamed answer stopped early, keeping the {len(items)} items received: {e}")
+    finally:
+        # Closing the stream closes the HTTP response, so an aborted answer stops using the connection
+        stream.close()
+
+    if invalid_items:
+        logging.warning(f"{len(invalid_items)} streamed items miss required keys; re-requesting only those.")
+        if stats is not None:
+            stats.increment("salvaged_items", len(items))
+        for item in repair_items(llm, prompt, list_key, item_keys, invalid_items, output_format, stats):
+            accept(item)
+
+    if not items:
+        raise SchemaError(f"No item in '{list_key}' has all required keys.")
+    return {list_key: items}
@@ -0,0 +1,22 @@
+""" Tests of the heading detection that decides where document_chunker splits a document. """
+
+import unittest
+
+from document_chunker import HEADING_PATTERN, split_blocks
+
+class HeadingPatternTest(unittest.TestCase):
+
+    def test_all_caps_titles_and_keywords_are_headings(self):
+        for line in ("SYSTEM REQUIREMENTS", "LOGIN & LOGOUT", "Chapter 2", "SECTION 4", "bölüm 3", "# Overview", "3.1 Login"):
+            self.assertIsNotNone(HEADING_PATTERN.match(line), line)
+
+    def test_short_ordinary_lines_are_not_headings(self):
+        for line in ("The user logs in", "Login fails", "Password is reset"):
+            self.assertIsNone(HEADING_PATTERN.match(line), line)
+
+    def test_paragraph_of_short_lines_stays_one_block(self):
+        document = "LOGIN\nThe user logs in\nLogin fails\nPassword is reset"
+        self.assertEqual(split_blocks(document), [(True, document)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,379 @@
+"""
+This script runs a minimal stand-in for the Ollama HTTP API, used to benchmark and try both tools without a real model.
+
+Usage:
+    python tools/stub_ollama.py --port 11435
+    OLLAMA_HOST=http://127.0.0.1:11435 streamlit run app.py
+
+It answers /api/chat, /api/generate (blocking, or streamed as NDJSON) and /api/show. Answers are built from
+the request:
+- A JSON schema format with "results", "assignments" or "is_same" (the Smart Selection judge) gets a list with
+  one item per "UniqueCase N:" / "TestCase N:" block of the user message, or a single verdict; is_same is always false.
+- Other JSON requests are answered from the prompt content (custom test prompt, judge controls, test cases or
+  test scenarios); requests without a format get a short text.
+
+Latency is simulated with a small cost model:
+- every new TCP connection costs --connect-ms and every request --latency-ms,
+- a model that is not loaded, or whose keep_alive has expired, adds --load-ms,
+- the part of the prompt that is not a common prefix with the model's previous prompt (KV cache) adds
+  --prefill-ms-per-kchar per 1000 characters,
+- every generated token (about 4 characters, capped by num_predict) adds --decode-ms-per-token.
+A streamed answer spreads this time over its chunks, so connection reuse and streaming are visible.
+
+Faults can be injected to exercise the retry policy: --fail-rate answers a share of the requests with
+HTTP 503. For a share of the plain JSON-mode requests, --bad-json-rate truncates the JSON, --partial-rate
+drops a required key from one item and --prose-rate puts a sentence before the JSON. Requests with a
+JSON schema as the format are answered without JSON faults, like Ollama's structured outputs.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 11435
+DEFAULT_KEEP_ALIVE_SECONDS = 300  # Ollama's default (5m)
+
+UNIQUE_CASE_PATTERN = re.compile(r"^UniqueCase (\d+):", re.MULTILINE)
+CLUSTER_CASE_PATTERN = re.compile(r"^TestCase (\d+):", re.MULTILINE)
+
+# Convert a keep_alive value ("30m", "10s", 300, "-1") to seconds; a negative value means forever
+def parse_keep_alive(value):
+    if value is None:
+        return DEFAULT_KEEP_ALIVE_SECONDS
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+def common_prefix_length(first, second):
+    length = min(len(first), len(second))
+    for index in range(length):
+        if first[index] != second[index]:
+            return index
+    return length
+
+# Render chat messages as the single text the model sees (a simplified chat template)
+def render_prompt(messages):
+    return "".join(f"<|{message.get('role')}|>{message.get('content', '')}\n" for message in messages)
+
+# Drop one key of one item of the first list in a JSON answer
+def drop_item_key(content, rng):
+    data = json.loads(content)
+    items = next(value for value in data.values() if isinstance(value, list))
+    item = rng.choice(items)
+    item.pop(rng.choice(sorted(item)))
+    return json.dumps(data)
+
+# Build the answer of a Smart Selection judge request from its schema, or None for other requests
+def build_selection_content(schema, user_content):
+    """ Returns a list with one item per numbered case of the user message, or a single verdict. """
+    properties = schema.get("properties", {}) if isinstance(schema, dict) else {}
+    if "results" in properties:
+        count = len(UNIQUE_CASE_PATTERN.findall(user_content))
+        return json.dumps({"results": [{"index": index, "is_same": False} for index in range(count)]})
+    if "assignments" in properties:
+        count = len(CLUSTER_CASE_PATTERN.findall(user_content))
+        return json.dumps({"assignments": [{"index": index, "group": index} for index in range(count)]})
+    if "is_same" in properties:
+        return json.dumps({"is_same": False})
+    return None
+
+# Build a JSON answer that matches what the calling module expects
+def build_content(prompt, json_mode, items=3):
+    """ Returns the stub answer for a scenario/test case generator prompt. """
+    if not json_mode:
+        return "Functional Tests\nSuitability: High\nExplanation: Stub analysis of the document content."
+    if "custom_test_prompt" in prompt:
+        return json.dumps({"custom_test_prompt": "Generate test scenarios for the uploaded document."})
+    if '"Controls"' in prompt:
+        return json.dumps({"Controls": [
+            {"ControlID": str(index), "Title": f"Control {index}", "Evaluation": True, "Comments": ""}
+            for index in range(1, items + 1)
+        ]})
+    if '"TestCases"' in prompt:
+        return json.dumps({"TestCases": [
+            {
+                "ScenarioID": "Scenario_1",
+                "TestCaseID": f"TestCase_{index}",
+                "Title": f"Stub test case {index}",
+                "Description": "Stub description of the test case.",
+                "Objective": "Stub objective.",
+                "Category": "Functional Tests",
+                "Comments": ""
+            }
+            for index in range(1, items + 1)
+        ]})
+    # Scenarios of different document parts get different titles
+    part = re.search(r"Part (\d+) of \d+ of the document", prompt)
+    suffix = f" (part {part.group(1)})" if part else ""
+    return json.dumps({"TestScenarios": [
+        {
+            "ScenarioID": f"Stub_Test_Scenario_{index}",
+            "Title": f"Stub scenario {index}{suffix}",
+            "Description": "Stub description of the test scenario.",
+            "Objective": "Stub objective.",
+            "Category": "Functional Tests",
+            "Comments": ""
+        }
+        for index in range(1, items + 1)
+    ]})
+
+class StubStats:
+    """ Counters shared by all handler threads. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {
+            "connections": 0, "requests": 0, "show": 0, "failed": 0, "bad_json": 0, "partial": 0, "prose": 0,
+            "aborted": 0, "loads": 0, "prompt_chars": 0, "prefilled_chars": 0,
+        }
+
+    def increment(self, key, amount=1):
+        with self.lock:
+            self.values[key] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+class StubModelState:
+    """ Load state and last processed prompt (KV cache) of every model. """
+
+    def __init__(self, load_ms, prefill_ms_per_kchar, decode_ms_per_token, stats):
+        self.load_ms = load_ms
+        self.prefill_ms_per_kchar = prefill_ms_per_kchar
+        self.decode_ms_per_token = decode_ms_per_token
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.expires_at = {}  # model -> time.monotonic() until which it stays loaded
+        self.cached_prompt = {}  # model -> last processed prompt
+
+    def process(self, model, prompt, keep_alive, output_tokens):
+        """ Returns the simulated (load ms, prefill ms, decode ms, prefilled characters) of a request. """
+        now = time.monotonic()
+        with self.lock:
+            load = 0.0
+            if self.expires_at.get(model, 0) < now:
+                load = self.load_ms
+                self.cached_prompt.pop(model, None)
+                self.stats.increment("loads")
+
+            keep_alive_seconds = parse_keep_alive(keep_alive)
+            self.expires_at[model] = float("inf") if keep_alive_seconds < 0 else now + keep_alive_seconds
+
+            prefilled = len(prompt) - common_prefix_length(self.cached_prompt.get(model, ""), prompt)
+            self.cached_prompt[model] = prompt
+        self.stats.increment("prompt_chars", len(prompt))
+        self.stats.increment("prefilled_chars", prefilled)
+
+        prefill = prefilled / 1000 * self.prefill_ms_per_kchar
+        decode = output_tokens * self.decode_ms_per_token
+        return load, prefill, decode, prefilled
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests like the real server
+    protocol_version = "HTTP/1.1"
+    connect_ms = 0.0
+    latency_ms = 0.0
+    items = 3
+    fail_rate = 0.0
+    bad_json_rate = 0.0
+    partial_rate = 0.0
+    prose_rate = 0.0
+    random = None
+    stats = None
+    state = None
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stats.increment("connections")
+        time.sleep(self.connect_ms / 1000)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            self.send_json(200, {"version": "0.0.0-stub"})
+        elif self.path == "/stats":
+            self.send_json(200, self.stats.snapshot())
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if self.path == "/api/show":
+            self.stats.increment("show")
+            self.send_json(200, {"model_info": {"llama.context_length": 8192}, "details": {}, "parameters": ""})
+            return
+        if self.path == "/api/chat":
+            messages = request.get("messages", [])
+        elif self.path == "/api/generate":
+            messages = [{"role": "user", "content": request.get("prompt", "")}] if request.get("prompt") else []
+        else:
+            self.send_json(404, {"error": "not found"})
+            return
+
+        self.stats.increment("requests")
+        if self.random.random() < self.fail_rate:
+            self.stats.increment("failed")
+            self.send_json(503, {"error": "stub: injected server failure"})
+            return
+
+        output_format = request.get("format")
+        user_content = next((message.get("content", "") for message in reversed(messages) if message.get("role") == "user"), "")
+        content = build_selection_content(output_format, user_content)
+        if content is None:
+            content = build_content("\n".join(message.get("content", "") for message in messages), bool(output_format), self.items)
+        if not messages:
+            # An empty generate request only loads the model
+            content = ""
+        if output_format == "json":
+            roll = self.random.random()
+            if roll < self.bad_json_rate:
+                self.stats.increment("bad_json")
+                content = content[:len(content) // 2]
+            elif roll < self.bad_json_rate + self.partial_rate:
+                self.stats.increment("partial")
+                content = drop_item_key(content, self.random)
+            elif roll < self.bad_json_rate + self.partial_rate + self.prose_rate:
+                self.stats.increment("prose")
+                content = "Sure! Here are the test scenarios you asked for:\n" + content
+
+        num_predict = (request.get("options") or {}).get("num_predict")
+        output_tokens = max(1, len(content) // 4) if content else 0
+        if num_predict is not None and num_predict >= 0:
+            output_tokens = min(output_tokens, num_predict)
+        prompt = render_prompt(messages) if self.path == "/api/chat" else request.get("prompt", "")
+        load, prefill, decode, prefilled = self.state.process(request.get("model", ""), prompt, request.get("keep_alive"), output_tokens)
+        timings = {
+            "duration_ms": self.latency_ms + load + prefill + decode,
+            "load_ms": load,
+            "prefill_ms": prefill,
+            "decode_ms": decode,
+            "prompt_eval_count": prefilled // 4,
+            "eval_count": output_tokens,
+        }
+
+        if request.get("stream"):
+            self.send_stream(request, content, timings)
+        else:
+            time.sleep(timings["duration_ms"] / 1000)
+            self.send_json(200, self.build_payload(request, content, timings))
+
+    def build_payload(self, request, content, timings=None):
+        """ Returns an answer (or stream chunk) payload; timings marks the final one. """
+        payload = {
+            "model": request.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "done": timings is not None,
+        }
+        if timings is not None:
+            payload.update({
+                "done_reason": "stop",
+                "total_duration": int(timings["duration_ms"] * 1e6),
+                "load_duration": int(timings["load_ms"] * 1e6),
+                "prompt_eval_count": timings["prompt_eval_count"],
+                "prompt_eval_duration": int(timings["prefill_ms"] * 1e6),
+                "eval_count": timings["eval_count"],
+                "eval_duration": int(timings["decode_ms"] * 1e6),
+            })
+        if self.path == "/api/chat":
+            payload["message"] = {"role": "assistant", "content": content}
+        else:
+            payload["response"] = content
+        return payload
+
+    def send_stream(self, request, content, timings, chunk_chars=16):
+        """ Streams the answer as NDJSON chunks and spreads the simulated duration over them like token generation. """
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        pieces = [content[index:index + chunk_chars] for index in range(0, len(content), chunk_chars)]
+        delay = timings["duration_ms"] / 1000 / max(1, len(pieces))
+        lines = [self.build_payload(request, piece) for piece in pieces]
+        lines.append(self.build_payload(request, "", timings))
+        try:
+            for line in lines:
+                time.sleep(delay)
+                body = (json.dumps(line) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(body):X}\r\n".encode("ascii") + body + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (e.g. aborted a malformed answer)
+            self.stats.increment("aborted")
+            self.close_connection = True
+
+# Create the stub server (port 0 picks a free port); run it with serve_forever()
+def create_server(host="127.0.0.1", port=DEFAULT_PORT, connect_ms=20.0, latency_ms=50.0, items=3,
+                  fail_rate=0.0, bad_json_rate=0.0, partial_rate=0.0, prose_rate=0.0, seed=None,
+                  load_ms=0.0, prefill_ms_per_kchar=0.0, decode_ms_per_token=0.0):
+    stats = StubStats()
+    handler = type("Handler", (StubOllamaHandler,), {
+        "connect_ms": connect_ms,
+        "latency_ms": latency_ms,
+        "items": items,
+        "fail_rate": fail_rate,
+        "bad_json_rate": bad_json_rate,
+        "partial_rate": partial_rate,
+        "prose_rate": prose_rate,
+        "random": random.Random(seed),
+        "stats": stats,
+        "state": StubModelState(load_ms, prefill_ms_per_kchar, decode_ms_per_token, stats),
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+def main():
+    parser = argparse.ArgumentParser(description="Minimal stand-in for the Ollama HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("STUB_OLLAMA_PORT", DEFAULT_PORT)))
+    parser.add_argument("--connect-ms", type=float, default=20.0, help="simulated cost of a new connection")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated fixed time per request")
+    parser.add_argument("--load-ms", type=float, default=0.0, help="simulated model load time")
+    parser.add_argument("--prefill-ms-per-kchar", type=float, default=0.0, help="simulated prompt processing cost")
+    parser.add_argument("--decode-ms-per-token", type=float, default=0.0, help="simulated generation cost")
+    parser.add_argument("--items", type=int, default=3, help="scenarios/test cases/controls per JSON answer")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with HTTP 503")
+    parser.add_argument("--bad-json-rate", type=float, default=0.0, help="share of JSON answers that are truncated")
+    parser.add_argument("--partial-rate", type=float, default=0.0, help="share of JSON answers with one item missing a key")
+    parser.add_argument("--prose-rate", type=float, default=0.0, help="share of JSON answers that start with prose")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the injected faults")
+    args = parser.parse_args()
+
+    server = create_server(
+        args.host, args.port, args.connect_ms, args.latency_ms, args.items, args.fail_rate, args.bad_json_rate,
+        args.partial_rate, args.prose_rate, args.seed, args.load_ms, args.prefill_ms_per_kchar, args.decode_ms_per_token
+    )
+    print(f"Stub Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()